@@ -1,13 +1,27 @@
 ﻿from __future__ import annotations
 
+import asyncio
 import json
-from typing import Any, Dict
+import random
+from typing import Any, Dict, Tuple
 
+import httpx
 import jsonpatch
-import requests
 from fastapi import HTTPException
 
-from .config import GEMINI_API_KEY, MODEL_NAME
+from .ai_cache import ai_cache_key, ai_response_cache
+from .config import (
+    AI_BASE_URL,
+    AI_MAX_CONCURRENCY,
+    AI_MAX_RETRIES,
+    AI_RETRY_BACKOFF_SECONDS,
+    AI_TIMEOUT_SECONDS,
+    DEFAULT_USER_ID,
+    GEMINI_API_KEY,
+    MODEL_NAME,
+)
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
 
 SYSTEM_PROMPT = """
 You are the AI assistant for a personal routine manager.
@@ -43,6 +57,42 @@ Data model hints:
 """
 
 
+ALWAYS_SENT_SLICES = ("rules", "conditions")
+
+CORE_TASK_FIELDS = ("id", "slot", "type")
+
+SPEC_SLICE_KEYWORDS: Dict[str, Tuple[str, ...]] = {
+    "products": tuple(
+        "product 제품 serum 세럼 ampoule 앰플 cream 크림 toner 토너 sunscreen 선크림 "
+        "makeup 메이크업 all_in_one 올인원".split()
+    ),
+    "taskDefinitions": tuple(
+        "task routine 루틴 card 카드 step 단계 slot shower 샤워 scalp 두피 mask 마스크 "
+        "supp 영양제 interval 주기 weekday 요일".split()
+    ),
+}
+
+
+def select_spec_slices(spec: Dict[str, Any], user_instruction: str) -> Dict[str, Any]:
+    # Top-level sections are kept or dropped whole so JSON Patch array indexes
+    # stay valid against the full spec.
+    text = user_instruction.lower()
+    wanted = {
+        key
+        for key, keywords in SPEC_SLICE_KEYWORDS.items()
+        if any(keyword in text for keyword in keywords)
+    }
+    wanted.update(ALWAYS_SENT_SLICES)
+    sliced = {key: value for key, value in spec.items() if key in wanted}
+    if "taskDefinitions" not in sliced and "taskDefinitions" in spec:
+        # Unmatched instructions still see which tasks exist, in spec order.
+        sliced["taskDefinitions"] = [
+            {field: task[field] for field in CORE_TASK_FIELDS if field in task}
+            for task in spec["taskDefinitions"]
+        ]
+    return sliced
+
+
 def _extract_json(text: str) -> Dict[str, Any]:
     start = text.find("{")
     end = text.rfind("}")
@@ -51,11 +101,77 @@ def _extract_json(text: str) -> Dict[str, Any]:
     return json.loads(text[start : end + 1])
 
 
-def generate_ai_patch(
+class _ProviderClient:
+    def __init__(self, transport: httpx.AsyncBaseTransport | None = None) -> None:
+        self.loop = asyncio.get_running_loop()
+        self.semaphore = asyncio.Semaphore(AI_MAX_CONCURRENCY)
+        self.http = httpx.AsyncClient(
+            base_url=AI_BASE_URL,
+            timeout=httpx.Timeout(AI_TIMEOUT_SECONDS, connect=5.0),
+            limits=httpx.Limits(
+                max_connections=AI_MAX_CONCURRENCY,
+                max_keepalive_connections=AI_MAX_CONCURRENCY,
+            ),
+            transport=transport,
+        )
+
+
+_client: _ProviderClient | None = None
+_transport: httpx.AsyncBaseTransport | None = None
+
+
+def set_ai_transport(transport: httpx.AsyncBaseTransport | None) -> None:
+    # Lets tests route provider calls to a local fake server.
+    global _client, _transport
+    _transport = transport
+    _client = None
+
+
+def _get_client() -> _ProviderClient:
+    global _client
+    loop = asyncio.get_running_loop()
+    if _client is None or _client.loop is not loop:
+        _client = _ProviderClient(_transport)
+    return _client
+
+
+async def close_ai_client() -> None:
+    global _client
+    if _client is not None and _client.loop is asyncio.get_running_loop():
+        await _client.http.aclose()
+    _client = None
+
+
+async def _send(client: _ProviderClient, path: str, payload: Dict[str, Any]) -> httpx.Response:
+    async with client.semaphore:
+        return await client.http.post(path, json=payload)
+
+
+async def _post_with_retry(path: str, payload: Dict[str, Any]) -> httpx.Response:
+    client = _get_client()
+    for attempt in range(AI_MAX_RETRIES):
+        try:
+            response = await _send(client, path, payload)
+        except httpx.TransportError:
+            pass
+        else:
+            if response.status_code not in RETRYABLE_STATUS:
+                return response
+        delay = AI_RETRY_BACKOFF_SECONDS * (2**attempt)
+        await asyncio.sleep(delay + random.uniform(0, delay / 2))
+
+    try:
+        return await _send(client, path, payload)
+    except httpx.TransportError as exc:
+        raise HTTPException(status_code=502, detail="AI provider unreachable") from exc
+
+
+async def generate_ai_patch(
     user_instruction: str,
     current_spec: Dict[str, Any],
     api_key: str | None = None,
     model_name: str | None = None,
+    user_id: str = DEFAULT_USER_ID,
 ) -> Dict[str, Any]:
     api_key = api_key or GEMINI_API_KEY
     model_name = model_name or MODEL_NAME
@@ -65,6 +181,11 @@ def generate_ai_patch(
             "summary": "AI not configured. Set GEMINI_API_KEY and MODEL_NAME.",
         }
 
+    cache_key = ai_cache_key(user_id, model_name, SYSTEM_PROMPT, user_instruction, current_spec)
+    cached = await ai_response_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
     prompt = (
         f"{SYSTEM_PROMPT}\n"
         "Use paths relative to currentSpec.\n\n"
@@ -72,16 +193,13 @@ def generate_ai_patch(
         f"currentSpec: {json.dumps(current_spec, ensure_ascii=False)}"
     )
 
-    url = (
-        "https://generativelanguage.googleapis.com/v1beta/models/"
-        f"{model_name}:generateContent?key={api_key}"
-    )
+    path = f"/v1beta/models/{model_name}:generateContent?key={api_key}"
     payload = {
         "contents": [{"role": "user", "parts": [{"text": prompt}]}],
         "generationConfig": {"temperature": 0.2},
     }
 
-    response = requests.post(url, json=payload, timeout=30)
+    response = await _post_with_retry(path, payload)
     if response.status_code != 200:
         raise HTTPException(status_code=502, detail="AI provider error")
 
@@ -106,4 +224,6 @@ def generate_ai_patch(
     except Exception as exc:  # pragma: no cover - defensive
         raise HTTPException(status_code=400, detail="Invalid JSON Patch") from exc
 
-    return {"jsonPatch": json_patch, "summary": summary}
+    result = {"jsonPatch": json_patch, "summary": summary}
+    await ai_response_cache.set(cache_key, result)
+    return result
@@ -0,0 +1,118 @@
+﻿from __future__ import annotations
+
+import copy
+import hashlib
+import json
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Optional, Tuple
+
+from anyio import to_thread
+from sqlmodel import Session, col, delete, select
+
+from .cache import LRUCache
+from .config import AI_CACHE_MAX_ENTRIES, AI_CACHE_PERSIST, AI_CACHE_TTL_SECONDS
+from .db import engine
+from .models import AiCacheEntry
+
+
+def ai_cache_key(
+    user_id: str,
+    model_name: str,
+    system_prompt: str,
+    user_instruction: str,
+    spec: Dict[str, Any],
+) -> str:
+    canonical = json.dumps(
+        [user_id, model_name, system_prompt, user_instruction.strip(), spec],
+        sort_keys=True,
+        separators=(",", ":"),
+        ensure_ascii=False,
+    )
+    return f"{user_id}:{hashlib.sha256(canonical.encode('utf-8')).hexdigest()}"
+
+
+class AiResponseCache:
+    def __init__(self, maxsize: int, ttl_seconds: float, persist: bool) -> None:
+        self.maxsize = maxsize
+        self.ttl_seconds = ttl_seconds
+        self.persist = persist
+        self.hits: Counter[str] = Counter()
+        self.misses: Counter[str] = Counter()
+        self._entries: LRUCache[Tuple[float, Dict[str, Any]]] = LRUCache(maxsize)
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        user_id = _key_owner(key)
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > time.time():
+            self.hits[user_id] += 1
+            return copy.deepcopy(entry[1])
+
+        if self.persist:
+            stored = await to_thread.run_sync(self._load, key)
+            if stored is not None:
+                expires_at, value = stored
+                self._entries.set(key, (expires_at, value))
+                self.hits[user_id] += 1
+                return copy.deepcopy(value)
+
+        self.misses[user_id] += 1
+        return None
+
+    async def set(self, key: str, value: Dict[str, Any]) -> None:
+        value = copy.deepcopy(value)
+        self._entries.set(key, (time.time() + self.ttl_seconds, value))
+        if self.persist:
+            await to_thread.run_sync(self._store, key, value)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.hits.clear()
+        self.misses.clear()
+
+    def stats(self, user_id: str) -> Dict[str, int]:
+        size = sum(1 for key in self._entries.keys() if _key_owner(key) == user_id)
+        return {"hits": self.hits[user_id], "misses": self.misses[user_id], "size": size}
+
+    def _load(self, key: str) -> Optional[Tuple[float, Dict[str, Any]]]:
+        with Session(engine) as session:
+            row = session.get(AiCacheEntry, key)
+            if row is None:
+                return None
+            created_at = row.created_at
+            if created_at.tzinfo is None:
+                created_at = created_at.replace(tzinfo=timezone.utc)
+            expires_at = created_at.timestamp() + self.ttl_seconds
+            if expires_at <= time.time():
+                return None
+            return expires_at, row.response
+
+    def _store(self, key: str, value: Dict[str, Any]) -> None:
+        now = datetime.now(timezone.utc)
+        with Session(engine) as session:
+            session.exec(
+                delete(AiCacheEntry).where(
+                    AiCacheEntry.created_at < now - timedelta(seconds=self.ttl_seconds)
+                )
+            )
+            session.merge(AiCacheEntry(key=key, response=value, created_at=now))
+            session.flush()
+            newest = (
+                select(AiCacheEntry.key)
+                .order_by(col(AiCacheEntry.created_at).desc())
+                .limit(self.maxsize)
+            )
+            session.exec(delete(AiCacheEntry).where(col(AiCacheEntry.key).not_in(newest)))
+            session.commit()
+
+
+def _key_owner(key: str) -> str:
+    return key.split(":", 1)[0]
+
+
+ai_response_cache = AiResponseCache(
+    maxsize=AI_CACHE_MAX_ENTRIES,
+    ttl_seconds=AI_CACHE_TTL_SECONDS,
+    persist=AI_CACHE_PERSIST,
+)
@@ -0,0 +1,360 @@
+﻿from __future__ import annotations
+
+import os
+import tempfile
+
+# Standalone runs get a throwaway database; the app reads DATABASE_URL on import.
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/routine-bench.db")
+
+import argparse
+import importlib.util
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from ..history import EVENT_COMPLETE
+from ..rule_plan import compile_rule_plan
+from ..scheduler import _is_due, build_range_cards, build_task_steps, build_today_cards
+from .synthetic import (
+    make_history_events,
+    make_status_and_history,
+    make_task_definitions,
+    seed_rules,
+    write_seed_file,
+)
+
+DEFAULT_SIZES = (10, 100, 1000, 10000)
+DEFAULT_API_SIZES = (10, 1000)
+DEFAULT_SEED_PRODUCTS = 20000
+DEFAULT_DUE_MATRIX_TASKS = 10000
+TARGET_DATE = date(2026, 1, 4)
+
+
+def _timed(func: Callable[[], Any], min_seconds: float) -> Dict[str, float]:
+    samples: List[float] = []
+    deadline = time.perf_counter() + min_seconds
+    while not samples or time.perf_counter() < deadline:
+        started = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - started)
+    return {
+        "runs": len(samples),
+        "mean_ms": statistics.fmean(samples) * 1000,
+        "min_ms": min(samples) * 1000,
+        "ops_per_sec": len(samples) / sum(samples),
+    }
+
+
+def _peak_memory_kib(func: Callable[[], Any]) -> float:
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak / 1024
+
+
+def _percentiles(samples: Sequence[float]) -> Dict[str, float]:
+    ordered = sorted(samples)
+
+    def pick(fraction: float) -> float:
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * 1000
+
+    return {"p50_ms": pick(0.50), "p95_ms": pick(0.95), "p99_ms": pick(0.99), "max_ms": pick(1.0)}
+
+
+def bench_scheduler(
+    size: int, history_days: int, range_days: int, min_seconds: float
+) -> Dict[str, Any]:
+    rules, conditions = seed_rules()
+    plan = compile_rule_plan(rules, conditions)
+    task_defs = make_task_definitions(size)
+    status_map, history = make_status_and_history(task_defs, TARGET_DATE, history_days)
+    range_end = TARGET_DATE + timedelta(days=range_days - 1)
+    skin_am = next(task_def for task_def in task_defs if task_def.id == "skin_am")
+
+    def today() -> None:
+        build_today_cards(task_defs, status_map, plan, conditions, {}, TARGET_DATE, history)
+
+    def range_cards() -> None:
+        build_range_cards(
+            task_defs,
+            status_map,
+            plan,
+            conditions,
+            {},
+            TARGET_DATE,
+            range_end,
+            project_from=TARGET_DATE,
+            history=history,
+        )
+
+    def steps() -> None:
+        build_task_steps(skin_am, plan, conditions, {}, TARGET_DATE, None)
+
+    return {
+        "size": size,
+        "history_days": history_days,
+        "range_days": range_days,
+        "build_today_cards": _timed(today, min_seconds),
+        "build_range_cards": _timed(range_cards, min_seconds),
+        "build_task_steps": _timed(steps, min_seconds),
+        "range_peak_kib": _peak_memory_kib(range_cards),
+    }
+
+
+def _prepare_api_user(size: int, history_days: int) -> str:
+    from sqlmodel import Session
+
+    from ..cache import bump_state_version
+    from ..db import engine
+    from ..due_index import record_completion
+    from ..models import TaskDefinition, TaskEvent, TaskStatus
+    from ..tenants import provision_tenant
+
+    user_id = f"bench-{size}"
+    task_defs = [
+        task_def
+        for task_def in make_task_definitions(size)
+        if task_def.id.startswith("bench_")
+    ]
+    events = make_history_events(task_defs, TARGET_DATE, history_days)
+    occurred_at = datetime.now(timezone.utc)
+    with Session(engine) as session:
+        provision_tenant(session, user_id)
+        for task_def in task_defs:
+            session.merge(
+                TaskDefinition(
+                    user_id=user_id,
+                    id=task_def.id,
+                    slot=task_def.slot,
+                    task_type=task_def.task_type,
+                    steps=task_def.steps,
+                    interval_days=task_def.interval_days,
+                    cron_weekdays=task_def.cron_weekdays,
+                )
+            )
+        session.flush()
+        session.connection().execute(
+            TaskEvent.__table__.insert(),
+            [
+                {
+                    "user_id": user_id,
+                    "task_definition_id": task_definition_id,
+                    "kind": kind,
+                    "instance_date": day,
+                    "occurred_at": occurred_at,
+                }
+                for task_definition_id, kind, day in events
+                if kind == EVENT_COMPLETE
+            ],
+        )
+        intervals = {task_def.id: task_def.interval_days for task_def in task_defs}
+        statuses: Dict[str, TaskStatus] = {}
+        for task_definition_id, kind, day in events:
+            if kind != EVENT_COMPLETE:
+                continue
+            status = statuses.get(task_definition_id)
+            if status is None:
+                status = statuses[task_definition_id] = TaskStatus(
+                    user_id=user_id, task_definition_id=task_definition_id
+                )
+            record_completion(status, intervals[task_definition_id], day)
+        for status in statuses.values():
+            session.merge(status)
+        bump_state_version(session, user_id)
+        session.commit()
+    return user_id
+
+
+def bench_api(size: int, history_days: int, requests: int) -> Dict[str, Any]:
+    from fastapi.testclient import TestClient
+
+    from ..main import app
+
+    with TestClient(app) as client:
+        user_id = f"bench-{size}"
+        headers = {"X-User-Id": user_id}
+        _prepare_api_user(size, history_days)
+
+        def get_today(day: date) -> None:
+            client.get(
+                "/api/today", params={"date": day.isoformat()}, headers=headers
+            ).raise_for_status()
+
+        def measure(dates: Sequence[date]) -> Dict[str, float]:
+            samples = []
+            for day in dates:
+                started = time.perf_counter()
+                get_today(day)
+                samples.append(time.perf_counter() - started)
+            return _percentiles(samples)
+
+        def allocations(dates: Sequence[date]) -> Dict[str, float]:
+            # Peak traced memory above the starting point, per request.
+            peaks = []
+            tracemalloc.start()
+            try:
+                for day in dates:
+                    baseline = tracemalloc.get_traced_memory()[0]
+                    tracemalloc.reset_peak()
+                    get_today(day)
+                    peaks.append(tracemalloc.get_traced_memory()[1] - baseline)
+            finally:
+                tracemalloc.stop()
+            return {
+                "mean_peak_kib": statistics.fmean(peaks) / 1024,
+                "max_peak_kib": max(peaks) / 1024,
+            }
+
+        cold_dates = [TARGET_DATE + timedelta(days=offset) for offset in range(requests)]
+        alloc_dates = [day - timedelta(days=requests) for day in cold_dates]
+        return {
+            "size": size,
+            "history_days": history_days,
+            "requests": requests,
+            "today_uncached": measure(cold_dates),
+            "today_cached": measure([TARGET_DATE] * requests),
+            "today_uncached_alloc": allocations(alloc_dates),
+        }
+
+
+def bench_seed_import(products: int, task_definitions: int) -> Dict[str, Any]:
+    from pathlib import Path
+
+    from sqlmodel import Session
+
+    from ..db import engine
+    from ..migrations import init_db
+    from ..seed import import_seed
+
+    init_db()
+    with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory) / "seed.json"
+        write_seed_file(path, products, task_definitions)
+        size_bytes = path.stat().st_size
+        user_id = f"bench-seed-{time.time_ns()}"
+        started = time.perf_counter()
+        with Session(engine) as session:
+            counts = import_seed(session, user_id, path)
+            session.commit()
+        elapsed = time.perf_counter() - started
+
+    rows = counts["products"] + counts["taskDefinitions"]
+    return {
+        "products": products,
+        "task_definitions": task_definitions,
+        "file_bytes": size_bytes,
+        "seconds": elapsed,
+        "rows_per_sec": rows / elapsed if elapsed else None,
+    }
+
+
+def bench_due_matrix(tasks: int, days: int, min_seconds: float) -> Optional[Dict[str, Any]]:
+    if importlib.util.find_spec("numpy") is None:
+        return None
+    from ..vectorized import date_ordinals, due_matrix, task_columns
+
+    task_defs = make_task_definitions(tasks)
+    status_map, _ = make_status_and_history(task_defs, TARGET_DATE, 30)
+    dates = [TARGET_DATE + timedelta(days=offset) for offset in range(days)]
+    ordinals = date_ordinals(dates)
+
+    def vectorized() -> None:
+        due_matrix(*task_columns(task_defs, status_map), ordinals)
+
+    def scalar() -> None:
+        for task_def in task_defs:
+            status = status_map[task_def.id]
+            for day in dates:
+                _is_due(task_def, status, day)
+
+    return {
+        "tasks": tasks,
+        "days": days,
+        "vectorized": _timed(vectorized, min_seconds),
+        "scalar": _timed(scalar, 0),
+    }
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        result = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return result.stdout.strip()
+
+
+def run(
+    sizes: Sequence[int] = DEFAULT_SIZES,
+    api_sizes: Sequence[int] = DEFAULT_API_SIZES,
+    history_days: int = 730,
+    range_days: int = 31,
+    requests: int = 100,
+    min_seconds: float = 0.5,
+    seed_products: int = DEFAULT_SEED_PRODUCTS,
+    due_matrix_tasks: int = DEFAULT_DUE_MATRIX_TASKS,
+) -> Dict[str, Any]:
+    return {
+        "meta": {
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+        },
+        "scheduler": [
+            bench_scheduler(size, history_days, range_days, min_seconds) for size in sizes
+        ],
+        "api": [bench_api(size, history_days, requests) for size in api_sizes],
+        "seed_import": bench_seed_import(seed_products, max(1, seed_products // 10)),
+        "due_matrix": bench_due_matrix(due_matrix_tasks, 365, min_seconds),
+    }
+
+
+def _sizes(value: str) -> List[int]:
+    return [int(item) for item in value.split(",") if item]
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Scheduler and /api/today benchmarks")
+    parser.add_argument("--sizes", type=_sizes, default=list(DEFAULT_SIZES))
+    parser.add_argument("--api-sizes", type=_sizes, default=list(DEFAULT_API_SIZES))
+    parser.add_argument("--history-days", type=int, default=730)
+    parser.add_argument("--range-days", type=int, default=31)
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--min-seconds", type=float, default=0.5)
+    parser.add_argument("--seed-products", type=int, default=DEFAULT_SEED_PRODUCTS)
+    parser.add_argument("--due-matrix-tasks", type=int, default=DEFAULT_DUE_MATRIX_TASKS)
+    parser.add_argument("--output", help="Write JSON here instead of stdout")
+    args = parser.parse_args(argv)
+
+    results = run(
+        sizes=args.sizes,
+        api_sizes=args.api_sizes,
+        history_days=args.history_days,
+        range_days=args.range_days,
+        requests=args.requests,
+        min_seconds=args.min_seconds,
+        seed_products=args.seed_products,
+        due_matrix_tasks=args.due_matrix_tasks,
+    )
+    payload = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as handle:
+            handle.write(payload + "\n")
+    else:
+        sys.stdout.write(payload + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,122 @@
+﻿from __future__ import annotations
+
+import json
+import random
+from datetime import date, datetime, time, timedelta
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+from ..config import SEED_PATH, TIMEZONE
+from ..history import EVENT_COMPLETE, EVENT_SKIP, TaskHistory
+from ..models import TaskDefinition, TaskStatus
+from ..seed import DEFAULT_CONDITIONS, _read_seed
+
+EXTRA_SLOTS = ("AM", "PM", "SHOWER", "SUPP")
+
+
+def seed_rules() -> Tuple[Dict[str, Any], Dict[str, bool]]:
+    data = _read_seed(SEED_PATH)
+    return data.get("rules", {}), dict(DEFAULT_CONDITIONS)
+
+
+def make_task_definitions(count: int, seed: int = 0) -> List[TaskDefinition]:
+    # The seeded skincare tasks keep the serum rotation on the hot path; the
+    # rest spread over enough slots that larger sets also produce more cards.
+    rng = random.Random(seed)
+    data = _read_seed(SEED_PATH)
+    task_defs = [
+        TaskDefinition(
+            id=item["id"],
+            slot=item["slot"],
+            task_type=item["type"],
+            steps=item.get("steps", []),
+            interval_days=item.get("interval_days"),
+            cron_weekdays=item.get("cron_weekdays"),
+        )
+        for item in data.get("taskDefinitions", [])[:count]
+    ]
+    slot_count = max(len(EXTRA_SLOTS), count // 8)
+    for index in range(len(task_defs), count):
+        slot = EXTRA_SLOTS[index % len(EXTRA_SLOTS)] if index % 2 else f"SLOT_{index % slot_count}"
+        use_cron = rng.random() < 0.25
+        task_defs.append(
+            TaskDefinition(
+                id=f"bench_{index}",
+                slot=slot,
+                task_type="bench",
+                steps=[
+                    {"step": step, "action": f"action_{step}", "products": [f"product_{step}"]}
+                    for step in range(1, rng.randint(1, 4) + 1)
+                ],
+                interval_days=None if use_cron else rng.choice((1, 2, 3, 4, 7, 14)),
+                cron_weekdays=sorted(rng.sample(range(7), rng.randint(1, 3))) if use_cron else None,
+            )
+        )
+    return task_defs
+
+
+def _at(day: date, hour: int) -> datetime:
+    return datetime.combine(day, time(hour), tzinfo=TIMEZONE)
+
+
+def make_history_events(
+    task_defs: List[TaskDefinition], end_date: date, days: int, seed: int = 0
+) -> List[Tuple[str, str, date]]:
+    rng = random.Random(seed)
+    events: List[Tuple[str, str, date]] = []
+    start_date = end_date - timedelta(days=days)
+    for task_def in task_defs:
+        step = task_def.interval_days or 2
+        day = start_date + timedelta(days=rng.randrange(step))
+        while day < end_date:
+            kind = EVENT_SKIP if rng.random() < 0.1 else EVENT_COMPLETE
+            events.append((task_def.id, kind, day))
+            day += timedelta(days=step + (1 if rng.random() < 0.2 else 0))
+    return events
+
+
+def make_status_and_history(
+    task_defs: List[TaskDefinition], end_date: date, days: int, seed: int = 0
+) -> Tuple[Dict[str, TaskStatus], TaskHistory]:
+    status_map = {
+        task_def.id: TaskStatus(task_definition_id=task_def.id) for task_def in task_defs
+    }
+    history = TaskHistory()
+    for task_definition_id, kind, day in make_history_events(task_defs, end_date, days, seed):
+        history.add(task_definition_id, kind, day)
+        status = status_map[task_definition_id]
+        if kind == EVENT_COMPLETE:
+            status.last_completed_at = _at(day, 9)
+        else:
+            status.last_skipped_at = _at(day, 9)
+    return status_map, history
+
+
+def write_seed_file(path: Path, products: int, task_definitions: int, seed: int = 0) -> None:
+    rules, _ = seed_rules()
+    data = {
+        "products": [
+            {
+                "id": f"product_{index}",
+                "name": f"Product {index}",
+                "category": ("ampoule", "cream", "toner", "sunscreen")[index % 4],
+                "role": "bench",
+                "notes": None,
+                "verified": {"source": "bench"},
+            }
+            for index in range(products)
+        ],
+        "taskDefinitions": [
+            {
+                "id": task_def.id,
+                "slot": task_def.slot,
+                "type": task_def.task_type,
+                "steps": task_def.steps,
+                "interval_days": task_def.interval_days,
+                "cron_weekdays": task_def.cron_weekdays,
+            }
+            for task_def in make_task_definitions(task_definitions, seed)
+        ],
+        "rules": rules,
+    }
+    path.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
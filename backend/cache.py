@@ -0,0 +1,85 @@
+﻿from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Generic, Hashable, List, Optional, TypeVar
+
+from sqlmodel import Session, select, update
+
+from .events import publish_after_commit
+from .models import StateVersion
+from .sync import stamp_revisions
+
+STATE_VERSION_ID = 1
+
+V = TypeVar("V")
+
+
+class LRUCache(Generic[V]):
+    def __init__(self, maxsize: int) -> None:
+        self.maxsize = maxsize
+        self._data: "OrderedDict[Hashable, V]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[V]:
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: V) -> None:
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def keys(self) -> List[Hashable]:
+        with self._lock:
+            return list(self._data)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+def init_state_version(session: Session, user_id: str) -> None:
+    if session.get(StateVersion, (user_id, STATE_VERSION_ID)) is None:
+        session.add(StateVersion(user_id=user_id, id=STATE_VERSION_ID, version=0))
+        session.commit()
+
+
+def get_state_version(session: Session, user_id: str) -> int:
+    state = session.get(StateVersion, (user_id, STATE_VERSION_ID))
+    return state.version if state is not None else 0
+
+
+def bump_state_version(session: Session, user_id: str) -> int:
+    with session.no_autoflush:
+        result = session.exec(
+            update(StateVersion)
+            .where(StateVersion.user_id == user_id, StateVersion.id == STATE_VERSION_ID)
+            .values(version=StateVersion.version + 1)
+        )
+        if result.rowcount == 0:
+            session.add(StateVersion(user_id=user_id, id=STATE_VERSION_ID, version=1))
+            version = 1
+        else:
+            version = session.exec(
+                select(StateVersion.version).where(
+                    StateVersion.user_id == user_id, StateVersion.id == STATE_VERSION_ID
+                )
+            ).one()
+    stamp_revisions(session, user_id, version)
+    publish_after_commit(session, user_id, version)
+    return version
+
+
+today_cache: LRUCache[Any] = LRUCache(maxsize=128)
+spec_cache: LRUCache[Any] = LRUCache(maxsize=64)
+# Keyed by (user_id, state version); product edits bump the version.
+product_cache: LRUCache[Dict[str, Dict[str, Any]]] = LRUCache(maxsize=128)
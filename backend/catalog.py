@@ -0,0 +1,105 @@
+﻿from __future__ import annotations
+
+import re
+from typing import Optional
+
+from sqlalchemy import Column, MetaData, String, Table, and_, text
+from sqlalchemy.engine import Connection
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.sql.elements import ColumnElement
+from sqlmodel import select
+
+from .models import Product
+
+MAX_PRODUCT_PAGE_SIZE = 200
+
+# Maintained by triggers, so it lives outside SQLModel.metadata and create_all.
+product_fts = Table(
+    "product_fts",
+    MetaData(),
+    Column("name", String),
+    Column("user_id", String),
+    Column("product_id", String),
+)
+
+_PRODUCT_SEARCH_DDL = (
+    "CREATE VIRTUAL TABLE product_fts USING fts5("
+    "name, user_id UNINDEXED, product_id UNINDEXED, "
+    "tokenize='trigram')",
+    "CREATE TRIGGER product_fts_insert AFTER INSERT ON product BEGIN "
+    "INSERT INTO product_fts (name, user_id, product_id) "
+    "VALUES (new.name, new.user_id, new.id); END",
+    "CREATE TRIGGER product_fts_delete AFTER DELETE ON product BEGIN "
+    "DELETE FROM product_fts WHERE user_id = old.user_id AND product_id = old.id; END",
+    "CREATE TRIGGER product_fts_update AFTER UPDATE OF name, id ON product BEGIN "
+    "DELETE FROM product_fts WHERE user_id = old.user_id AND product_id = old.id; "
+    "INSERT INTO product_fts (name, user_id, product_id) "
+    "VALUES (new.name, new.user_id, new.id); END",
+    "INSERT INTO product_fts (name, user_id, product_id) SELECT name, user_id, id FROM product",
+)
+
+_search_available: Optional[bool] = None
+
+
+def create_product_search(connection: Connection) -> None:
+    if connection.dialect.name != "sqlite":
+        return
+    for name in ("product_fts_insert", "product_fts_delete", "product_fts_update"):
+        connection.execute(text(f"DROP TRIGGER IF EXISTS {name}"))
+    connection.execute(text("DROP TABLE IF EXISTS product_fts"))
+    try:
+        with connection.begin_nested():
+            for statement in _PRODUCT_SEARCH_DDL:
+                connection.execute(text(statement))
+    except OperationalError:
+        # SQLite without FTS5 or its trigram tokenizer (3.34+); search falls
+        # back to LIKE, which matches the same substrings.
+        pass
+    reset_product_search()
+
+
+def reset_product_search() -> None:
+    global _search_available
+    _search_available = None
+
+
+def product_search_available(connection: Connection) -> bool:
+    global _search_available
+    if _search_available is None:
+        _search_available = connection.dialect.name == "sqlite" and bool(
+            connection.execute(
+                text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'product_fts'")
+            ).first()
+        )
+    return _search_available
+
+
+def _escape_like(value: str) -> str:
+    return re.sub(r"([\\%_])", r"\\\1", value)
+
+
+def _name_contains(term: str) -> ColumnElement:
+    return Product.name.ilike(f"%{_escape_like(term)}%", escape="\\")
+
+
+def product_name_filter(connection: Connection, user_id: str, query: str) -> ColumnElement:
+    # Every word must appear somewhere in the name, case-insensitively.
+    terms = query.split()
+    if not product_search_available(connection):
+        return and_(*(_name_contains(term) for term in terms))
+
+    # Trigrams only index words of three or more characters. Shorter words
+    # filter the caller's per-tenant Product scan instead of the shared search
+    # table. Quoting a word keeps it from injecting FTS syntax.
+    indexed = [term for term in terms if len(term) >= 3]
+    conditions = [_name_contains(term) for term in terms if len(term) < 3]
+    if indexed:
+        match = " ".join('"{}"'.format(term.replace('"', '""')) for term in indexed)
+        conditions.append(
+            Product.id.in_(
+                select(product_fts.c.product_id).where(
+                    product_fts.c.user_id == user_id, product_fts.c.name.op("MATCH")(match)
+                )
+            )
+        )
+    return and_(*conditions)
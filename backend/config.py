@@ -9,10 +9,48 @@ REPO_ROOT = BASE_DIR.parent
 
 DEFAULT_DB_PATH = REPO_ROOT / "backend" / "routine.db"
 DATABASE_URL = os.getenv("DATABASE_URL", f"sqlite:///{DEFAULT_DB_PATH.as_posix()}")
+# Defaults to DATABASE_URL with the aiosqlite / asyncpg driver.
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL")
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_CACHE_SIZE_KIB = int(os.getenv("SQLITE_CACHE_SIZE_KIB", str(16 * 1024)))
 
 SEED_PATH = Path(os.getenv("SEED_PATH", str(REPO_ROOT / "spec" / "seed.json")))
 
 TIMEZONE = ZoneInfo("Asia/Seoul")
 
+DEFAULT_USER_ID = os.getenv("DEFAULT_USER_ID", "default")
+# Unseen user ids are only seeded when listed here, or for any well-formed id
+# with TENANT_AUTO_PROVISION=1; otherwise use `python -m backend.tenants`.
+ALLOWED_TENANTS = frozenset(
+    user_id.strip() for user_id in os.getenv("ALLOWED_TENANTS", "").split(",") if user_id.strip()
+)
+TENANT_AUTO_PROVISION = os.getenv("TENANT_AUTO_PROVISION", "0").lower() in {"1", "true", "yes"}
+TENANT_CACHE_SIZE = int(os.getenv("TENANT_CACHE_SIZE", "1024"))
+
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 MODEL_NAME = os.getenv("MODEL_NAME", "gemini-3.0-flash")
+AI_BASE_URL = os.getenv("AI_BASE_URL", "https://generativelanguage.googleapis.com")
+AI_TIMEOUT_SECONDS = float(os.getenv("AI_TIMEOUT_SECONDS", "30"))
+AI_MAX_CONCURRENCY = int(os.getenv("AI_MAX_CONCURRENCY", "4"))
+AI_MAX_RETRIES = int(os.getenv("AI_MAX_RETRIES", "2"))
+AI_RETRY_BACKOFF_SECONDS = float(os.getenv("AI_RETRY_BACKOFF_SECONDS", "0.5"))
+AI_CACHE_TTL_SECONDS = float(os.getenv("AI_CACHE_TTL_SECONDS", str(24 * 60 * 60)))
+AI_CACHE_MAX_ENTRIES = int(os.getenv("AI_CACHE_MAX_ENTRIES", "256"))
+AI_CACHE_PERSIST = os.getenv("AI_CACHE_PERSIST", "0").lower() in {"1", "true", "yes"}
+
+STREAM_QUEUE_SIZE = int(os.getenv("STREAM_QUEUE_SIZE", "8"))
+STREAM_KEEPALIVE_SECONDS = float(os.getenv("STREAM_KEEPALIVE_SECONDS", "15"))
+
+PLAN_WORKERS = int(os.getenv("PLAN_WORKERS", str(os.cpu_count() or 1)))
+PLAN_CHUNK_SIZE = int(os.getenv("PLAN_CHUNK_SIZE", "200"))
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "0").lower() in {"1", "true", "yes"}
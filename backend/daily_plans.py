@@ -0,0 +1,177 @@
+﻿from __future__ import annotations
+
+import argparse
+import json
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+from sqlmodel import Session, delete, select
+
+from .cache import get_state_version
+from .config import PLAN_CHUNK_SIZE, PLAN_WORKERS
+from .db import engine
+from .models import DailyPlan, StateVersion
+from .schedule_inputs import cards_etag, load_schedule_inputs
+from .scheduler import build_today_cards, card_to_dict, kst_now, parse_date
+
+ChunkResult = Tuple[List[Dict[str, Any]], float]
+
+
+def load_daily_plan(
+    session: Session, user_id: str, plan_date: date, state_version: int
+) -> Optional[DailyPlan]:
+    plan = session.get(DailyPlan, (user_id, plan_date))
+    if plan is None or plan.state_version != state_version:
+        return None
+    return plan
+
+
+def iter_tenant_chunks(session: Session, chunk_size: int) -> Iterator[List[str]]:
+    after = None
+    while True:
+        statement = select(StateVersion.user_id).order_by(StateVersion.user_id)
+        if after is not None:
+            statement = statement.where(StateVersion.user_id > after)
+        user_ids = list(session.exec(statement.limit(chunk_size)).all())
+        if not user_ids:
+            return
+        yield user_ids
+        after = user_ids[-1]
+
+
+def _init_worker() -> None:
+    # Connections inherited from the parent must not be reused after fork.
+    engine.dispose(close=False)
+
+
+def plan_chunk(user_ids: List[str], plan_date: date) -> ChunkResult:
+    started = time.perf_counter()
+    generated_at = datetime.now(timezone.utc)
+    rows = []
+    with Session(engine) as session:
+        for user_id in user_ids:
+            # Read the version first: a write landing after it only makes the
+            # plan newer than its version, and stale plans are never served.
+            version = get_state_version(session, user_id)
+            inputs = load_schedule_inputs(session, user_id, plan_date, plan_date)
+            cards = build_today_cards(target_date=plan_date, **inputs)
+            rows.append(
+                {
+                    "user_id": user_id,
+                    "plan_date": plan_date,
+                    "state_version": version,
+                    "cards": [card_to_dict(card) for card in cards],
+                    "etag": cards_etag(plan_date, cards),
+                    "generated_at": generated_at,
+                }
+            )
+            session.expunge_all()
+    return rows, time.perf_counter() - started
+
+
+def write_plans(session: Session, plan_date: date, rows: List[Dict[str, Any]]) -> None:
+    session.exec(
+        delete(DailyPlan).where(
+            DailyPlan.plan_date == plan_date,
+            DailyPlan.user_id.in_([row["user_id"] for row in rows]),
+        )
+    )
+    session.connection().execute(DailyPlan.__table__.insert(), rows)
+
+
+def prune_plans(session: Session, before: date) -> None:
+    session.exec(delete(DailyPlan).where(DailyPlan.plan_date < before))
+
+
+def run_daily_plans(
+    plan_date: date,
+    workers: int = PLAN_WORKERS,
+    chunk_size: int = PLAN_CHUNK_SIZE,
+    on_chunk: Optional[Callable[[Dict[str, Any]], None]] = None,
+) -> Dict[str, Any]:
+    started = time.perf_counter()
+    totals = {"date": plan_date.isoformat(), "workers": workers, "chunks": 0, "tenants": 0}
+
+    def record(index: int, result: ChunkResult) -> None:
+        rows, compute_seconds = result
+        write_started = time.perf_counter()
+        with Session(engine) as session:
+            write_plans(session, plan_date, rows)
+            session.commit()
+        write_seconds = time.perf_counter() - write_started
+        totals["chunks"] += 1
+        totals["tenants"] += len(rows)
+        if on_chunk is not None:
+            on_chunk(
+                {
+                    "chunk": index,
+                    "tenants": len(rows),
+                    "computeSeconds": round(compute_seconds, 4),
+                    "writeSeconds": round(write_seconds, 4),
+                    "tenantsPerSecond": round(len(rows) / compute_seconds, 1)
+                    if compute_seconds
+                    else None,
+                }
+            )
+
+    with Session(engine) as session:
+        prune_plans(session, kst_now().date())
+        session.commit()
+        chunks = enumerate(iter_tenant_chunks(session, chunk_size))
+        if workers <= 1:
+            for index, user_ids in chunks:
+                record(index, plan_chunk(user_ids, plan_date))
+        else:
+            # Only the parent writes; workers read and compute, with a bounded
+            # number of chunks in flight so tenants are streamed, not listed.
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+                pending: Dict[Future, int] = {}
+                for index, user_ids in chunks:
+                    pending[pool.submit(plan_chunk, user_ids, plan_date)] = index
+                    if len(pending) >= workers * 2:
+                        _drain(pending, record, FIRST_COMPLETED)
+                _drain(pending, record, None)
+
+    elapsed = time.perf_counter() - started
+    totals["seconds"] = round(elapsed, 3)
+    totals["tenantsPerSecond"] = round(totals["tenants"] / elapsed, 1) if elapsed else None
+    return totals
+
+
+def _drain(
+    pending: Dict[Future, int],
+    record: Callable[[int, ChunkResult], None],
+    return_when: Optional[str],
+) -> None:
+    done: Set[Future]
+    if return_when is None:
+        done = set(pending)
+    else:
+        done, _ = wait(pending, return_when=return_when)
+    for future in done:
+        record(pending.pop(future), future.result())
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    from .migrations import init_db
+
+    parser = argparse.ArgumentParser(description="Precompute day cards for every tenant")
+    parser.add_argument("--date", type=parse_date, help="Defaults to tomorrow in KST")
+    parser.add_argument("--workers", type=int, default=PLAN_WORKERS)
+    parser.add_argument("--chunk-size", type=int, default=PLAN_CHUNK_SIZE)
+    args = parser.parse_args(argv)
+
+    init_db()
+    plan_date = args.date or kst_now().date() + timedelta(days=1)
+
+    def report(chunk: Dict[str, Any]) -> None:
+        print(json.dumps(chunk), flush=True)
+
+    print(json.dumps(run_daily_plans(plan_date, args.workers, args.chunk_size, report)))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
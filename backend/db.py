@@ -1,16 +1,199 @@
 ﻿from __future__ import annotations
 
+from typing import Any, Dict
+
+from sqlalchemy import Connection, Engine, Table, event, inspect, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.pool import StaticPool
 from sqlmodel import Session, SQLModel, create_engine
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from .config import (
+    ASYNC_DATABASE_URL,
+    DATABASE_URL,
+    DB_MAX_OVERFLOW,
+    DB_POOL_RECYCLE,
+    DB_POOL_SIZE,
+    DB_POOL_TIMEOUT,
+    DEFAULT_USER_ID,
+    SQLITE_BUSY_TIMEOUT_MS,
+    SQLITE_CACHE_SIZE_KIB,
+    SQLITE_JOURNAL_MODE,
+    SQLITE_MMAP_SIZE,
+    SQLITE_SYNCHRONOUS,
+)
+
+
+def _sqlite_pragmas(in_memory: bool) -> Dict[str, Any]:
+    pragmas: Dict[str, Any] = {
+        "busy_timeout": SQLITE_BUSY_TIMEOUT_MS,
+        "cache_size": -SQLITE_CACHE_SIZE_KIB,
+        "temp_store": "MEMORY",
+    }
+    if not in_memory:
+        pragmas["journal_mode"] = SQLITE_JOURNAL_MODE
+        pragmas["synchronous"] = SQLITE_SYNCHRONOUS
+        pragmas["mmap_size"] = SQLITE_MMAP_SIZE
+    return pragmas
+
+
+def _install_sqlite_pragmas(sync_engine: Engine, in_memory: bool) -> None:
+    pragmas = _sqlite_pragmas(in_memory)
+
+    @event.listens_for(sync_engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record) -> None:
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+
+def _engine_options(url: str) -> Dict[str, Any]:
+    database_url = make_url(url)
+    if database_url.get_backend_name() != "sqlite":
+        return {
+            "pool_size": DB_POOL_SIZE,
+            "max_overflow": DB_MAX_OVERFLOW,
+            "pool_timeout": DB_POOL_TIMEOUT,
+            "pool_recycle": DB_POOL_RECYCLE,
+            "pool_pre_ping": True,
+        }
+
+    options: Dict[str, Any] = {
+        "connect_args": {
+            "check_same_thread": False,
+            "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000,
+        }
+    }
+    if _is_sqlite_memory(url):
+        options["poolclass"] = StaticPool
+    else:
+        options.update(
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+        )
+    return options
+
+
+def _is_sqlite_memory(url: str) -> bool:
+    return make_url(url).database in (None, "", ":memory:")
+
+
+def create_db_engine(url: str = DATABASE_URL) -> Engine:
+    db_engine = create_engine(url, echo=False, **_engine_options(url))
+    if make_url(url).get_backend_name() == "sqlite":
+        _install_sqlite_pragmas(db_engine, _is_sqlite_memory(url))
+    return db_engine
+
+
+def to_async_url(url: str) -> str:
+    database_url = make_url(url)
+    backend = database_url.get_backend_name()
+    if backend == "sqlite":
+        database_url = database_url.set(drivername="sqlite+aiosqlite")
+    elif backend == "postgresql":
+        database_url = database_url.set(drivername="postgresql+asyncpg")
+    return database_url.render_as_string(hide_password=False)
+
 
-from .config import DATABASE_URL
+def create_async_db_engine(url: str | None = None) -> AsyncEngine:
+    url = url or ASYNC_DATABASE_URL or to_async_url(DATABASE_URL)
+    db_engine = create_async_engine(url, echo=False, **_engine_options(url))
+    if make_url(url).get_backend_name() == "sqlite":
+        _install_sqlite_pragmas(db_engine.sync_engine, _is_sqlite_memory(url))
+    return db_engine
 
-engine = create_engine(DATABASE_URL, echo=False)
 
+engine = create_db_engine()
+_async_engine: AsyncEngine | None = None
 
-def init_db() -> None:
-    SQLModel.metadata.create_all(engine)
+
+def get_async_engine() -> AsyncEngine:
+    # Created on first use so the async driver is only needed by async routes.
+    global _async_engine
+    if _async_engine is None:
+        _async_engine = create_async_db_engine()
+    return _async_engine
+
+
+def _add_tenant_column(connection: Connection, table: Table) -> None:
+    # Rebuild a pre-tenant table with the user_id-led primary key and move its
+    # rows to the default user.
+    inspector = inspect(connection)
+    legacy_name = f"{table.name}_legacy"
+    columns = [column["name"] for column in inspector.get_columns(table.name)]
+
+    for index in inspector.get_indexes(table.name):
+        connection.execute(text(f'DROP INDEX "{index["name"]}"'))
+    pk_name = inspector.get_pk_constraint(table.name).get("name")
+    connection.execute(text(f'ALTER TABLE "{table.name}" RENAME TO "{legacy_name}"'))
+    if pk_name and connection.dialect.name != "sqlite":
+        connection.execute(text(f'ALTER INDEX "{pk_name}" RENAME TO "{legacy_name}_pkey"'))
+
+    table.create(connection)
+    copied = ", ".join(f'"{name}"' for name in columns if name in table.columns)
+    connection.execute(
+        text(
+            f'INSERT INTO "{table.name}" ("user_id", {copied}) '
+            f'SELECT :user_id, {copied} FROM "{legacy_name}"'
+        ),
+        {"user_id": DEFAULT_USER_ID},
+    )
+    connection.execute(text(f'DROP TABLE "{legacy_name}"'))
+
+
+def migrate_tenant_columns(connection: Connection) -> None:
+    existing = set(inspect(connection).get_table_names())
+    for table in SQLModel.metadata.sorted_tables:
+        if "user_id" not in table.columns or table.name not in existing:
+            continue
+        columns = {column["name"] for column in inspect(connection).get_columns(table.name)}
+        if "user_id" not in columns:
+            _add_tenant_column(connection, table)
+
+
+def add_missing_columns(connection: Connection) -> None:
+    existing = set(inspect(connection).get_table_names())
+    for table in SQLModel.metadata.sorted_tables:
+        if table.name not in existing:
+            continue
+        columns = {column["name"] for column in inspect(connection).get_columns(table.name)}
+        for column in table.columns:
+            if column.name in columns:
+                continue
+            ddl = f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" '
+            ddl += column.type.compile(dialect=connection.dialect)
+            if column.server_default is not None:
+                ddl += f" NOT NULL DEFAULT {column.server_default.arg}"
+            connection.execute(text(ddl))
+
+
+def migrate_revision_columns(connection: Connection) -> None:
+    # Adds every column the models know about, not only revision, so the ORM
+    # data migrations that follow can load rows from older databases.
+    add_missing_columns(connection)
+    existing = set(inspect(connection).get_table_names())
+    for table in SQLModel.metadata.sorted_tables:
+        if table.name not in existing:
+            continue
+        for index in table.indexes:
+            if "revision" in index.columns:
+                index.create(connection, checkfirst=True)
+
+
+def create_missing_indexes(connection: Connection) -> None:
+    for table in SQLModel.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
 
 
 def get_session():
     with Session(engine) as session:
         yield session
+
+
+async def get_async_session():
+    async with AsyncSession(get_async_engine(), expire_on_commit=False) as session:
+        yield session
@@ -0,0 +1,151 @@
+﻿from __future__ import annotations
+
+from datetime import date, datetime, timedelta
+from itertools import chain
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import and_, event, func, or_
+from sqlalchemy.orm import Session as OrmSession
+from sqlalchemy.sql import ColumnElement, Select
+from sqlmodel import Session, select
+
+from .config import TIMEZONE
+from .history import EVENT_COMPLETE
+from .models import TaskDefinition, TaskEvent, TaskStatus
+
+ALL_WEEKDAYS = 0b1111111
+
+
+def weekday_mask(cron_weekdays: Optional[Iterable[Any]]) -> int:
+    mask = 0
+    for weekday in cron_weekdays or ():
+        if isinstance(weekday, int) and 0 <= weekday <= 6:
+            mask |= 1 << weekday
+    return mask
+
+
+def weekdays_between(start_date: date, end_date: date) -> int:
+    if (end_date - start_date).days >= 6:
+        return ALL_WEEKDAYS
+    mask = 0
+    day = start_date
+    while day <= end_date:
+        mask |= 1 << day.weekday()
+        day += timedelta(days=1)
+    return mask
+
+
+@event.listens_for(OrmSession, "before_flush")
+def _sync_weekday_masks(session: OrmSession, flush_context: Any, instances: Any) -> None:
+    for instance in chain(session.new, session.dirty):
+        if isinstance(instance, TaskDefinition):
+            mask = weekday_mask(instance.cron_weekdays)
+            if instance.weekday_mask != mask:
+                instance.weekday_mask = mask
+
+
+def refresh_next_due(status: TaskStatus, interval_days: Optional[int]) -> None:
+    if interval_days is None or status.completed_through is None:
+        status.next_due_date = None
+    else:
+        status.next_due_date = status.completed_through + timedelta(days=interval_days)
+
+
+def record_completion(
+    status: TaskStatus, interval_days: Optional[int], instance_date: date
+) -> None:
+    if status.completed_through is None or instance_date > status.completed_through:
+        status.completed_through = instance_date
+    refresh_next_due(status, interval_days)
+
+
+def _candidate_filter(user_id: str, start_date: date, end_date: date) -> ColumnElement[bool]:
+    # A superset of the tasks _select_candidates can keep for any day in the
+    # range. A NULL next_due_date always matches, so rows the projection has
+    # not seen yet are never hidden. completed_through >= start_date keeps
+    # tasks whose latest completion is after an earlier, back-dated request.
+    has_events = select(TaskEvent.task_definition_id).where(
+        TaskEvent.user_id == user_id,
+        TaskEvent.instance_date >= start_date,
+        TaskEvent.instance_date <= end_date,
+    )
+    interval_due = and_(
+        TaskDefinition.interval_days.is_not(None),
+        or_(
+            TaskStatus.next_due_date.is_(None),
+            TaskStatus.next_due_date <= end_date,
+            TaskStatus.completed_through >= start_date,
+        ),
+    )
+    weekday_due = and_(
+        TaskDefinition.interval_days.is_(None),
+        TaskDefinition.weekday_mask.op("&")(weekdays_between(start_date, end_date)) != 0,
+    )
+    return and_(
+        TaskDefinition.user_id == user_id,
+        or_(interval_due, weekday_due, TaskDefinition.id.in_(has_events)),
+    )
+
+
+def _with_status(statement: Select) -> Select:
+    return statement.outerjoin(
+        TaskStatus,
+        and_(
+            TaskStatus.user_id == TaskDefinition.user_id,
+            TaskStatus.task_definition_id == TaskDefinition.id,
+        ),
+    )
+
+
+def candidate_task_ids(user_id: str, start_date: date, end_date: date) -> Select:
+    return (
+        _with_status(select(TaskDefinition.id))
+        .where(_candidate_filter(user_id, start_date, end_date))
+        .correlate(None)
+    )
+
+
+def load_candidate_tasks(
+    session: Session, user_id: str, start_date: date, end_date: date
+) -> Tuple[List[TaskDefinition], Dict[str, TaskStatus]]:
+    rows = session.exec(
+        _with_status(select(TaskDefinition, TaskStatus))
+        .where(_candidate_filter(user_id, start_date, end_date))
+        .order_by(TaskDefinition.id)
+    ).all()
+    task_defs = [task_def for task_def, _ in rows]
+    status_map = {status.task_definition_id: status for _, status in rows if status is not None}
+    return task_defs, status_map
+
+
+def _kst_date(value: Optional[datetime]) -> Optional[date]:
+    if value is None:
+        return None
+    return value.astimezone(TIMEZONE).date()
+
+
+def backfill_due_projection(session: Session) -> None:
+    intervals = {}
+    for task_def in session.exec(select(TaskDefinition)):
+        task_def.weekday_mask = weekday_mask(task_def.cron_weekdays)
+        intervals[(task_def.user_id, task_def.id)] = task_def.interval_days
+        session.add(task_def)
+
+    completed = {
+        (user_id, task_definition_id): instance_date
+        for user_id, task_definition_id, instance_date in session.exec(
+            select(
+                TaskEvent.user_id,
+                TaskEvent.task_definition_id,
+                func.max(TaskEvent.instance_date),
+            )
+            .where(TaskEvent.kind == EVENT_COMPLETE)
+            .group_by(TaskEvent.user_id, TaskEvent.task_definition_id)
+        )
+    }
+    for status in session.exec(select(TaskStatus)):
+        key = (status.user_id, status.task_definition_id)
+        status.completed_through = completed.get(key) or _kst_date(status.last_completed_at)
+        refresh_next_due(status, intervals.get(key))
+        session.add(status)
+    session.commit()
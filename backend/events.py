@@ -0,0 +1,80 @@
+﻿from __future__ import annotations
+
+import asyncio
+import threading
+from typing import Any, Dict, Set
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session as OrmSession
+
+from .config import STREAM_QUEUE_SIZE
+
+_PENDING_KEY = "state_changes"
+
+
+class Subscription:
+    def __init__(self, user_id: str, maxsize: int) -> None:
+        self.user_id = user_id
+        self.loop = asyncio.get_running_loop()
+        self.queue: asyncio.Queue[int] = asyncio.Queue(maxsize=maxsize)
+
+    def offer(self, version: int) -> None:
+        # Each message only says "state moved on", so a full queue already
+        # holds enough to make the subscriber refresh; dropping is lossless.
+        try:
+            self.queue.put_nowait(version)
+        except asyncio.QueueFull:
+            pass
+
+
+class StateChangeBroker:
+    def __init__(self, queue_size: int) -> None:
+        self._queue_size = queue_size
+        self._lock = threading.Lock()
+        self._subscribers: Dict[str, Set[Subscription]] = {}
+
+    def subscribe(self, user_id: str) -> Subscription:
+        subscription = Subscription(user_id, self._queue_size)
+        with self._lock:
+            self._subscribers.setdefault(user_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.user_id)
+            if subscribers is None:
+                return
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._subscribers[subscription.user_id]
+
+    def subscriber_count(self, user_id: str) -> int:
+        with self._lock:
+            return len(self._subscribers.get(user_id, ()))
+
+    def publish(self, user_id: str, version: int) -> None:
+        with self._lock:
+            subscribers = list(self._subscribers.get(user_id, ()))
+        for subscription in subscribers:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.offer, version)
+            except RuntimeError:
+                self.unsubscribe(subscription)
+
+
+broker = StateChangeBroker(STREAM_QUEUE_SIZE)
+
+
+def publish_after_commit(session: Any, user_id: str, version: int) -> None:
+    session.info.setdefault(_PENDING_KEY, {})[user_id] = version
+
+
+@event.listens_for(OrmSession, "after_commit")
+def _publish_pending(session: OrmSession) -> None:
+    for user_id, version in session.info.pop(_PENDING_KEY, {}).items():
+        broker.publish(user_id, version)
+
+
+@event.listens_for(OrmSession, "after_rollback")
+def _drop_pending(session: OrmSession) -> None:
+    session.info.pop(_PENDING_KEY, None)
@@ -0,0 +1,114 @@
+﻿from __future__ import annotations
+
+from bisect import bisect_left, insort
+from datetime import date
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy.sql import Select
+from sqlalchemy import exists
+from sqlmodel import Session, select
+
+from .models import TaskDefinition, TaskEvent
+
+EVENT_COMPLETE = "complete"
+EVENT_SKIP = "skip"
+
+_EVENT_STATES = {EVENT_COMPLETE: "completed", EVENT_SKIP: "skipped"}
+
+
+class TaskHistory:
+    def __init__(self) -> None:
+        self._completions: Dict[str, List[date]] = {}
+        self._states: Dict[Tuple[str, date], str] = {}
+        self._tracked: set[str] = set()
+
+    def add(self, task_definition_id: str, kind: str, instance_date: date) -> None:
+        self._tracked.add(task_definition_id)
+        key = (task_definition_id, instance_date)
+        if kind == EVENT_COMPLETE:
+            completions = self._completions.setdefault(task_definition_id, [])
+            index = bisect_left(completions, instance_date)
+            if index == len(completions) or completions[index] != instance_date:
+                insort(completions, instance_date)
+            self._states[key] = _EVENT_STATES[EVENT_COMPLETE]
+        elif self._states.get(key) != _EVENT_STATES[EVENT_COMPLETE]:
+            self._states[key] = _EVENT_STATES[kind]
+
+    def track(self, task_definition_id: str) -> None:
+        self._tracked.add(task_definition_id)
+
+    def tracks(self, task_definition_id: str) -> bool:
+        return task_definition_id in self._tracked
+
+    def last_completed_before(self, task_definition_id: str, target_date: date) -> Optional[date]:
+        completions = self._completions.get(task_definition_id)
+        if not completions:
+            return None
+        index = bisect_left(completions, target_date)
+        return completions[index - 1] if index else None
+
+    def state_on(self, task_definition_id: str, target_date: date) -> Optional[str]:
+        return self._states.get((task_definition_id, target_date))
+
+    def copy(self) -> "TaskHistory":
+        clone = TaskHistory()
+        clone._completions = {key: list(value) for key, value in self._completions.items()}
+        clone._states = dict(self._states)
+        clone._tracked = set(self._tracked)
+        return clone
+
+
+def load_task_history(
+    session: Session,
+    user_id: str,
+    start_date: date,
+    end_date: date,
+    task_definition_ids: Optional[Select] = None,
+) -> TaskHistory:
+    history = TaskHistory()
+
+    last_completed_before = (
+        select(TaskEvent.instance_date)
+        .where(
+            TaskEvent.user_id == TaskDefinition.user_id,
+            TaskEvent.task_definition_id == TaskDefinition.id,
+            TaskEvent.kind == EVENT_COMPLETE,
+            TaskEvent.instance_date < start_date,
+        )
+        .order_by(TaskEvent.instance_date.desc())
+        .limit(1)
+        .correlate(TaskDefinition)
+        .scalar_subquery()
+    )
+    # Any event at all makes the log authoritative, including for days before
+    # the first completion, where the status column would point ahead.
+    has_events = (
+        exists()
+        .where(
+            TaskEvent.user_id == TaskDefinition.user_id,
+            TaskEvent.task_definition_id == TaskDefinition.id,
+        )
+        .correlate(TaskDefinition)
+    )
+    statement = select(TaskDefinition.id, last_completed_before, has_events).where(
+        TaskDefinition.user_id == user_id
+    )
+    if task_definition_ids is not None:
+        statement = statement.where(TaskDefinition.id.in_(task_definition_ids))
+    for task_definition_id, instance_date, tracked in session.exec(statement):
+        if tracked:
+            history.track(task_definition_id)
+        if instance_date is not None:
+            history.add(task_definition_id, EVENT_COMPLETE, instance_date)
+
+    events = session.exec(
+        select(TaskEvent).where(
+            TaskEvent.user_id == user_id,
+            TaskEvent.instance_date >= start_date,
+            TaskEvent.instance_date <= end_date,
+        )
+    )
+    for event in events:
+        history.add(event.task_definition_id, event.kind, event.instance_date)
+
+    return history
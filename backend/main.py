@@ -1,28 +1,72 @@
 ﻿from __future__ import annotations
 
-from typing import Any, Dict, List
-
-from fastapi import Depends, FastAPI, HTTPException
-from sqlmodel import Session, select
-
-from .ai import generate_ai_patch
-from .db import get_session, init_db, engine
-from .models import Product, RuleUsage, RulesState, TaskDefinition, TaskStatus
+import asyncio
+import hashlib
+import threading
+from datetime import timedelta
+from typing import Any, Callable, Dict, List, Tuple, Type, TypeVar
+
+import jsonpatch
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, ValidationError
+from sqlmodel import Session, delete, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from .ai import close_ai_client, generate_ai_patch, select_spec_slices
+from .ai_cache import ai_response_cache
+from .cache import (
+    LRUCache,
+    bump_state_version,
+    get_state_version,
+    product_cache,
+    spec_cache,
+    today_cache,
+)
+from .catalog import MAX_PRODUCT_PAGE_SIZE, product_name_filter
+from .config import (
+    DEFAULT_USER_ID,
+    METRICS_ENABLED,
+    STREAM_KEEPALIVE_SECONDS,
+    TENANT_CACHE_SIZE,
+)
+from .daily_plans import load_daily_plan
+from .db import engine, get_async_session, get_session
+from .due_index import record_completion, refresh_next_due
+from .events import broker
+from .history import EVENT_COMPLETE, EVENT_SKIP
+from .metrics import install_metrics, registry, timed
+from .migrations import init_db
+from .models import Product, RuleUsage, TaskDefinition, TaskEvent, TaskStatus
+from .rule_plan import clear_rule_plan_cache
+from .schedule_inputs import (
+    cards_etag,
+    get_rule_plan,
+    get_rule_usage,
+    get_rules_state,
+    load_schedule_inputs,
+)
 from .scheduler import (
+    Card,
+    build_range_cards,
     build_today_cards,
+    card_from_dict,
     kst_now,
     parse_date,
     parse_iso_datetime,
     parse_task_instance_id,
-    select_am_serum,
-    select_pm_serum,
+    serum_rule_key_for_completion,
 )
 from .schemas import (
+    AiCacheStats,
     AiPatchRequest,
     AiPatchResponse,
     CompleteRequest,
     CompleteResponse,
     DeleteResponse,
+    EventBatchRequest,
+    EventBatchResponse,
     TaskDefinitionCreate,
     TaskDefinitionRead,
     TaskDefinitionUpdate,
@@ -31,49 +75,82 @@ from .schemas import (
     ProductUpdate,
     RulesPatchRequest,
     RulesResponse,
+    ScheduleResponse,
     SkipRequest,
     SkipResponse,
+    SpecApplyRequest,
+    SpecApplyResponse,
+    SpecSnapshot,
+    StatsResponse,
+    SyncResponse,
     TimeResponse,
     TodayResponse,
 )
-from .seed import (
-    DEFAULT_CONDITIONS,
-    RULE_KEY_AM_VITC,
-    RULE_KEY_PM_HIGH_NIACIN,
-    migrate_products,
-    migrate_skincare_tasks,
-    migrate_rules,
-    seed_if_needed,
+from .seed import DEFAULT_CONDITIONS
+from .serialization import FastJSONResponse, dumps
+from .stats import (
+    delete_task_stats,
+    load_rotation_stats,
+    load_task_stats,
+    record_rotation_use,
+    record_task_day,
 )
+from .sync import load_changes, record_task_definition_deleted
+from .tenants import is_valid_tenant_id, may_provision, provision_tenant, tenant_exists
 
 app = FastAPI()
+if METRICS_ENABLED:
+    install_metrics(app, exclude={"/api/stream"})
+
+MAX_SCHEDULE_DAYS = 92
+MAX_BATCH_EVENTS = 1000
+DEFAULT_STATS_DAYS = 30
+EXPAND_PRODUCTS = "products"
+SERUM_TASK_IDS = {"skin_am", "skin_pm"}
+
+T = TypeVar("T")
+
+# Tenants confirmed to exist, so most requests skip the lookup entirely.
+_known_tenants: LRUCache[bool] = LRUCache(maxsize=TENANT_CACHE_SIZE)
+_tenant_lock = threading.Lock()
 
 
 @app.on_event("startup")
 def on_startup() -> None:
+    # Allowed tenants, including the default one, are seeded on first request.
     init_db()
-    with Session(engine) as session:
-        seed_if_needed(session)
-        migrate_products(session)
-        migrate_skincare_tasks(session)
-        migrate_rules(session)
+    _known_tenants.clear()
+    # Cache keys embed state versions, which restart when the database does.
+    today_cache.clear()
+    spec_cache.clear()
+    product_cache.clear()
+    clear_rule_plan_cache()
 
 
-def _get_rules_state(session: Session) -> RulesState:
-    rules_state = session.exec(select(RulesState)).first()
-    if rules_state is None:
-        rules_state = RulesState(id=1, rules={}, conditions=DEFAULT_CONDITIONS.copy())
-        session.add(rules_state)
-        session.commit()
-        session.refresh(rules_state)
-    else:
-        for key, value in DEFAULT_CONDITIONS.items():
-            rules_state.conditions.setdefault(key, value)
-    return rules_state
+@app.on_event("shutdown")
+async def on_shutdown() -> None:
+    await close_ai_client()
+
 
+async def get_user_id(x_user_id: str | None = Header(default=None)) -> str:
+    user_id = (x_user_id or DEFAULT_USER_ID).strip()
+    if not is_valid_tenant_id(user_id):
+        raise HTTPException(status_code=400, detail="Invalid X-User-Id header")
+    if _known_tenants.get(user_id) is None:
+        await run_in_threadpool(_ensure_tenant, user_id)
+    return user_id
 
-def _get_rule_usage(session: Session) -> Dict[str, RuleUsage]:
-    return {usage.rule_key: usage for usage in session.exec(select(RuleUsage)).all()}
+
+def _ensure_tenant(user_id: str) -> None:
+    with _tenant_lock:
+        if _known_tenants.get(user_id) is not None:
+            return
+        with Session(engine) as session:
+            if not tenant_exists(session, user_id):
+                if not may_provision(user_id):
+                    raise HTTPException(status_code=403, detail="Unknown user")
+                provision_tenant(session, user_id)
+        _known_tenants.set(user_id, True)
 
 
 def _deep_merge(base: Dict[str, Any], updates: Dict[str, Any]) -> Dict[str, Any]:
@@ -86,62 +163,243 @@ def _deep_merge(base: Dict[str, Any], updates: Dict[str, Any]) -> Dict[str, Any]
     return merged
 
 
+def _task_definition_to_dict(task_def: TaskDefinition) -> Dict[str, Any]:
+    return {
+        "id": task_def.id,
+        "slot": task_def.slot,
+        "type": task_def.task_type,
+        "steps": task_def.steps,
+        "interval_days": task_def.interval_days,
+        "cron_weekdays": task_def.cron_weekdays,
+    }
+
+
 def _task_definition_to_read(task_def: TaskDefinition) -> TaskDefinitionRead:
-    return TaskDefinitionRead(
-        id=task_def.id,
-        slot=task_def.slot,
-        type=task_def.task_type,
-        steps=task_def.steps,
-        interval_days=task_def.interval_days,
-        cron_weekdays=task_def.cron_weekdays,
-    )
+    return TaskDefinitionRead(**_task_definition_to_dict(task_def))
+
+
+def _product_to_dict(product: Product) -> Dict[str, Any]:
+    return {
+        "id": product.id,
+        "name": product.name,
+        "category": product.category,
+        "role": product.role,
+        "notes": product.notes,
+        "verified": product.verified,
+        "is_active": product.is_active,
+    }
+
+
+def _isoformat_or_none(value) -> str | None:
+    return value.isoformat() if value is not None else None
+
+
+def _spec_snapshot(session: Session, user_id: str) -> Tuple[int, Dict[str, Any]]:
+    version = get_state_version(session, user_id)
+    cache_key = (user_id, version)
+    spec = spec_cache.get(cache_key)
+    if spec is None:
+        rules_state = get_rules_state(session, user_id)
+        products = session.exec(
+            select(Product)
+            .where(Product.user_id == user_id, Product.is_active == True)
+            .order_by(Product.id)
+        ).all()
+        task_defs = session.exec(
+            select(TaskDefinition)
+            .where(TaskDefinition.user_id == user_id)
+            .order_by(TaskDefinition.id)
+        ).all()
+        spec = {
+            "rules": rules_state.rules,
+            "conditions": rules_state.conditions,
+            "products": [_product_to_dict(product) for product in products],
+            "taskDefinitions": [_task_definition_to_dict(task_def) for task_def in task_defs],
+        }
+        spec_cache.set(cache_key, spec)
+    return version, spec
 
 
 def _update_rule_usage(
     session: Session,
+    user_id: str,
     rule_key: str,
+    target_date,
     completed_at,
     rule_usage: Dict[str, RuleUsage],
 ) -> None:
     usage = rule_usage.get(rule_key)
     if usage is None:
-        usage = RuleUsage(rule_key=rule_key)
+        usage = RuleUsage(user_id=user_id, rule_key=rule_key)
     usage.last_used_at = completed_at
     session.add(usage)
+    rule_usage[rule_key] = usage
+    record_rotation_use(session, user_id, rule_key, target_date)
 
 
 def _apply_serum_usage_updates(
     session: Session,
+    user_id: str,
     task_definition_id: str,
     target_date,
     completed_at,
 ) -> None:
-    rules_state = _get_rules_state(session)
-    rules = rules_state.rules
-    conditions = rules_state.conditions
-
-    if conditions.get("lazy_mode"):
+    rules_state = get_rules_state(session, user_id)
+    plan = get_rule_plan(rules_state)
+    if plan.lazy_mode:
         return
 
-    rule_usage = _get_rule_usage(session)
+    rule_usage = get_rule_usage(session, user_id)
+    rule_key = serum_rule_key_for_completion(
+        task_definition_id, plan, rules_state.conditions, rule_usage, target_date
+    )
+    if rule_key is not None:
+        _update_rule_usage(session, user_id, rule_key, target_date, completed_at, rule_usage)
+
+
+def _validate_conditions(conditions: Dict[str, Any]) -> None:
+    for key, value in conditions.items():
+        if key not in DEFAULT_CONDITIONS:
+            raise HTTPException(status_code=400, detail=f"Unknown condition: {key}")
+        if not isinstance(value, bool):
+            raise HTTPException(status_code=400, detail=f"Condition {key} must be boolean")
+
 
-    vitc_id = rules.get("amSerumRotation", {}).get("vitc", {}).get("productId")
-    niacin_id = (
-        rules.get("pmSerumRotation", {})
-        .get("highNiacinamide", {})
-        .get("productId")
+def _delete_task_definition(session: Session, user_id: str, task_def: TaskDefinition) -> None:
+    status = session.get(TaskStatus, (user_id, task_def.id))
+    if status is not None:
+        session.delete(status)
+    session.exec(
+        delete(TaskEvent).where(
+            TaskEvent.user_id == user_id, TaskEvent.task_definition_id == task_def.id
+        )
     )
+    delete_task_stats(session, user_id, task_def.id)
+    session.delete(task_def)
+    record_task_definition_deleted(session, user_id, task_def.id)
 
-    am_selected = select_am_serum(rules, conditions, rule_usage, target_date)
 
-    if task_definition_id == "skin_am" and vitc_id and am_selected == vitc_id:
-        _update_rule_usage(session, RULE_KEY_AM_VITC, completed_at, rule_usage)
-        return
+def _refresh_status_due_date(session: Session, user_id: str, task_def: TaskDefinition) -> None:
+    status = session.get(TaskStatus, (user_id, task_def.id))
+    if status is not None:
+        refresh_next_due(status, task_def.interval_days)
+        session.add(status)
+
+
+def _model_to_dict(model: BaseModel) -> Dict[str, Any]:
+    if hasattr(model, "model_dump"):
+        return model.model_dump()
+    return model.dict()
+
+
+def _spec_section_by_id(
+    spec: Dict[str, Any], section: str, schema: Type[BaseModel]
+) -> Dict[str, Dict[str, Any]]:
+    items = spec.get(section)
+    if not isinstance(items, list):
+        raise HTTPException(status_code=400, detail=f"{section} must be a list")
+
+    by_id: Dict[str, Dict[str, Any]] = {}
+    for item in items:
+        if not isinstance(item, dict):
+            raise HTTPException(status_code=400, detail=f"{section} entries must be objects")
+        try:
+            values = _model_to_dict(schema(**item))
+        except ValidationError as exc:
+            raise HTTPException(status_code=400, detail=f"Invalid {section} entry") from exc
+        if values["id"] in by_id:
+            raise HTTPException(
+                status_code=400, detail=f"Duplicate {section} id: {values['id']}"
+            )
+        if "is_active" in item:
+            values["is_active"] = item["is_active"]
+        by_id[values["id"]] = values
+    return by_id
+
+
+def _apply_product_changes(
+    session: Session,
+    user_id: str,
+    current: Dict[str, Dict[str, Any]],
+    patched: Dict[str, Dict[str, Any]],
+) -> int:
+    changed = 0
+    for product_id, values in patched.items():
+        values = {**values, "is_active": bool(values.get("is_active", True))}
+        if current.get(product_id) == values:
+            continue
+        # Deactivated products are not in the snapshot, so re-adding one revives the row.
+        product = session.get(Product, (user_id, product_id))
+        if product is None:
+            product = Product(user_id=user_id, **values)
+        else:
+            for key, value in values.items():
+                setattr(product, key, value)
+        session.add(product)
+        changed += 1
+
+    for product_id in current.keys() - patched.keys():
+        product = session.get(Product, (user_id, product_id))
+        product.is_active = False
+        session.add(product)
+        changed += 1
+    return changed
+
 
-    if task_definition_id == "skin_pm" and niacin_id:
-        pm_selected = select_pm_serum(rules, conditions, rule_usage, target_date, am_selected)
-        if pm_selected == niacin_id:
-            _update_rule_usage(session, RULE_KEY_PM_HIGH_NIACIN, completed_at, rule_usage)
+def _apply_task_definition_changes(
+    session: Session,
+    user_id: str,
+    current: Dict[str, Dict[str, Any]],
+    patched: Dict[str, Dict[str, Any]],
+) -> int:
+    changed = 0
+    for task_definition_id, values in patched.items():
+        if current.get(task_definition_id) == values:
+            continue
+        fields = {key: value for key, value in values.items() if key != "type"}
+        task_def = session.get(TaskDefinition, (user_id, task_definition_id))
+        if task_def is None:
+            task_def = TaskDefinition(user_id=user_id, task_type=values["type"], **fields)
+        else:
+            task_def.task_type = values["type"]
+            for key, value in fields.items():
+                setattr(task_def, key, value)
+            _refresh_status_due_date(session, user_id, task_def)
+        session.add(task_def)
+        changed += 1
+
+    for task_definition_id in current.keys() - patched.keys():
+        task_def = session.get(TaskDefinition, (user_id, task_definition_id))
+        _delete_task_definition(session, user_id, task_def)
+        changed += 1
+    return changed
+
+
+def _record_task_event(
+    session: Session,
+    user_id: str,
+    status: TaskStatus,
+    task_def: TaskDefinition,
+    kind: str,
+    target_date,
+    occurred_at,
+) -> None:
+    if kind == EVENT_COMPLETE:
+        status.last_completed_at = occurred_at
+        record_completion(status, task_def.interval_days, target_date)
+    else:
+        status.last_skipped_at = occurred_at
+    session.add(status)
+    record_task_day(session, user_id, task_def, target_date, kind)
+    session.add(
+        TaskEvent(
+            user_id=user_id,
+            task_definition_id=status.task_definition_id,
+            kind=kind,
+            instance_date=target_date,
+            occurred_at=occurred_at,
+        )
+    )
 
 
 @app.get("/api/time", response_model=TimeResponse)
@@ -149,61 +407,304 @@ def get_time() -> Dict[str, str]:
     return {"nowKstIso": kst_now().isoformat()}
 
 
-@app.get("/api/today", response_model=TodayResponse)
+def _etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = {value.strip() for value in if_none_match.split(",")}
+    return "*" in candidates or etag in candidates
+
+
+def _product_lookup(session: Session, user_id: str, version: int) -> Dict[str, Dict[str, Any]]:
+    products = product_cache.get((user_id, version))
+    if products is None:
+        rows = session.exec(
+            select(Product.id, Product.name, Product.category, Product.role, Product.is_active)
+            .where(Product.user_id == user_id)
+        ).all()
+        products = {
+            product_id: {
+                "id": product_id,
+                "name": name,
+                "category": category,
+                "role": role,
+                "is_active": is_active,
+            }
+            for product_id, name, category, role, is_active in rows
+        }
+        product_cache.set((user_id, version), products)
+    return products
+
+
+def _referenced_products(
+    cards: List[Card], lookup: Dict[str, Dict[str, Any]]
+) -> Dict[str, Dict[str, Any]]:
+    return {
+        product_id: lookup[product_id]
+        for card in cards
+        for step in card.steps
+        for product_id in step.products
+        if product_id in lookup
+    }
+
+
+def _today_cards(
+    session: Session, user_id: str, target_date, expand_products: bool = False
+) -> Tuple[List[Card], Dict[str, Dict[str, Any]] | None, str]:
+    version = get_state_version(session, user_id)
+    cache_key = (user_id, target_date, version)
+    cached = today_cache.get(cache_key)
+    if cached is None:
+        plan = load_daily_plan(session, user_id, target_date, version)
+        if plan is not None:
+            cached = ([card_from_dict(card) for card in plan.cards], None, plan.etag)
+        else:
+            inputs = load_schedule_inputs(session, user_id, target_date, target_date)
+            with timed("scheduler"):
+                cards = build_today_cards(target_date=target_date, **inputs)
+            cached = (cards, None, cards_etag(target_date, cards))
+        today_cache.set(cache_key, cached)
+    if not expand_products:
+        return cached
+
+    # Product edits bump the state version, so the expanded payload can be
+    # cached next to the plain one.
+    expanded_key = cache_key + (EXPAND_PRODUCTS,)
+    expanded = today_cache.get(expanded_key)
+    if expanded is None:
+        cards, _, etag = cached
+        products = _referenced_products(cards, _product_lookup(session, user_id, version))
+        digest = hashlib.sha1(dumps([etag, products])).hexdigest()
+        expanded = (cards, products, f'W/"{digest}"')
+        today_cache.set(expanded_key, expanded)
+    return expanded
+
+
+@app.get("/api/metrics", include_in_schema=False)
+def get_metrics() -> Response:
+    if not METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    return Response(registry.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/api/today", response_model=TodayResponse, response_model_exclude_none=True)
 def get_today(
-    date: str | None = None, session: Session = Depends(get_session)
-) -> Dict[str, Any]:
+    request: Request,
+    date: str | None = None,
+    expand: str | None = None,
+    session: Session = Depends(get_session),
+    user_id: str = Depends(get_user_id),
+) -> Any:
     target_date = parse_date(date) if date else kst_now().date()
+    if expand not in (None, EXPAND_PRODUCTS):
+        raise HTTPException(status_code=400, detail="expand must be 'products'")
+
+    cards, products, etag = _today_cards(
+        session, user_id, target_date, expand == EXPAND_PRODUCTS
+    )
+
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
 
-    task_defs = session.exec(select(TaskDefinition)).all()
-    status_map = {
-        status.task_definition_id: status
-        for status in session.exec(select(TaskStatus)).all()
+    content: Dict[str, Any] = {
+        "date": target_date.isoformat(),
+        "nowKstIso": kst_now().isoformat(),
+        "cards": cards,
     }
+    if products is not None:
+        content["products"] = products
+    with timed("serialize"):
+        return FastJSONResponse(content, headers=headers)
+
+
+def _stream_cards(
+    session: Session, user_id: str, target_date
+) -> Tuple[int, List[Card]]:
+    version = get_state_version(session, user_id)
+    cards, _, _ = _today_cards(session, user_id, target_date)
+    return version, cards
+
+
+def _with_session(func: Callable[..., T], *args: Any) -> T:
+    with Session(engine) as session:
+        return func(session, *args)
+
+
+async def _load_stream_cards(user_id: str, target_date) -> Tuple[int, List[Card]]:
+    # Building cards is CPU work; off the event loop it cannot stall other streams.
+    return await run_in_threadpool(_with_session, _stream_cards, user_id, target_date)
+
+
+def _card_diff(previous: List[Card], cards: List[Card]) -> Tuple[List[Card], List[str]]:
+    previous_by_id = {card.taskInstanceId: card for card in previous}
+    current_ids = {card.taskInstanceId for card in cards}
+    changed = [card for card in cards if previous_by_id.get(card.taskInstanceId) != card]
+    removed = [card_id for card_id in previous_by_id if card_id not in current_ids]
+    return changed, removed
+
 
-    rules_state = _get_rules_state(session)
-    rule_usage = _get_rule_usage(session)
+def _sse_event(name: str, data: Dict[str, Any]) -> str:
+    payload = dumps(data).decode("utf-8")
+    return f"event: {name}\ndata: {payload}\n\n"
 
-    cards = build_today_cards(
-        task_defs,
-        status_map,
-        rules_state.rules,
-        rules_state.conditions,
-        rule_usage,
-        target_date,
+
+async def _card_events(request: Request, user_id: str, fixed_date=None):
+    subscription = broker.subscribe(user_id)
+    try:
+        target_date = fixed_date or kst_now().date()
+        version, cards = await _load_stream_cards(user_id, target_date)
+        yield _sse_event(
+            "snapshot", {"date": target_date.isoformat(), "version": version, "cards": cards}
+        )
+
+        while not await request.is_disconnected():
+            try:
+                await asyncio.wait_for(subscription.queue.get(), STREAM_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                if fixed_date is not None or kst_now().date() == target_date:
+                    yield ": keepalive\n\n"
+                    continue
+            # Several commits may have landed; one reload covers all of them.
+            while not subscription.queue.empty():
+                subscription.queue.get_nowait()
+
+            current_date = fixed_date or kst_now().date()
+            version, latest = await _load_stream_cards(user_id, current_date)
+            if current_date != target_date:
+                target_date, cards = current_date, latest
+                yield _sse_event(
+                    "snapshot",
+                    {"date": target_date.isoformat(), "version": version, "cards": cards},
+                )
+                continue
+
+            changed, removed = _card_diff(cards, latest)
+            cards = latest
+            if changed or removed:
+                yield _sse_event(
+                    "diff",
+                    {
+                        "date": target_date.isoformat(),
+                        "version": version,
+                        "changed": changed,
+                        "removed": removed,
+                    },
+                )
+    finally:
+        broker.unsubscribe(subscription)
+
+
+@app.get("/api/stream")
+async def stream_today(
+    request: Request,
+    date: str | None = None,
+    user_id: str = Depends(get_user_id),
+) -> StreamingResponse:
+    try:
+        fixed_date = parse_date(date) if date else None
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
+    return StreamingResponse(
+        _card_events(request, user_id, fixed_date),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
 
+
+@app.get("/api/schedule", response_model=ScheduleResponse)
+def get_schedule(
+    from_: str = Query(alias="from"),
+    to: str = Query(),
+    session: Session = Depends(get_session),
+    user_id: str = Depends(get_user_id),
+) -> Any:
+    try:
+        start_date = parse_date(from_)
+        end_date = parse_date(to)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
+
+    if end_date < start_date:
+        raise HTTPException(status_code=400, detail="'to' must not be before 'from'")
+    if (end_date - start_date).days >= MAX_SCHEDULE_DAYS:
+        raise HTTPException(
+            status_code=400, detail=f"Range must be at most {MAX_SCHEDULE_DAYS} days"
+        )
+
+    inputs = load_schedule_inputs(session, user_id, start_date, end_date)
+    with timed("scheduler"):
+        days = build_range_cards(start_date=start_date, end_date=end_date, **inputs)
+
+    with timed("serialize"):
+        return FastJSONResponse(
+            {
+                "from": start_date.isoformat(),
+                "to": end_date.isoformat(),
+                "nowKstIso": kst_now().isoformat(),
+                "days": days,
+            }
+        )
+
+
+def _stats_payload(session: Session, user_id: str, start_date, end_date) -> Dict[str, Any]:
     return {
-        "date": target_date.isoformat(),
-        "nowKstIso": kst_now().isoformat(),
-        "cards": cards,
+        "from": start_date.isoformat(),
+        "to": end_date.isoformat(),
+        "tasks": load_task_stats(session, user_id, start_date, end_date),
+        "rotations": load_rotation_stats(session, user_id, start_date, end_date),
     }
 
 
+@app.get("/api/stats", response_model=StatsResponse)
+def get_stats(
+    from_: str | None = Query(default=None, alias="from"),
+    to: str | None = None,
+    session: Session = Depends(get_session),
+    user_id: str = Depends(get_user_id),
+) -> Dict[str, Any]:
+    try:
+        end_date = parse_date(to) if to else kst_now().date()
+        start_date = (
+            parse_date(from_) if from_ else end_date - timedelta(days=DEFAULT_STATS_DAYS - 1)
+        )
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
+    if end_date < start_date:
+        raise HTTPException(status_code=400, detail="'to' must not be before 'from'")
+
+    return _stats_payload(session, user_id, start_date, end_date)
+
+
 @app.post("/api/complete", response_model=CompleteResponse)
 def complete_task(
-    payload: CompleteRequest, session: Session = Depends(get_session)
+    payload: CompleteRequest,
+    session: Session = Depends(get_session),
+    user_id: str = Depends(get_user_id),
 ) -> Dict[str, Any]:
     try:
         task_definition_id, target_date = parse_task_instance_id(payload.taskInstanceId)
     except ValueError as exc:
         raise HTTPException(status_code=400, detail=str(exc)) from exc
 
-    task_def = session.get(TaskDefinition, task_definition_id)
+    task_def = session.get(TaskDefinition, (user_id, task_definition_id))
     if task_def is None:
         raise HTTPException(status_code=404, detail="Task definition not found")
 
     completed_at = parse_iso_datetime(payload.completedAtIso)
-    status = session.get(TaskStatus, task_definition_id)
+    status = session.get(TaskStatus, (user_id, task_definition_id))
     if status is None:
-        status = TaskStatus(task_definition_id=task_definition_id)
+        status = TaskStatus(user_id=user_id, task_definition_id=task_definition_id)
 
-    status.last_completed_at = completed_at
-    session.add(status)
+    _record_task_event(
+        session, user_id, status, task_def, EVENT_COMPLETE, target_date, completed_at
+    )
 
-    if task_definition_id in {"skin_am", "skin_pm"}:
-        _apply_serum_usage_updates(session, task_definition_id, target_date, completed_at)
+    if task_definition_id in SERUM_TASK_IDS:
+        _apply_serum_usage_updates(
+            session, user_id, task_definition_id, target_date, completed_at
+        )
 
+    bump_state_version(session, user_id)
     session.commit()
 
     return {
@@ -214,23 +715,27 @@ def complete_task(
 
 
 @app.post("/api/skip", response_model=SkipResponse)
-def skip_task(payload: SkipRequest, session: Session = Depends(get_session)) -> Dict[str, Any]:
+def skip_task(
+    payload: SkipRequest,
+    session: Session = Depends(get_session),
+    user_id: str = Depends(get_user_id),
+) -> Dict[str, Any]:
     try:
-        task_definition_id, _ = parse_task_instance_id(payload.taskInstanceId)
+        task_definition_id, target_date = parse_task_instance_id(payload.taskInstanceId)
     except ValueError as exc:
         raise HTTPException(status_code=400, detail=str(exc)) from exc
 
-    task_def = session.get(TaskDefinition, task_definition_id)
+    task_def = session.get(TaskDefinition, (user_id, task_definition_id))
     if task_def is None:
         raise HTTPException(status_code=404, detail="Task definition not found")
 
     skipped_at = parse_iso_datetime(payload.skippedAtIso)
-    status = session.get(TaskStatus, task_definition_id)
+    status = session.get(TaskStatus, (user_id, task_definition_id))
     if status is None:
-        status = TaskStatus(task_definition_id=task_definition_id)
+        status = TaskStatus(user_id=user_id, task_definition_id=task_definition_id)
 
-    status.last_skipped_at = skipped_at
-    session.add(status)
+    _record_task_event(session, user_id, status, task_def, EVENT_SKIP, target_date, skipped_at)
+    bump_state_version(session, user_id)
     session.commit()
 
     return {
@@ -240,20 +745,103 @@ def skip_task(payload: SkipRequest, session: Session = Depends(get_session)) ->
     }
 
 
+@app.post("/api/events/batch", response_model=EventBatchResponse)
+def record_event_batch(
+    payload: EventBatchRequest,
+    session: Session = Depends(get_session),
+    user_id: str = Depends(get_user_id),
+) -> Dict[str, Any]:
+    if len(payload.events) > MAX_BATCH_EVENTS:
+        raise HTTPException(
+            status_code=400, detail=f"At most {MAX_BATCH_EVENTS} events per batch"
+        )
+
+    task_defs = {
+        task_def.id: task_def
+        for task_def in session.exec(
+            select(TaskDefinition).where(TaskDefinition.user_id == user_id)
+        )
+    }
+    events = []
+    for index, event in enumerate(payload.events):
+        if event.kind not in {EVENT_COMPLETE, EVENT_SKIP}:
+            raise HTTPException(
+                status_code=400, detail=f"events[{index}]: unknown kind {event.kind}"
+            )
+        try:
+            task_definition_id, target_date = parse_task_instance_id(event.taskInstanceId)
+            occurred_at = parse_iso_datetime(event.occurredAtIso)
+        except ValueError as exc:
+            raise HTTPException(status_code=400, detail=f"events[{index}]: {exc}") from exc
+        if task_definition_id not in task_defs:
+            raise HTTPException(
+                status_code=404,
+                detail=f"events[{index}]: task definition {task_definition_id} not found",
+            )
+        events.append((occurred_at, index, task_definition_id, target_date, event.kind))
+    events.sort()
+
+    statuses = session.exec(select(TaskStatus).where(TaskStatus.user_id == user_id)).all()
+    status_map = {status.task_definition_id: status for status in statuses}
+    rules_state = get_rules_state(session, user_id)
+    plan = get_rule_plan(rules_state)
+    rule_usage = get_rule_usage(session, user_id)
+
+    for occurred_at, _, task_definition_id, target_date, kind in events:
+        status = status_map.get(task_definition_id)
+        if status is None:
+            status = TaskStatus(user_id=user_id, task_definition_id=task_definition_id)
+            status_map[task_definition_id] = status
+        _record_task_event(
+            session,
+            user_id,
+            status,
+            task_defs[task_definition_id],
+            kind,
+            target_date,
+            occurred_at,
+        )
+
+        if kind != EVENT_COMPLETE or task_definition_id not in SERUM_TASK_IDS or plan.lazy_mode:
+            continue
+        rule_key = serum_rule_key_for_completion(
+            task_definition_id, plan, rules_state.conditions, rule_usage, target_date
+        )
+        if rule_key is not None:
+            _update_rule_usage(
+                session, user_id, rule_key, target_date, occurred_at, rule_usage
+            )
+
+    if events:
+        bump_state_version(session, user_id)
+        session.commit()
+
+    return {"ok": True, "applied": len(events)}
+
+
 @app.get("/api/tasks", response_model=List[TaskDefinitionRead])
-def list_task_definitions(session: Session = Depends(get_session)) -> List[TaskDefinitionRead]:
-    task_defs = session.exec(select(TaskDefinition)).all()
+async def list_task_definitions(
+    session: AsyncSession = Depends(get_async_session),
+    user_id: str = Depends(get_user_id),
+) -> List[TaskDefinitionRead]:
+    result = await session.exec(
+        select(TaskDefinition).where(TaskDefinition.user_id == user_id)
+    )
+    task_defs = result.all()
     return [_task_definition_to_read(task_def) for task_def in task_defs]
 
 
 @app.post("/api/tasks", response_model=TaskDefinitionRead, status_code=201)
 def create_task_definition(
-    payload: TaskDefinitionCreate, session: Session = Depends(get_session)
+    payload: TaskDefinitionCreate,
+    session: Session = Depends(get_session),
+    user_id: str = Depends(get_user_id),
 ) -> TaskDefinitionRead:
-    if session.get(TaskDefinition, payload.id) is not None:
+    if session.get(TaskDefinition, (user_id, payload.id)) is not None:
         raise HTTPException(status_code=409, detail="Task definition id already exists")
 
     task_def = TaskDefinition(
+        user_id=user_id,
         id=payload.id,
         slot=payload.slot,
         task_type=payload.type,
@@ -262,6 +850,7 @@ def create_task_definition(
         cron_weekdays=payload.cron_weekdays,
     )
     session.add(task_def)
+    bump_state_version(session, user_id)
     session.commit()
     session.refresh(task_def)
     return _task_definition_to_read(task_def)
@@ -269,9 +858,12 @@ def create_task_definition(
 
 @app.patch("/api/tasks/{id}", response_model=TaskDefinitionRead)
 def update_task_definition(
-    id: str, payload: TaskDefinitionUpdate, session: Session = Depends(get_session)
+    id: str,
+    payload: TaskDefinitionUpdate,
+    session: Session = Depends(get_session),
+    user_id: str = Depends(get_user_id),
 ) -> TaskDefinitionRead:
-    task_def = session.get(TaskDefinition, id)
+    task_def = session.get(TaskDefinition, (user_id, id))
     if task_def is None:
         raise HTTPException(status_code=404, detail="Task definition not found")
 
@@ -285,41 +877,87 @@ def update_task_definition(
 
     for key, value in updates.items():
         setattr(task_def, key, value)
+    if "interval_days" in updates:
+        _refresh_status_due_date(session, user_id, task_def)
 
     session.add(task_def)
+    bump_state_version(session, user_id)
     session.commit()
     session.refresh(task_def)
     return _task_definition_to_read(task_def)
 
 
 @app.delete("/api/tasks/{id}", response_model=DeleteResponse)
-def delete_task_definition(id: str, session: Session = Depends(get_session)) -> Dict[str, Any]:
-    task_def = session.get(TaskDefinition, id)
+def delete_task_definition(
+    id: str, session: Session = Depends(get_session), user_id: str = Depends(get_user_id)
+) -> Dict[str, Any]:
+    task_def = session.get(TaskDefinition, (user_id, id))
     if task_def is None:
         raise HTTPException(status_code=404, detail="Task definition not found")
 
-    status = session.get(TaskStatus, id)
-    if status is not None:
-        session.delete(status)
-
-    session.delete(task_def)
+    _delete_task_definition(session, user_id, task_def)
+    bump_state_version(session, user_id)
     session.commit()
     return {"ok": True, "id": id}
 
 
+def _list_products(
+    session: Session,
+    user_id: str,
+    category: str | None,
+    role: str | None,
+    q: str | None,
+    after: str | None,
+    limit: int | None,
+) -> Tuple[List[Product], str | None]:
+    statement = select(Product).where(Product.user_id == user_id, Product.is_active == True)
+    if category is not None:
+        statement = statement.where(Product.category == category)
+    if role is not None:
+        statement = statement.where(Product.role == role)
+    if q and q.strip():
+        statement = statement.where(product_name_filter(session.connection(), user_id, q))
+    if after is not None:
+        statement = statement.where(Product.id > after)
+    statement = statement.order_by(Product.id)
+    if limit is None:
+        return session.exec(statement).all(), None
+
+    products = session.exec(statement.limit(limit + 1)).all()
+    if len(products) > limit:
+        products = products[:limit]
+        return products, products[-1].id
+    return products, None
+
+
 @app.get("/api/products", response_model=List[ProductRead])
-def list_products(session: Session = Depends(get_session)) -> List[Product]:
-    return session.exec(select(Product).where(Product.is_active == True)).all()
+def list_products(
+    response: Response,
+    category: str | None = None,
+    role: str | None = None,
+    q: str | None = Query(default=None, max_length=100),
+    after: str | None = None,
+    limit: int | None = Query(default=None, ge=1, le=MAX_PRODUCT_PAGE_SIZE),
+    session: Session = Depends(get_session),
+    user_id: str = Depends(get_user_id),
+) -> List[Product]:
+    products, next_cursor = _list_products(session, user_id, category, role, q, after, limit)
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return products
 
 
 @app.post("/api/products", response_model=ProductRead, status_code=201)
 def create_product(
-    payload: ProductCreate, session: Session = Depends(get_session)
+    payload: ProductCreate,
+    session: Session = Depends(get_session),
+    user_id: str = Depends(get_user_id),
 ) -> Product:
-    if session.get(Product, payload.id) is not None:
+    if session.get(Product, (user_id, payload.id)) is not None:
         raise HTTPException(status_code=409, detail="Product id already exists")
 
     product = Product(
+        user_id=user_id,
         id=payload.id,
         name=payload.name,
         category=payload.category,
@@ -329,6 +967,7 @@ def create_product(
         is_active=True,
     )
     session.add(product)
+    bump_state_version(session, user_id)
     session.commit()
     session.refresh(product)
     return product
@@ -336,9 +975,12 @@ def create_product(
 
 @app.patch("/api/products/{id}", response_model=ProductRead)
 def update_product(
-    id: str, payload: ProductUpdate, session: Session = Depends(get_session)
+    id: str,
+    payload: ProductUpdate,
+    session: Session = Depends(get_session),
+    user_id: str = Depends(get_user_id),
 ) -> Product:
-    product = session.get(Product, id)
+    product = session.get(Product, (user_id, id))
     if product is None:
         raise HTTPException(status_code=404, detail="Product not found")
 
@@ -350,61 +992,190 @@ def update_product(
         setattr(product, key, value)
 
     session.add(product)
+    bump_state_version(session, user_id)
     session.commit()
     session.refresh(product)
     return product
 
 
 @app.delete("/api/products/{id}", response_model=DeleteResponse)
-def delete_product(id: str, session: Session = Depends(get_session)) -> Dict[str, Any]:
-    product = session.get(Product, id)
+def delete_product(
+    id: str, session: Session = Depends(get_session), user_id: str = Depends(get_user_id)
+) -> Dict[str, Any]:
+    product = session.get(Product, (user_id, id))
     if product is None:
         raise HTTPException(status_code=404, detail="Product not found")
 
     product.is_active = False
     session.add(product)
+    bump_state_version(session, user_id)
     session.commit()
 
     return {"ok": True, "id": id}
 
 
 @app.get("/api/rules", response_model=RulesResponse)
-def get_rules(session: Session = Depends(get_session)) -> Dict[str, Any]:
-    rules_state = _get_rules_state(session)
+def get_rules(
+    session: Session = Depends(get_session),
+    user_id: str = Depends(get_user_id),
+) -> Dict[str, Any]:
+    rules_state = get_rules_state(session, user_id)
     return {"rules": rules_state.rules, "conditions": rules_state.conditions}
 
 
 @app.patch("/api/rules", response_model=RulesResponse)
 def patch_rules(
-    payload: RulesPatchRequest, session: Session = Depends(get_session)
+    payload: RulesPatchRequest,
+    session: Session = Depends(get_session),
+    user_id: str = Depends(get_user_id),
 ) -> Dict[str, Any]:
-    rules_state = _get_rules_state(session)
+    rules_state = get_rules_state(session, user_id)
 
     if payload.rules:
         rules_state.rules = _deep_merge(rules_state.rules, payload.rules)
 
     if payload.conditions:
-        for key, value in payload.conditions.items():
-            if key not in DEFAULT_CONDITIONS:
-                raise HTTPException(status_code=400, detail=f"Unknown condition: {key}")
-            if not isinstance(value, bool):
-                raise HTTPException(
-                    status_code=400, detail=f"Condition {key} must be boolean"
-                )
-            rules_state.conditions[key] = value
+        _validate_conditions(payload.conditions)
+        rules_state.conditions = {**rules_state.conditions, **payload.conditions}
 
     session.add(rules_state)
+    bump_state_version(session, user_id)
     session.commit()
     session.refresh(rules_state)
 
     return {"rules": rules_state.rules, "conditions": rules_state.conditions}
 
 
+def _sync_payload(session: Session, user_id: str, since: int | None) -> Dict[str, Any]:
+    cursor = get_state_version(session, user_id)
+    full = since is None or since > cursor
+    changes = load_changes(session, user_id, None if full else since)
+    rules_states = changes["rules_states"]
+    return {
+        "cursor": cursor,
+        "full": full,
+        "products": [_product_to_dict(product) for product in changes["products"]],
+        "taskDefinitions": [
+            _task_definition_to_dict(task_def) for task_def in changes["task_defs"]
+        ],
+        "taskStatuses": [
+            {
+                "taskDefinitionId": status.task_definition_id,
+                "lastCompletedAtIso": _isoformat_or_none(status.last_completed_at),
+                "lastSkippedAtIso": _isoformat_or_none(status.last_skipped_at),
+            }
+            for status in changes["statuses"]
+        ],
+        "rules": (
+            {"rules": rules_states[-1].rules, "conditions": rules_states[-1].conditions}
+            if rules_states
+            else None
+        ),
+        "deletedTaskDefinitionIds": changes["deleted_task_definition_ids"],
+    }
+
+
+@app.get("/api/sync", response_model=SyncResponse)
+def get_sync(
+    since: int | None = Query(default=None, ge=0),
+    session: Session = Depends(get_session),
+    user_id: str = Depends(get_user_id),
+) -> Dict[str, Any]:
+    return _sync_payload(session, user_id, since)
+
+
+@app.get("/api/spec", response_model=SpecSnapshot)
+def get_spec(
+    request: Request,
+    response: Response,
+    session: Session = Depends(get_session),
+    user_id: str = Depends(get_user_id),
+) -> Any:
+    version, spec = _spec_snapshot(session, user_id)
+
+    etag = f'W/"spec-{version}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+
+    return {"version": version, "spec": spec}
+
+
+@app.post("/api/spec/apply", response_model=SpecApplyResponse)
+def apply_spec_patch(
+    payload: SpecApplyRequest,
+    session: Session = Depends(get_session),
+    user_id: str = Depends(get_user_id),
+) -> Dict[str, Any]:
+    version, spec = _spec_snapshot(session, user_id)
+    if payload.specVersion is not None and payload.specVersion != version:
+        raise HTTPException(status_code=409, detail="Spec changed since specVersion")
+
+    try:
+        patched = jsonpatch.JsonPatch(payload.jsonPatch).apply(spec, in_place=False)
+    except (jsonpatch.JsonPatchException, jsonpatch.JsonPointerException) as exc:
+        raise HTTPException(status_code=400, detail=f"Invalid JSON Patch: {exc}") from exc
+
+    if not isinstance(patched, dict):
+        raise HTTPException(status_code=400, detail="Patched spec must be an object")
+    rules = patched.get("rules")
+    conditions = patched.get("conditions")
+    if not isinstance(rules, dict) or not isinstance(conditions, dict):
+        raise HTTPException(status_code=400, detail="rules and conditions must be objects")
+    _validate_conditions(conditions)
+
+    changed = _apply_product_changes(
+        session,
+        user_id,
+        _spec_section_by_id(spec, "products", ProductRead),
+        _spec_section_by_id(patched, "products", ProductCreate),
+    )
+    changed += _apply_task_definition_changes(
+        session,
+        user_id,
+        _spec_section_by_id(spec, "taskDefinitions", TaskDefinitionCreate),
+        _spec_section_by_id(patched, "taskDefinitions", TaskDefinitionCreate),
+    )
+
+    rules_changed = rules != spec["rules"] or conditions != spec["conditions"]
+    if rules_changed:
+        rules_state = get_rules_state(session, user_id)
+        rules_state.rules = rules
+        rules_state.conditions = conditions
+        session.add(rules_state)
+        changed += 1
+
+    if changed:
+        bump_state_version(session, user_id)
+        session.commit()
+        version, spec = _spec_snapshot(session, user_id)
+
+    return {"version": version, "spec": spec, "changed": changed}
+
+
 @app.post("/api/ai/patch", response_model=AiPatchResponse)
-def ai_patch(payload: AiPatchRequest) -> Dict[str, Any]:
-    return generate_ai_patch(
+async def ai_patch(
+    payload: AiPatchRequest,
+    user_id: str = Depends(get_user_id),
+) -> Dict[str, Any]:
+    spec_version = None
+    current_spec = payload.currentSpec
+    if current_spec is None:
+        # The session closes before the wait on the AI provider.
+        spec_version, spec = await run_in_threadpool(_with_session, _spec_snapshot, user_id)
+        current_spec = select_spec_slices(spec, payload.userInstruction)
+
+    result = await generate_ai_patch(
         payload.userInstruction,
-        payload.currentSpec,
+        current_spec,
         payload.apiKey,
         payload.modelName,
+        user_id,
     )
+    return {**result, "specVersion": spec_version}
+
+
+@app.get("/api/ai/cache", response_model=AiCacheStats)
+def get_ai_cache_stats(user_id: str = Depends(get_user_id)) -> Dict[str, int]:
+    return ai_response_cache.stats(user_id)
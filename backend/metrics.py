@@ -0,0 +1,233 @@
+﻿from __future__ import annotations
+
+import functools
+import inspect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from fastapi import FastAPI, Request, Response
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+PHASES = ("db", "scheduler", "serialize")
+
+
+class RequestMetrics:
+    __slots__ = ("phases", "queries", "endpoint_done", "_query_started")
+
+    def __init__(self) -> None:
+        self.phases: Dict[str, float] = dict.fromkeys(PHASES, 0.0)
+        self.queries = 0
+        self.endpoint_done: Optional[float] = None
+        self._query_started: List[float] = []
+
+    def add(self, phase: str, seconds: float) -> None:
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+
+_current: ContextVar[Optional[RequestMetrics]] = ContextVar("request_metrics", default=None)
+
+
+@contextmanager
+def timed(phase: str) -> Iterator[None]:
+    metrics = _current.get()
+    if metrics is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.add(phase, time.perf_counter() - started)
+
+
+class _RouteStats:
+    __slots__ = ("count", "total", "buckets", "queries", "phases")
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.total = 0.0
+        self.buckets = [0] * len(DURATION_BUCKETS)
+        self.queries = 0
+        self.phases: Dict[str, float] = dict.fromkeys(PHASES, 0.0)
+
+
+class MetricsRegistry:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._routes: Dict[Tuple[str, str], _RouteStats] = {}
+
+    def observe(self, method: str, route: str, total: float, metrics: RequestMetrics) -> None:
+        with self._lock:
+            stats = self._routes.get((method, route))
+            if stats is None:
+                stats = self._routes[(method, route)] = _RouteStats()
+            stats.count += 1
+            stats.total += total
+            for index, bound in enumerate(DURATION_BUCKETS):
+                if total <= bound:
+                    stats.buckets[index] += 1
+            stats.queries += metrics.queries
+            for phase, seconds in metrics.phases.items():
+                stats.phases[phase] = stats.phases.get(phase, 0.0) + seconds
+
+    def clear(self) -> None:
+        with self._lock:
+            self._routes.clear()
+
+    def render(self) -> str:
+        with self._lock:
+            routes = sorted(self._routes.items())
+            lines = [
+                "# HELP routine_request_duration_seconds Request wall time.",
+                "# TYPE routine_request_duration_seconds histogram",
+            ]
+            for (method, route), stats in routes:
+                labels = f'method="{method}",route="{route}"'
+                for bound, count in zip(DURATION_BUCKETS, stats.buckets):
+                    lines.append(
+                        f'routine_request_duration_seconds_bucket{{{labels},le="{bound}"}} {count}'
+                    )
+                lines.append(
+                    f'routine_request_duration_seconds_bucket{{{labels},le="+Inf"}} {stats.count}'
+                )
+                lines.append(f"routine_request_duration_seconds_sum{{{labels}}} {stats.total}")
+                lines.append(f"routine_request_duration_seconds_count{{{labels}}} {stats.count}")
+
+            lines += [
+                "# HELP routine_db_queries_total Database statements executed.",
+                "# TYPE routine_db_queries_total counter",
+            ]
+            for (method, route), stats in routes:
+                labels = f'method="{method}",route="{route}"'
+                lines.append(f"routine_db_queries_total{{{labels}}} {stats.queries}")
+
+            for phase in PHASES:
+                lines += [
+                    f"# HELP routine_{phase}_seconds_total Time spent in {phase}.",
+                    f"# TYPE routine_{phase}_seconds_total counter",
+                ]
+                for (method, route), stats in routes:
+                    labels = f'method="{method}",route="{route}"'
+                    lines.append(
+                        f"routine_{phase}_seconds_total{{{labels}}} {stats.phases.get(phase, 0.0)}"
+                    )
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    metrics = _current.get()
+    if metrics is not None:
+        metrics._query_started.append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    metrics = _current.get()
+    if metrics is not None and metrics._query_started:
+        metrics.queries += 1
+        metrics.add("db", time.perf_counter() - metrics._query_started.pop())
+
+
+def _timed_endpoint(endpoint: Callable[..., Any]) -> Callable[..., Any]:
+    # Marks when the endpoint returns so the route handler can attribute the
+    # remaining time to response validation and serialization.
+    if inspect.iscoroutinefunction(endpoint):
+
+        @functools.wraps(endpoint)
+        async def async_wrapper(*args: Any, **kwargs: Any) -> Any:
+            try:
+                return await endpoint(*args, **kwargs)
+            finally:
+                _mark_endpoint_done()
+
+        return async_wrapper
+
+    @functools.wraps(endpoint)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        try:
+            return endpoint(*args, **kwargs)
+        finally:
+            _mark_endpoint_done()
+
+    return wrapper
+
+
+def _mark_endpoint_done() -> None:
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.endpoint_done = time.perf_counter()
+
+
+class TimedRoute(APIRoute):
+    def __init__(self, path: str, endpoint: Callable[..., Any], **kwargs: Any) -> None:
+        super().__init__(path, _timed_endpoint(endpoint), **kwargs)
+
+    def get_route_handler(self) -> Callable[[Request], Any]:
+        handler = super().get_route_handler()
+
+        async def timed_handler(request: Request) -> Response:
+            response = await handler(request)
+            metrics = _current.get()
+            if metrics is not None and metrics.endpoint_done is not None:
+                metrics.add("serialize", time.perf_counter() - metrics.endpoint_done)
+            return response
+
+        return timed_handler
+
+
+def _server_timing(total: float, metrics: RequestMetrics) -> str:
+    entries = [f"total;dur={total * 1000:.2f}"]
+    for phase in PHASES:
+        entries.append(f"{phase};dur={metrics.phases[phase] * 1000:.2f}")
+    entries[1] += f';desc="{metrics.queries} queries"'
+    return ", ".join(entries)
+
+
+class MetricsMiddleware:
+    # Plain ASGI so streamed responses pass through untouched when excluded.
+    def __init__(self, app: ASGIApp, exclude: Iterable[str] = ()) -> None:
+        self.app = app
+        self.exclude = frozenset(exclude)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["path"] in self.exclude:
+            await self.app(scope, receive, send)
+            return
+
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        started = time.perf_counter()
+
+        async def send_with_timing(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                total = time.perf_counter() - started
+                route_path = getattr(scope.get("route"), "path", "unmatched")
+                registry.observe(scope["method"], route_path, total, metrics)
+                MutableHeaders(scope=message).append(
+                    "Server-Timing", _server_timing(total, metrics)
+                )
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current.reset(token)
+
+
+def install_metrics(app: FastAPI, exclude: Iterable[str] = ()) -> None:
+    # Must run before routes are declared so they are built as TimedRoute.
+    app.router.route_class = TimedRoute
+    if not event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+    app.add_middleware(MetricsMiddleware, exclude=exclude)
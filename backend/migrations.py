@@ -0,0 +1,105 @@
+﻿from __future__ import annotations
+
+from typing import Callable, List, Optional, Tuple
+
+from sqlalchemy import inspect, update
+from sqlalchemy.engine import Connection
+from sqlmodel import Session, SQLModel, select
+
+from .catalog import create_product_search
+from .db import (
+    add_missing_columns,
+    create_missing_indexes,
+    engine,
+    migrate_revision_columns,
+    migrate_tenant_columns,
+)
+from .due_index import backfill_due_projection
+from .models import SchemaVersion
+from .stats import backfill_task_stats
+from .seed import migrate_products, migrate_rules, migrate_skincare_tasks
+
+SCHEMA_VERSION_ID = 1
+
+
+def _data_migration(migrate: Callable[[Session], None]) -> Callable[[Connection], None]:
+    def run(connection: Connection) -> None:
+        # The session joins the caller's transaction; its commits do not end it.
+        with Session(bind=connection) as session:
+            migrate(session)
+
+    return run
+
+
+def _create_tables(connection: Connection) -> None:
+    SQLModel.metadata.create_all(connection)
+
+
+def _migrate_due_projection(connection: Connection) -> None:
+    add_missing_columns(connection)
+    create_missing_indexes(connection)
+    _data_migration(backfill_due_projection)(connection)
+
+
+# Append only: each entry runs once per database, in order.
+MIGRATIONS: List[Tuple[int, str, Callable[[Connection], None]]] = [
+    (1, "partition tables by user_id", migrate_tenant_columns),
+    (2, "add revision columns", migrate_revision_columns),
+    (3, "serum products become ampoules", _data_migration(migrate_products)),
+    (4, "trim skincare task steps", _data_migration(migrate_skincare_tasks)),
+    (5, "default hydration auto seasons", _data_migration(migrate_rules)),
+    (6, "product catalog indexes", create_missing_indexes),
+    (7, "product name search", create_product_search),
+    (8, "next due projection", _migrate_due_projection),
+    (9, "daily plan table", _create_tables),
+    (10, "task statistics", _data_migration(backfill_task_stats)),
+    (11, "substring product search", create_product_search),
+]
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def current_schema_version(connection: Connection) -> Optional[int]:
+    if not inspect(connection).has_table(SchemaVersion.__tablename__):
+        return None
+    return connection.execute(
+        select(SchemaVersion.version).where(SchemaVersion.id == SCHEMA_VERSION_ID)
+    ).scalar_one_or_none()
+
+
+def upgrade(connection: Connection) -> int:
+    SQLModel.metadata.create_all(connection)
+
+    # Take the write lock before reading so concurrent workers upgrade one at a time.
+    connection.execute(
+        update(SchemaVersion)
+        .where(SchemaVersion.id == SCHEMA_VERSION_ID)
+        .values(version=SchemaVersion.version)
+    )
+    current = current_schema_version(connection)
+    if current is None:
+        # New databases run every migration as well; on empty tables they only
+        # add what create_all cannot, such as the search table.
+        current = 0
+        connection.execute(
+            SchemaVersion.__table__.insert().values(id=SCHEMA_VERSION_ID, version=current)
+        )
+
+    for version, _, migrate in MIGRATIONS:
+        if version <= current:
+            continue
+        migrate(connection)
+        connection.execute(
+            update(SchemaVersion)
+            .where(SchemaVersion.id == SCHEMA_VERSION_ID)
+            .values(version=version)
+        )
+        current = version
+    return current
+
+
+def init_db() -> None:
+    with engine.connect() as connection:
+        if current_schema_version(connection) == LATEST_VERSION:
+            return
+    with engine.begin() as connection:
+        upgrade(connection)
@@ -1,13 +1,22 @@
 ﻿from __future__ import annotations
 
-from datetime import datetime
+from datetime import date, datetime
 from typing import Any, Dict, List, Optional
 
-from sqlalchemy import Boolean, Column, DateTime, JSON, String
+from sqlalchemy import Boolean, Column, DateTime, Index, JSON, String
 from sqlmodel import Field, SQLModel
 
+from .config import DEFAULT_USER_ID
+
 
 class Product(SQLModel, table=True):
+    __table_args__ = (
+        Index("ix_product_user_revision", "user_id", "revision"),
+        Index("ix_product_user_category", "user_id", "is_active", "category", "id"),
+        Index("ix_product_user_role", "user_id", "is_active", "role", "id"),
+    )
+
+    user_id: str = Field(default=DEFAULT_USER_ID, primary_key=True)
     id: str = Field(primary_key=True)
     name: str
     category: str
@@ -15,18 +24,30 @@ class Product(SQLModel, table=True):
     notes: Optional[str] = None
     verified: Dict[str, Any] = Field(default_factory=dict, sa_column=Column(JSON))
     is_active: bool = Field(default=True, sa_column=Column(Boolean))
+    revision: int = Field(default=0, sa_column_kwargs={"server_default": "0"})
 
 
 class TaskDefinition(SQLModel, table=True):
+    __table_args__ = (Index("ix_taskdefinition_user_revision", "user_id", "revision"),)
+
+    user_id: str = Field(default=DEFAULT_USER_ID, primary_key=True)
     id: str = Field(primary_key=True)
     slot: str
     task_type: str = Field(sa_column=Column("type", String))
     steps: List[Dict[str, Any]] = Field(default_factory=list, sa_column=Column(JSON))
     interval_days: Optional[int] = None
     cron_weekdays: Optional[List[int]] = Field(default=None, sa_column=Column(JSON))
+    weekday_mask: int = Field(default=0, sa_column_kwargs={"server_default": "0"})
+    revision: int = Field(default=0, sa_column_kwargs={"server_default": "0"})
 
 
 class TaskStatus(SQLModel, table=True):
+    __table_args__ = (
+        Index("ix_taskstatus_user_revision", "user_id", "revision"),
+        Index("ix_taskstatus_user_next_due", "user_id", "next_due_date"),
+    )
+
+    user_id: str = Field(default=DEFAULT_USER_ID, primary_key=True)
     task_definition_id: str = Field(primary_key=True)
     last_completed_at: Optional[datetime] = Field(
         default=None, sa_column=Column(DateTime(timezone=True))
@@ -34,16 +55,109 @@ class TaskStatus(SQLModel, table=True):
     last_skipped_at: Optional[datetime] = Field(
         default=None, sa_column=Column(DateTime(timezone=True))
     )
+    completed_through: Optional[date] = None
+    next_due_date: Optional[date] = None
+    revision: int = Field(default=0, sa_column_kwargs={"server_default": "0"})
+
+
+class TaskEvent(SQLModel, table=True):
+    __table_args__ = (
+        Index(
+            "ix_taskevent_user_task_date",
+            "user_id",
+            "task_definition_id",
+            "instance_date",
+            "kind",
+        ),
+        Index("ix_taskevent_user_date", "user_id", "instance_date"),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    user_id: str = Field(default=DEFAULT_USER_ID)
+    task_definition_id: str
+    kind: str
+    instance_date: date
+    occurred_at: datetime = Field(sa_column=Column(DateTime(timezone=True), nullable=False))
 
 
 class RulesState(SQLModel, table=True):
+    __table_args__ = (Index("ix_rulesstate_user_revision", "user_id", "revision"),)
+
+    user_id: str = Field(default=DEFAULT_USER_ID, primary_key=True)
     id: int = Field(primary_key=True)
     rules: Dict[str, Any] = Field(default_factory=dict, sa_column=Column(JSON))
     conditions: Dict[str, bool] = Field(default_factory=dict, sa_column=Column(JSON))
+    revision: int = Field(default=0, sa_column_kwargs={"server_default": "0"})
 
 
 class RuleUsage(SQLModel, table=True):
+    user_id: str = Field(default=DEFAULT_USER_ID, primary_key=True)
     rule_key: str = Field(primary_key=True)
     last_used_at: Optional[datetime] = Field(
         default=None, sa_column=Column(DateTime(timezone=True))
     )
+
+
+class StateVersion(SQLModel, table=True):
+    user_id: str = Field(default=DEFAULT_USER_ID, primary_key=True)
+    id: int = Field(primary_key=True)
+    version: int = 0
+
+
+class SyncTombstone(SQLModel, table=True):
+    __table_args__ = (Index("ix_synctombstone_user_revision", "user_id", "revision"),)
+
+    user_id: str = Field(default=DEFAULT_USER_ID, primary_key=True)
+    kind: str = Field(primary_key=True)
+    row_id: str = Field(primary_key=True)
+    revision: int = Field(default=0, sa_column_kwargs={"server_default": "0"})
+
+
+class TaskDayStat(SQLModel, table=True):
+    __table_args__ = (
+        Index(
+            "ix_taskdaystat_user_task_state_day",
+            "user_id",
+            "task_definition_id",
+            "state",
+            "day",
+        ),
+    )
+
+    user_id: str = Field(primary_key=True)
+    task_definition_id: str = Field(primary_key=True)
+    day: date = Field(primary_key=True)
+    state: str
+    completed_total: int = 0
+    skipped_total: int = 0
+    streak: int = 0
+
+
+class RotationDayStat(SQLModel, table=True):
+    user_id: str = Field(primary_key=True)
+    rule_key: str = Field(primary_key=True)
+    day: date = Field(primary_key=True)
+    uses: int = 0
+    uses_total: int = 0
+
+
+class DailyPlan(SQLModel, table=True):
+    user_id: str = Field(primary_key=True)
+    plan_date: date = Field(primary_key=True, index=True)
+    state_version: int
+    cards: List[Dict[str, Any]] = Field(default_factory=list, sa_column=Column(JSON))
+    etag: str
+    generated_at: datetime = Field(sa_column=Column(DateTime(timezone=True), nullable=False))
+
+
+class SchemaVersion(SQLModel, table=True):
+    id: int = Field(primary_key=True)
+    version: int = 0
+
+
+class AiCacheEntry(SQLModel, table=True):
+    key: str = Field(primary_key=True)
+    response: Dict[str, Any] = Field(default_factory=dict, sa_column=Column(JSON))
+    created_at: datetime = Field(
+        sa_column=Column(DateTime(timezone=True), nullable=False, index=True)
+    )
@@ -0,0 +1,124 @@
+﻿from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, FrozenSet, Hashable, Optional, Tuple
+
+from .seed import RULE_KEY_AM_VITC, RULE_KEY_PM_HIGH_NIACIN
+
+CONSTRAINT_NO_VITC_SAME_DAY = "do_not_pair_with_vitc_same_day"
+
+_PLAN_CACHE_SIZE = 32
+
+
+@dataclass(frozen=True, slots=True)
+class SerumRotation:
+    rule_key: str
+    product_id: Optional[str]
+    interval_days: Optional[int]
+    only_if_condition_not: FrozenSet[str]
+    constraints: FrozenSet[str]
+    blocked: bool
+
+
+@dataclass(frozen=True, slots=True)
+class SerumSlot:
+    default_id: Optional[str]
+    rotation: Optional[SerumRotation]
+
+
+@dataclass(frozen=True, slots=True)
+class HydrationBoost:
+    product_id: Optional[str]
+    auto_seasons: FrozenSet[str]
+    toggle_enabled: bool
+
+
+@dataclass(frozen=True, slots=True)
+class RulePlan:
+    am: SerumSlot
+    pm: SerumSlot
+    hydration: HydrationBoost
+    lazy_mode: bool
+    lazy_fallback_am: Tuple[str, ...]
+    lazy_fallback_pm: Tuple[str, ...]
+    vitc_id: Optional[str]
+    niacin_id: Optional[str]
+
+
+def _compile_rotation(
+    rule: Optional[Dict[str, Any]], rule_key: str, conditions: Dict[str, bool]
+) -> Optional[SerumRotation]:
+    if not rule:
+        return None
+    block_list = frozenset(rule.get("only_if_condition_not", []))
+    return SerumRotation(
+        rule_key=rule_key,
+        product_id=rule.get("productId"),
+        interval_days=rule.get("interval_days"),
+        only_if_condition_not=block_list,
+        constraints=frozenset(rule.get("constraints", [])),
+        blocked=any(conditions.get(key, False) for key in block_list),
+    )
+
+
+def _build_rule_plan(rules: Dict[str, Any], conditions: Dict[str, bool]) -> RulePlan:
+    am_rules = rules.get("amSerumRotation", {})
+    pm_rules = rules.get("pmSerumRotation", {})
+    hydration_rule = rules.get("hydrationBoost", {})
+    toggle_key = hydration_rule.get("toggle")
+    lazy_rules = rules.get("lazyFallback", {})
+
+    return RulePlan(
+        am=SerumSlot(
+            default_id=am_rules.get("default"),
+            rotation=_compile_rotation(am_rules.get("vitc"), RULE_KEY_AM_VITC, conditions),
+        ),
+        pm=SerumSlot(
+            default_id=pm_rules.get("default"),
+            rotation=_compile_rotation(
+                pm_rules.get("highNiacinamide"), RULE_KEY_PM_HIGH_NIACIN, conditions
+            ),
+        ),
+        hydration=HydrationBoost(
+            product_id=hydration_rule.get("productId"),
+            auto_seasons=frozenset(hydration_rule.get("autoSeasons", [])),
+            toggle_enabled=bool(toggle_key and conditions.get(toggle_key, False)),
+        ),
+        lazy_mode=bool(conditions.get("lazy_mode")),
+        lazy_fallback_am=tuple(lazy_rules.get("am", [])),
+        lazy_fallback_pm=tuple(lazy_rules.get("pm", [])),
+        vitc_id=am_rules.get("vitc", {}).get("productId"),
+        niacin_id=pm_rules.get("highNiacinamide", {}).get("productId"),
+    )
+
+
+_plan_cache: "OrderedDict[Hashable, RulePlan]" = OrderedDict()
+_plan_cache_lock = threading.Lock()
+
+
+def compile_rule_plan(
+    rules: Dict[str, Any], conditions: Dict[str, bool], key: Optional[Hashable] = None
+) -> RulePlan:
+    # The key names the rules state, e.g. (user_id, RulesState.revision);
+    # without one the plan is built and not cached.
+    if key is None:
+        return _build_rule_plan(rules, conditions)
+    with _plan_cache_lock:
+        plan = _plan_cache.get(key)
+        if plan is not None:
+            _plan_cache.move_to_end(key)
+            return plan
+
+    plan = _build_rule_plan(rules, conditions)
+    with _plan_cache_lock:
+        _plan_cache[key] = plan
+        while len(_plan_cache) > _PLAN_CACHE_SIZE:
+            _plan_cache.popitem(last=False)
+    return plan
+
+
+def clear_rule_plan_cache() -> None:
+    with _plan_cache_lock:
+        _plan_cache.clear()
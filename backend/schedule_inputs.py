@@ -0,0 +1,69 @@
+﻿from __future__ import annotations
+
+import hashlib
+from datetime import date
+from typing import Any, Dict, List
+
+from sqlmodel import Session, select
+
+from .due_index import candidate_task_ids, load_candidate_tasks
+from .history import load_task_history
+from .models import RuleUsage, RulesState
+from .rule_plan import RulePlan, compile_rule_plan
+from .scheduler import Card
+from .seed import DEFAULT_CONDITIONS
+from .serialization import dumps
+
+
+def get_rules_state(session: Session, user_id: str) -> RulesState:
+    rules_state = session.get(RulesState, (user_id, 1))
+    if rules_state is None:
+        rules_state = RulesState(
+            user_id=user_id, id=1, rules={}, conditions=DEFAULT_CONDITIONS.copy()
+        )
+        session.add(rules_state)
+        session.commit()
+        session.refresh(rules_state)
+    else:
+        for key, value in DEFAULT_CONDITIONS.items():
+            rules_state.conditions.setdefault(key, value)
+    return rules_state
+
+
+def get_rule_plan(rules_state: RulesState) -> RulePlan:
+    return compile_rule_plan(
+        rules_state.rules,
+        rules_state.conditions,
+        (rules_state.user_id, rules_state.revision),
+    )
+
+
+def get_rule_usage(session: Session, user_id: str) -> Dict[str, RuleUsage]:
+    usages = session.exec(select(RuleUsage).where(RuleUsage.user_id == user_id)).all()
+    return {usage.rule_key: usage for usage in usages}
+
+
+def load_schedule_inputs(
+    session: Session, user_id: str, start_date: date, end_date: date
+) -> Dict[str, Any]:
+    task_defs, status_map = load_candidate_tasks(session, user_id, start_date, end_date)
+    rules_state = get_rules_state(session, user_id)
+    return {
+        "task_defs": task_defs,
+        "status_map": status_map,
+        "rules": get_rule_plan(rules_state),
+        "conditions": rules_state.conditions,
+        "rule_usage": get_rule_usage(session, user_id),
+        "history": load_task_history(
+            session,
+            user_id,
+            start_date,
+            end_date,
+            candidate_task_ids(user_id, start_date, end_date),
+        ),
+    }
+
+
+def cards_etag(target_date: date, cards: List[Card]) -> str:
+    digest = hashlib.sha1(dumps([target_date.isoformat(), cards])).hexdigest()
+    return f'W/"{digest}"'
@@ -1,12 +1,22 @@
 ﻿from __future__ import annotations
 
-from datetime import date, datetime
-from typing import Any, Dict, Iterable, List, Optional, Tuple
+from dataclasses import dataclass
+from datetime import date, datetime, time, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
 
 from .config import TIMEZONE
+from .history import EVENT_COMPLETE, TaskHistory
 from .models import RuleUsage, TaskDefinition, TaskStatus
+from .rule_plan import (
+    CONSTRAINT_NO_VITC_SAME_DAY,
+    RulePlan,
+    SerumSlot,
+    compile_rule_plan,
+)
 from .seed import RULE_KEY_AM_VITC, RULE_KEY_PM_HIGH_NIACIN
 
+RuleSource = Union[RulePlan, Dict[str, Any]]
+
 SLOT_PRIORITY = {
     "AM": 0,
     "PM": 1,
@@ -16,6 +26,51 @@ SLOT_PRIORITY = {
 }
 
 
+# Field names are the wire format so cards serialize without a mapping step.
+@dataclass(slots=True)
+class CardStep:
+    step: int
+    action: Optional[str]
+    products: List[str]
+
+
+@dataclass(slots=True)
+class Card:
+    taskInstanceId: str
+    taskDefinitionId: str
+    slot: str
+    type: str
+    state: str
+    steps: List[CardStep]
+
+
+def card_to_dict(card: Card) -> Dict[str, Any]:
+    return {
+        "taskInstanceId": card.taskInstanceId,
+        "taskDefinitionId": card.taskDefinitionId,
+        "slot": card.slot,
+        "type": card.type,
+        "state": card.state,
+        "steps": [
+            {"step": step.step, "action": step.action, "products": step.products}
+            for step in card.steps
+        ],
+    }
+
+
+def card_from_dict(value: Dict[str, Any]) -> Card:
+    return Card(
+        taskInstanceId=value["taskInstanceId"],
+        taskDefinitionId=value["taskDefinitionId"],
+        slot=value["slot"],
+        type=value["type"],
+        state=value["state"],
+        steps=[
+            CardStep(step["step"], step["action"], step["products"]) for step in value["steps"]
+        ],
+    )
+
+
 def kst_now() -> datetime:
     return datetime.now(tz=TIMEZONE)
 
@@ -38,15 +93,35 @@ def parse_task_instance_id(task_instance_id: str) -> Tuple[str, date]:
     return task_id, parse_date(date_str)
 
 
-def _date_or_none(value: Optional[datetime]) -> Optional[date]:
+def date_or_none(value: Optional[datetime]) -> Optional[date]:
     if value is None:
         return None
+    if not isinstance(value, datetime):
+        return value
     return value.astimezone(TIMEZONE).date()
 
 
-def _is_due(task_def: TaskDefinition, status: TaskStatus, target_date: date) -> bool:
+def _last_completed_date(
+    status: TaskStatus, target_date: date, history: Optional[TaskHistory]
+) -> Optional[date]:
+    if history is not None and history.tracks(status.task_definition_id):
+        return history.last_completed_before(status.task_definition_id, target_date)
+    completed_date = date_or_none(status.last_completed_at)
+    # The status only keeps the latest completion; it says nothing about days
+    # before it.
+    if completed_date is not None and completed_date > target_date:
+        return None
+    return completed_date
+
+
+def _is_due(
+    task_def: TaskDefinition,
+    status: TaskStatus,
+    target_date: date,
+    history: Optional[TaskHistory] = None,
+) -> bool:
     if task_def.interval_days is not None:
-        last_completed = _date_or_none(status.last_completed_at)
+        last_completed = _last_completed_date(status, target_date, history)
         if last_completed is None:
             return True
         days_since = (target_date - last_completed).days
@@ -58,9 +133,13 @@ def _is_due(task_def: TaskDefinition, status: TaskStatus, target_date: date) ->
     return False
 
 
-def _state_for_date(status: TaskStatus, target_date: date) -> Optional[str]:
-    completed_date = _date_or_none(status.last_completed_at)
-    skipped_date = _date_or_none(status.last_skipped_at)
+def _state_for_date(
+    status: TaskStatus, target_date: date, history: Optional[TaskHistory] = None
+) -> Optional[str]:
+    if history is not None and history.tracks(status.task_definition_id):
+        return history.state_on(status.task_definition_id, target_date)
+    completed_date = date_or_none(status.last_completed_at)
+    skipped_date = date_or_none(status.last_skipped_at)
     if completed_date == target_date:
         return "completed"
     if skipped_date == target_date:
@@ -75,72 +154,84 @@ def _rotation_due(
         return False
     if last_used_at is None:
         return True
-    last_used_date = last_used_at.astimezone(TIMEZONE).date()
+    last_used_date = date_or_none(last_used_at)
     if last_used_date == target_date:
         return True
     days_since = (target_date - last_used_date).days
     return days_since >= interval_days
 
 
-def _blocked_by_conditions(block_list: Iterable[str], conditions: Dict[str, bool]) -> bool:
-    return any(conditions.get(key, False) for key in block_list)
+def _as_plan(rules: RuleSource, conditions: Dict[str, bool]) -> RulePlan:
+    if isinstance(rules, RulePlan):
+        return rules
+    return compile_rule_plan(rules, conditions)
+
+
+def _select_rotation(
+    slot: SerumSlot, rule_usage: Dict[str, RuleUsage], target_date: date
+) -> Optional[str]:
+    rotation = slot.rotation
+    if rotation is None or rotation.blocked:
+        return slot.default_id
+
+    usage = rule_usage.get(rotation.rule_key)
+    if _rotation_due(usage.last_used_at if usage else None, rotation.interval_days, target_date):
+        return rotation.product_id
+
+    return slot.default_id
 
 
 def select_am_serum(
-    rules: Dict[str, Any],
+    rules: RuleSource,
     conditions: Dict[str, bool],
     rule_usage: Dict[str, RuleUsage],
     target_date: date,
 ) -> Optional[str]:
-    am_rules = rules.get("amSerumRotation", {})
-    default_id = am_rules.get("default")
-    vitc_rule = am_rules.get("vitc")
-    if not vitc_rule:
-        return default_id
+    plan = _as_plan(rules, conditions)
+    return _select_rotation(plan.am, rule_usage, target_date)
+
 
-    block_list = vitc_rule.get("only_if_condition_not", [])
-    if _blocked_by_conditions(block_list, conditions):
-        return default_id
+def select_pm_serum(
+    rules: RuleSource,
+    conditions: Dict[str, bool],
+    rule_usage: Dict[str, RuleUsage],
+    target_date: date,
+    am_selected: Optional[str],
+) -> Optional[str]:
+    plan = _as_plan(rules, conditions)
+    rotation = plan.pm.rotation
+    if rotation is None or rotation.blocked:
+        return plan.pm.default_id
 
-    vitc_id = vitc_rule.get("productId")
-    interval_days = vitc_rule.get("interval_days")
-    usage = rule_usage.get(RULE_KEY_AM_VITC)
-    if _rotation_due(usage.last_used_at if usage else None, interval_days, target_date):
-        return vitc_id
+    if CONSTRAINT_NO_VITC_SAME_DAY in rotation.constraints:
+        if plan.vitc_id and am_selected == plan.vitc_id:
+            return plan.pm.default_id
 
-    return default_id
+    return _select_rotation(plan.pm, rule_usage, target_date)
 
 
-def select_pm_serum(
-    rules: Dict[str, Any],
+def serum_rule_key_for_completion(
+    task_definition_id: str,
+    rules: RuleSource,
     conditions: Dict[str, bool],
     rule_usage: Dict[str, RuleUsage],
     target_date: date,
-    am_selected: Optional[str],
 ) -> Optional[str]:
-    pm_rules = rules.get("pmSerumRotation", {})
-    default_id = pm_rules.get("default")
-    niacin_rule = pm_rules.get("highNiacinamide")
-    if not niacin_rule:
-        return default_id
+    plan = _as_plan(rules, conditions)
+    if plan.lazy_mode:
+        return None
 
-    block_list = niacin_rule.get("only_if_condition_not", [])
-    if _blocked_by_conditions(block_list, conditions):
-        return default_id
+    am_selected = select_am_serum(plan, conditions, rule_usage, target_date)
 
-    constraints = niacin_rule.get("constraints", [])
-    if "do_not_pair_with_vitc_same_day" in constraints:
-        vitc_id = rules.get("amSerumRotation", {}).get("vitc", {}).get("productId")
-        if vitc_id and am_selected == vitc_id:
-            return default_id
+    if task_definition_id == "skin_am" and plan.vitc_id and am_selected == plan.vitc_id:
+        return RULE_KEY_AM_VITC
 
-    niacin_id = niacin_rule.get("productId")
-    interval_days = niacin_rule.get("interval_days")
-    usage = rule_usage.get(RULE_KEY_PM_HIGH_NIACIN)
-    if _rotation_due(usage.last_used_at if usage else None, interval_days, target_date):
-        return niacin_id
+    if task_definition_id == "skin_pm" and plan.niacin_id:
+        pm_selected = select_pm_serum(plan, conditions, rule_usage, target_date, am_selected)
+        if pm_selected == plan.niacin_id:
+            return RULE_KEY_PM_HIGH_NIACIN
 
-    return default_id
+    return None
 
 
 def _condition_met(condition: Optional[str], conditions: Dict[str, bool]) -> bool:
@@ -166,30 +257,23 @@ def _season_key(target_date: date) -> str:
     return "fall"
 
 
-def _hydration_enabled(
-    rules: Dict[str, Any], conditions: Dict[str, bool], target_date: date
-) -> Tuple[bool, Optional[str]]:
-    hydration_rule = rules.get("hydrationBoost", {})
-    toggle_key = hydration_rule.get("toggle")
-    product_id = hydration_rule.get("productId")
-    auto_seasons = hydration_rule.get("autoSeasons", [])
-    if not product_id:
+def _hydration_enabled(plan: RulePlan, target_date: date) -> Tuple[bool, Optional[str]]:
+    hydration = plan.hydration
+    if not hydration.product_id:
         return False, None
-    season_enabled = _season_key(target_date) in auto_seasons
-    toggle_enabled = bool(toggle_key and conditions.get(toggle_key, False))
-    return season_enabled or toggle_enabled, product_id
+    season_enabled = _season_key(target_date) in hydration.auto_seasons
+    return season_enabled or hydration.toggle_enabled, hydration.product_id
 
 
 def _apply_hydration_override(
     selected_id: Optional[str],
     default_id: Optional[str],
-    rules: Dict[str, Any],
-    conditions: Dict[str, bool],
+    plan: RulePlan,
     target_date: date,
 ) -> Optional[str]:
     if not selected_id or selected_id != default_id:
         return selected_id
-    enabled, hydration_id = _hydration_enabled(rules, conditions, target_date)
+    enabled, hydration_id = _hydration_enabled(plan, target_date)
     if not enabled or not hydration_id:
         return selected_id
     return hydration_id
@@ -197,18 +281,18 @@ def _apply_hydration_override(
 
 def build_task_steps(
     task_def: TaskDefinition,
-    rules: Dict[str, Any],
+    rules: RuleSource,
     conditions: Dict[str, bool],
     rule_usage: Dict[str, RuleUsage],
     target_date: date,
     am_selected: Optional[str],
-) -> Tuple[List[Dict[str, Any]], Optional[str]]:
-    if conditions.get("lazy_mode") and task_def.id in {"skin_am", "skin_pm"}:
-        key = "am" if task_def.slot == "AM" else "pm"
-        products = rules.get("lazyFallback", {}).get(key, [])
-        return ([{"step": 1, "action": "apply_products", "products": products}], am_selected)
+) -> Tuple[List[CardStep], Optional[str]]:
+    plan = _as_plan(rules, conditions)
+    if plan.lazy_mode and task_def.id in {"skin_am", "skin_pm"}:
+        fallback = plan.lazy_fallback_am if task_def.slot == "AM" else plan.lazy_fallback_pm
+        return [CardStep(1, "apply_products", list(fallback))], am_selected
 
-    steps: List[Dict[str, Any]] = []
+    steps: List[CardStep] = []
     step_number = 1
 
     for raw_step in task_def.steps:
@@ -218,79 +302,176 @@ def build_task_steps(
         products = list(raw_step.get("products", []))
         selector = raw_step.get("productSelector")
         if selector == "rule_based_serum_am":
-            am_rules = rules.get("amSerumRotation", {})
-            am_selected = select_am_serum(rules, conditions, rule_usage, target_date)
+            am_selected = select_am_serum(plan, conditions, rule_usage, target_date)
             am_selected = _apply_hydration_override(
-                am_selected, am_rules.get("default"), rules, conditions, target_date
+                am_selected, plan.am.default_id, plan, target_date
             )
             products = [am_selected] if am_selected else []
         elif selector == "rule_based_serum_pm":
-            pm_rules = rules.get("pmSerumRotation", {})
-            selected = select_pm_serum(rules, conditions, rule_usage, target_date, am_selected)
+            selected = select_pm_serum(plan, conditions, rule_usage, target_date, am_selected)
             selected = _apply_hydration_override(
-                selected, pm_rules.get("default"), rules, conditions, target_date
+                selected, plan.pm.default_id, plan, target_date
             )
             products = [selected] if selected else []
 
-        steps.append(
-            {
-                "step": step_number,
-                "action": raw_step.get("action"),
-                "products": products,
-            }
-        )
+        steps.append(CardStep(step_number, raw_step.get("action"), products))
         step_number += 1
 
     return steps, am_selected
 
 
-def build_today_cards(
+def _select_candidates(
     task_defs: Iterable[TaskDefinition],
     status_map: Dict[str, TaskStatus],
-    rules: Dict[str, Any],
-    conditions: Dict[str, bool],
-    rule_usage: Dict[str, RuleUsage],
     target_date: date,
-) -> List[Dict[str, Any]]:
-    candidates: Dict[str, Dict[str, Any]] = {}
+    history: Optional[TaskHistory] = None,
+) -> Dict[str, Tuple[TaskDefinition, str, int]]:
+    candidates: Dict[str, Tuple[TaskDefinition, str, int]] = {}
+    empty_status: Optional[TaskStatus] = None
 
     for task_def in task_defs:
-        status = status_map.get(task_def.id, TaskStatus(task_definition_id=task_def.id))
-        due = _is_due(task_def, status, target_date)
-        state = _state_for_date(status, target_date)
+        status = status_map.get(task_def.id)
+        if status is None:
+            # Tasks without a status share one placeholder instead of building a
+            # model instance each; it is only read, never stored.
+            if empty_status is None:
+                empty_status = TaskStatus()
+            empty_status.task_definition_id = task_def.id
+            status = empty_status
+        due = _is_due(task_def, status, target_date, history)
+        state = _state_for_date(status, target_date, history)
         if not due and state is None:
             continue
-        if state is None:
-            state = "due"
 
         interval_score = task_def.interval_days or 0
         existing = candidates.get(task_def.slot)
-        if existing is None or interval_score > existing["interval_score"]:
-            candidates[task_def.slot] = {
-                "task_def": task_def,
-                "state": state,
-                "interval_score": interval_score,
-            }
+        if existing is None or interval_score > existing[2]:
+            candidates[task_def.slot] = (task_def, state or "due", interval_score)
+
+    return candidates
+
+
+def build_today_cards(
+    task_defs: Iterable[TaskDefinition],
+    status_map: Dict[str, TaskStatus],
+    rules: RuleSource,
+    conditions: Dict[str, bool],
+    rule_usage: Dict[str, RuleUsage],
+    target_date: date,
+    history: Optional[TaskHistory] = None,
+) -> List[Card]:
+    plan = _as_plan(rules, conditions)
+    candidates = _select_candidates(task_defs, status_map, target_date, history)
 
     ordered_slots = sorted(candidates.keys(), key=lambda s: SLOT_PRIORITY.get(s, 99))
-    cards: List[Dict[str, Any]] = []
+    cards: List[Card] = []
     am_selected: Optional[str] = None
+    day = target_date.isoformat()
 
     for slot in ordered_slots:
-        candidate = candidates[slot]
-        task_def = candidate["task_def"]
+        task_def, state, _ = candidates[slot]
         steps, am_selected = build_task_steps(
-            task_def, rules, conditions, rule_usage, target_date, am_selected
+            task_def, plan, conditions, rule_usage, target_date, am_selected
         )
+        instance_id = f"{task_def.id}|{day}"
         cards.append(
-            {
-                "taskInstanceId": f"{task_def.id}|{target_date.isoformat()}",
-                "taskDefinitionId": task_def.id,
-                "slot": task_def.slot,
-                "type": task_def.task_type,
-                "state": candidate["state"],
-                "steps": steps,
-            }
+            Card(instance_id, task_def.id, task_def.slot, task_def.task_type, state, steps)
         )
 
     return cards
+
+
+def build_range_cards(
+    task_defs: Iterable[TaskDefinition],
+    status_map: Dict[str, TaskStatus],
+    rules: RuleSource,
+    conditions: Dict[str, bool],
+    rule_usage: Dict[str, RuleUsage],
+    start_date: date,
+    end_date: date,
+    project_from: Optional[date] = None,
+    history: Optional[TaskHistory] = None,
+) -> List[Dict[str, Any]]:
+    # Days from project_from (today by default) onwards assume every due card is
+    # completed on its day so intervals and serum rotations keep advancing.
+    if project_from is None:
+        project_from = kst_now().date()
+
+    plan = _as_plan(rules, conditions)
+    history = history.copy() if history is not None else None
+    task_defs = list(task_defs)
+    projected_status = {
+        task_def.id: _copy_status(status_map.get(task_def.id), task_def.id)
+        for task_def in task_defs
+    }
+    projected_usage = {
+        key: RuleUsage(rule_key=usage.rule_key, last_used_at=usage.last_used_at)
+        for key, usage in rule_usage.items()
+    }
+
+    days: List[Dict[str, Any]] = []
+    target_date = start_date
+    while target_date <= end_date:
+        cards = build_today_cards(
+            task_defs,
+            projected_status,
+            plan,
+            conditions,
+            projected_usage,
+            target_date,
+            history,
+        )
+        days.append({"date": target_date.isoformat(), "cards": cards})
+
+        if target_date >= project_from:
+            _project_completions(
+                cards,
+                projected_status,
+                plan,
+                conditions,
+                projected_usage,
+                target_date,
+                history,
+            )
+
+        target_date += timedelta(days=1)
+
+    return days
+
+
+def _copy_status(status: Optional[TaskStatus], task_definition_id: str) -> TaskStatus:
+    if status is None:
+        return TaskStatus(task_definition_id=task_definition_id)
+    return TaskStatus(
+        task_definition_id=task_definition_id,
+        last_completed_at=status.last_completed_at,
+        last_skipped_at=status.last_skipped_at,
+    )
+
+
+def _project_completions(
+    cards: List[Card],
+    status_map: Dict[str, TaskStatus],
+    rules: RuleSource,
+    conditions: Dict[str, bool],
+    rule_usage: Dict[str, RuleUsage],
+    target_date: date,
+    history: Optional[TaskHistory],
+) -> None:
+    completed_at = datetime.combine(target_date, time.min, tzinfo=TIMEZONE)
+    for card in cards:
+        if card.state != "due":
+            continue
+        task_definition_id = card.taskDefinitionId
+        status_map[task_definition_id].last_completed_at = completed_at
+        if history is not None:
+            history.add(task_definition_id, EVENT_COMPLETE, target_date)
+
+        rule_key = serum_rule_key_for_completion(
+            task_definition_id, rules, conditions, rule_usage, target_date
+        )
+        if rule_key is not None:
+            usage = rule_usage.get(rule_key)
+            if usage is None:
+                usage = rule_usage[rule_key] = RuleUsage(rule_key=rule_key)
+            usage.last_used_at = completed_at
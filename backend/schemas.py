@@ -24,10 +24,52 @@ class TaskCard(BaseModel):
     steps: List[TaskStep]
 
 
+class ProductSummary(BaseModel):
+    id: str
+    name: str
+    category: str
+    role: str
+    is_active: bool
+
+
 class TodayResponse(BaseModel):
     date: str
     nowKstIso: str
     cards: List[TaskCard]
+    products: Optional[Dict[str, ProductSummary]] = None
+
+
+class ScheduleDay(BaseModel):
+    date: str
+    cards: List[TaskCard]
+
+
+class ScheduleResponse(BaseModel):
+    from_: str = Field(alias="from")
+    to: str
+    nowKstIso: str
+    days: List[ScheduleDay]
+
+
+class TaskStats(BaseModel):
+    taskDefinitionId: str
+    completed: int
+    skipped: int
+    expected: int
+    completionRate: Optional[float] = None
+    currentStreak: int
+
+
+class RotationStats(BaseModel):
+    ruleKey: str
+    uses: int
+
+
+class StatsResponse(BaseModel):
+    from_: str = Field(alias="from")
+    to: str
+    tasks: List[TaskStats]
+    rotations: List[RotationStats]
 
 
 class TaskDefinitionBase(BaseModel):
@@ -77,6 +119,21 @@ class SkipResponse(BaseModel):
     skippedAtIso: str
 
 
+class TaskEventIn(BaseModel):
+    taskInstanceId: str
+    kind: str
+    occurredAtIso: str
+
+
+class EventBatchRequest(BaseModel):
+    events: List[TaskEventIn]
+
+
+class EventBatchResponse(BaseModel):
+    ok: bool
+    applied: int
+
+
 class ProductBase(BaseModel):
     id: str
     name: str
@@ -125,9 +182,39 @@ class JsonPatchOperation(BaseModel):
     value: Optional[Any] = None
 
 
+class TaskStatusRead(BaseModel):
+    taskDefinitionId: str
+    lastCompletedAtIso: Optional[str] = None
+    lastSkippedAtIso: Optional[str] = None
+
+
+class SyncResponse(BaseModel):
+    cursor: int
+    full: bool
+    products: List[ProductRead]
+    taskDefinitions: List[TaskDefinitionRead]
+    taskStatuses: List[TaskStatusRead]
+    rules: Optional[RulesResponse] = None
+    deletedTaskDefinitionIds: List[str]
+
+
+class SpecSnapshot(BaseModel):
+    version: int
+    spec: Dict[str, Any]
+
+
+class SpecApplyRequest(BaseModel):
+    jsonPatch: List[Dict[str, Any]]
+    specVersion: Optional[int] = None
+
+
+class SpecApplyResponse(SpecSnapshot):
+    changed: int
+
+
 class AiPatchRequest(BaseModel):
     userInstruction: str
-    currentSpec: Dict[str, Any]
+    currentSpec: Optional[Dict[str, Any]] = None
     apiKey: Optional[str] = None
     modelName: Optional[str] = None
 
@@ -135,3 +222,10 @@ class AiPatchRequest(BaseModel):
 class AiPatchResponse(BaseModel):
     jsonPatch: List[Dict[str, Any]]
     summary: str
+    specVersion: Optional[int] = None
+
+
+class AiCacheStats(BaseModel):
+    hits: int
+    misses: int
+    size: int
@@ -1,12 +1,17 @@
 ﻿from __future__ import annotations
 
+import argparse
+import codecs
 import json
+import time
 from pathlib import Path
-from typing import Any, Dict
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, TextIO, Tuple
 
 from sqlmodel import Session, select
 
-from .config import SEED_PATH
+from .cache import bump_state_version
+from .config import DEFAULT_USER_ID, SEED_PATH
+from .due_index import weekday_mask
 from .models import Product, RuleUsage, RulesState, TaskDefinition, TaskStatus
 
 DEFAULT_CONDITIONS: Dict[str, bool] = {
@@ -21,72 +26,276 @@ DEFAULT_CONDITIONS: Dict[str, bool] = {
 RULE_KEY_AM_VITC = "am_vitc"
 RULE_KEY_PM_HIGH_NIACIN = "pm_high_niacin"
 
+SEED_SECTIONS = ("products", "taskDefinitions", "rules")
+STREAMED_SECTIONS = ("products", "taskDefinitions")
+SEED_BATCH_SIZE = 500
+SEED_CHUNK_SIZE = 64 * 1024
+
+
+def _decodes_as(path: Path, encoding: str) -> bool:
+    # The whole file is checked: a long ASCII head says nothing about the rest.
+    decoder = codecs.getincrementaldecoder(encoding)()
+    try:
+        with open(path, "rb") as handle:
+            while chunk := handle.read(SEED_CHUNK_SIZE):
+                decoder.decode(chunk)
+        decoder.decode(b"", final=True)
+    except UnicodeDecodeError:
+        return False
+    return True
+
+
+def detect_seed_encoding(path: Path) -> str:
+    with open(path, "rb") as handle:
+        head = handle.read(4)
+    if head.startswith(codecs.BOM_UTF8):
+        return "utf-8-sig"
+    if head.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return "utf-16"
+    for encoding in ("utf-8", "cp949"):
+        if _decodes_as(path, encoding):
+            return encoding
+    raise ValueError(f"Unable to detect seed file encoding: {path}")
+
 
 def _read_seed(path: Path) -> Dict[str, Any]:
-    encodings = ["utf-8", "utf-8-sig", "cp949", "utf-16"]
-    last_error: Exception | None = None
-    for encoding in encodings:
-        try:
-            return json.loads(path.read_text(encoding=encoding))
-        except Exception as exc:  # pragma: no cover - best-effort fallback
-            last_error = exc
-    raise ValueError(f"Unable to read seed file: {path}") from last_error
+    return json.loads(path.read_text(encoding=detect_seed_encoding(path)))
 
 
-def seed_if_needed(session: Session) -> None:
-    has_products = session.exec(select(Product)).first() is not None
-    has_tasks = session.exec(select(TaskDefinition)).first() is not None
-    has_rules = session.exec(select(RulesState)).first() is not None
+class _JsonStream:
+    def __init__(self, handle: TextIO, chunk_size: int) -> None:
+        self._handle = handle
+        self._chunk_size = chunk_size
+        self._decoder = json.JSONDecoder()
+        self._buffer = ""
+        self._pos = 0
+        self._eof = False
 
-    if has_products and has_tasks and has_rules:
-        return
+    def _fill(self) -> bool:
+        if self._eof:
+            return False
+        chunk = self._handle.read(self._chunk_size)
+        if not chunk:
+            self._eof = True
+            return False
+        self._buffer = self._buffer[self._pos :] + chunk
+        self._pos = 0
+        return True
 
-    seed_path = SEED_PATH
-    data = _read_seed(seed_path)
-
-    if not has_products:
-        for product in data.get("products", []):
-            session.add(
-                Product(
-                    id=product["id"],
-                    name=product["name"],
-                    category=product["category"],
-                    role=product["role"],
-                    notes=product.get("notes"),
-                    verified=product.get("verified", {}),
-                    is_active=True,
-                )
-            )
+    def peek(self) -> str:
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos] in " \t\r\n":
+                self._pos += 1
+            if self._pos < len(self._buffer) or not self._fill():
+                return self._buffer[self._pos : self._pos + 1]
 
-    if not has_tasks:
-        for task_def in data.get("taskDefinitions", []):
-            session.add(
-                TaskDefinition(
-                    id=task_def["id"],
-                    slot=task_def["slot"],
-                    task_type=task_def["type"],
-                    steps=task_def.get("steps", []),
-                    interval_days=task_def.get("interval_days"),
-                    cron_weekdays=task_def.get("cron_weekdays"),
-                )
-            )
-        for task_def in data.get("taskDefinitions", []):
-            session.add(TaskStatus(task_definition_id=task_def["id"]))
+    def expect(self, chars: str) -> str:
+        char = self.peek()
+        if not char or char not in chars:
+            raise ValueError(f"Malformed seed file: expected one of {chars!r}, got {char!r}")
+        self._pos += 1
+        return char
+
+    def value(self) -> Any:
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+            # A number can end exactly at the chunk boundary and continue in the next one.
+            if end == len(self._buffer) and self._fill():
+                continue
+            self._pos = end
+            return value
 
-    if not has_rules:
-        rules = data.get("rules", {})
-        session.add(RulesState(id=1, rules=rules, conditions=DEFAULT_CONDITIONS.copy()))
 
-    rules = data.get("rules", {})
+def iter_seed(path: Path, chunk_size: int = SEED_CHUNK_SIZE) -> Iterator[Tuple[str, Any]]:
+    # Yields (section, item) for each element of the large list sections and
+    # (section, value) for everything else, without loading the whole file.
+    with open(path, encoding=detect_seed_encoding(path)) as handle:
+        stream = _JsonStream(handle, chunk_size)
+        stream.expect("{")
+        if stream.peek() == "}":
+            return
+        while True:
+            section = stream.value()
+            stream.expect(":")
+            if section in STREAMED_SECTIONS and stream.peek() == "[":
+                stream.expect("[")
+                if stream.peek() == "]":
+                    stream.expect("]")
+                else:
+                    while True:
+                        yield section, stream.value()
+                        if stream.expect(",]") == "]":
+                            break
+            else:
+                yield section, stream.value()
+            if stream.expect(",}") == "}":
+                return
+
+
+def _product_row(user_id: str, item: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "user_id": user_id,
+        "id": item["id"],
+        "name": item["name"],
+        "category": item["category"],
+        "role": item["role"],
+        "notes": item.get("notes"),
+        "verified": item.get("verified", {}),
+        "is_active": True,
+    }
+
+
+def _task_definition_row(user_id: str, item: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "user_id": user_id,
+        "id": item["id"],
+        "slot": item["slot"],
+        "type": item["type"],
+        "steps": item.get("steps", []),
+        "interval_days": item.get("interval_days"),
+        "cron_weekdays": item.get("cron_weekdays"),
+        "weekday_mask": weekday_mask(item.get("cron_weekdays")),
+    }
+
+
+def _insert_new_rows(
+    session: Session,
+    model: Any,
+    key: str,
+    user_id: str,
+    rows: List[Dict[str, Any]],
+    revision: Callable[[], int],
+) -> List[str]:
+    by_key: Dict[str, Dict[str, Any]] = {}
+    for row in rows:
+        by_key.setdefault(row[key], row)
+    column = getattr(model, key)
+    existing = set(
+        session.exec(
+            select(column).where(model.user_id == user_id, column.in_(list(by_key)))
+        ).all()
+    )
+    fresh = [row for row_key, row in by_key.items() if row_key not in existing]
+    if fresh:
+        # Core inserts skip the ORM revision stamping, so set it here.
+        version = revision()
+        for row in fresh:
+            row["revision"] = version
+        session.connection().execute(model.__table__.insert(), fresh)
+    return [row[key] for row in fresh]
+
+
+def _import_rules(
+    session: Session,
+    user_id: str,
+    rules: Dict[str, Any],
+    write_state: bool,
+    revision: Callable[[], int],
+) -> bool:
+    created = False
+    if write_state and session.get(RulesState, (user_id, 1)) is None:
+        session.add(
+            RulesState(
+                user_id=user_id, id=1, rules=rules, conditions=DEFAULT_CONDITIONS.copy()
+            )
+        )
+        created = True
+
     am_vitc = rules.get("amSerumRotation", {}).get("vitc")
     pm_niacin = rules.get("pmSerumRotation", {}).get("highNiacinamide")
 
-    if am_vitc and session.get(RuleUsage, RULE_KEY_AM_VITC) is None:
-        session.add(RuleUsage(rule_key=RULE_KEY_AM_VITC))
+    usages = []
+    if am_vitc and session.get(RuleUsage, (user_id, RULE_KEY_AM_VITC)) is None:
+        usages.append(RuleUsage(user_id=user_id, rule_key=RULE_KEY_AM_VITC))
+    if pm_niacin and session.get(RuleUsage, (user_id, RULE_KEY_PM_HIGH_NIACIN)) is None:
+        usages.append(RuleUsage(user_id=user_id, rule_key=RULE_KEY_PM_HIGH_NIACIN))
+    session.add_all(usages)
+    if created or usages:
+        revision()
+    return created
+
 
-    if pm_niacin and session.get(RuleUsage, RULE_KEY_PM_HIGH_NIACIN) is None:
-        session.add(RuleUsage(rule_key=RULE_KEY_PM_HIGH_NIACIN))
+def import_seed(
+    session: Session,
+    user_id: str = DEFAULT_USER_ID,
+    path: Optional[Path] = None,
+    sections: Iterable[str] = SEED_SECTIONS,
+    batch_size: int = SEED_BATCH_SIZE,
+) -> Dict[str, int]:
+    # Rows whose id already exists for the tenant are left untouched, so an
+    # import can be re-run. The caller owns the transaction; the state version
+    # is bumped once, on the first row actually written.
+    sections = set(sections)
+    counts = dict.fromkeys(SEED_SECTIONS, 0)
+    pending: Dict[str, List[Dict[str, Any]]] = {name: [] for name in STREAMED_SECTIONS}
+    versions: List[int] = []
 
+    def revision() -> int:
+        if not versions:
+            versions.append(bump_state_version(session, user_id))
+        return versions[0]
+
+    def flush(section: str) -> None:
+        rows, pending[section] = pending[section], []
+        if section == "products":
+            counts[section] += len(
+                _insert_new_rows(session, Product, "id", user_id, rows, revision)
+            )
+            return
+        inserted = _insert_new_rows(session, TaskDefinition, "id", user_id, rows, revision)
+        counts[section] += len(inserted)
+        if inserted:
+            _insert_new_rows(
+                session,
+                TaskStatus,
+                "task_definition_id",
+                user_id,
+                [{"user_id": user_id, "task_definition_id": task_id} for task_id in inserted],
+                revision,
+            )
+
+    row_builders = {"products": _product_row, "taskDefinitions": _task_definition_row}
+    with session.no_autoflush:
+        for section, value in iter_seed(path or SEED_PATH):
+            if section in pending:
+                if section not in sections:
+                    continue
+                pending[section].append(row_builders[section](user_id, value))
+                if len(pending[section]) >= batch_size:
+                    flush(section)
+            elif section == "rules":
+                counts["rules"] += _import_rules(
+                    session, user_id, value, "rules" in sections, revision
+                )
+        for section in STREAMED_SECTIONS:
+            if pending[section]:
+                flush(section)
+    return counts
+
+
+def seed_if_needed(session: Session, user_id: str = DEFAULT_USER_ID) -> None:
+    has_products = (
+        session.exec(select(Product).where(Product.user_id == user_id)).first() is not None
+    )
+    has_tasks = (
+        session.exec(select(TaskDefinition).where(TaskDefinition.user_id == user_id)).first()
+        is not None
+    )
+    has_rules = session.get(RulesState, (user_id, 1)) is not None
+
+    if has_products and has_tasks and has_rules:
+        return
+
+    present = {"products": has_products, "taskDefinitions": has_tasks, "rules": has_rules}
+    import_seed(
+        session, user_id, sections=[section for section, found in present.items() if not found]
+    )
     session.commit()
 
 
@@ -96,12 +305,14 @@ def migrate_skincare_tasks(session: Session) -> None:
     def _has_action(steps: list[dict[str, Any]], action: str) -> bool:
         return any(step.get("action") == action for step in steps)
 
-    am_task = session.get(TaskDefinition, "skin_am")
-    if am_task and (
-        _has_action(am_task.steps, "cleanse_optional")
-        or _has_action(am_task.steps, "apply_toner")
-        or not _has_action(am_task.steps, "apply_cream")
-    ):
+    am_tasks = session.exec(select(TaskDefinition).where(TaskDefinition.id == "skin_am")).all()
+    for am_task in am_tasks:
+        if not (
+            _has_action(am_task.steps, "cleanse_optional")
+            or _has_action(am_task.steps, "apply_toner")
+            or not _has_action(am_task.steps, "apply_cream")
+        ):
+            continue
         am_task.steps = [
             {"step": 1, "action": "apply_serum", "productSelector": "rule_based_serum_am"},
             {"step": 2, "action": "apply_cream", "products": ["cream_minic_barrier"]},
@@ -114,12 +325,14 @@ def migrate_skincare_tasks(session: Session) -> None:
         session.add(am_task)
         updated = True
 
-    pm_task = session.get(TaskDefinition, "skin_pm")
-    if pm_task and (
-        _has_action(pm_task.steps, "double_cleanse_if_needed")
-        or any(step.get("action") == "optional_toner" for step in pm_task.steps)
-        or not _has_action(pm_task.steps, "apply_toner")
-    ):
+    pm_tasks = session.exec(select(TaskDefinition).where(TaskDefinition.id == "skin_pm")).all()
+    for pm_task in pm_tasks:
+        if not (
+            _has_action(pm_task.steps, "double_cleanse_if_needed")
+            or any(step.get("action") == "optional_toner" for step in pm_task.steps)
+            or not _has_action(pm_task.steps, "apply_toner")
+        ):
+            continue
         pm_task.steps = [
             {"step": 1, "action": "apply_toner", "products": ["toner_dr_sante_azulene"]},
             {"step": 2, "action": "apply_serum", "productSelector": "rule_based_serum_pm"},
@@ -145,15 +358,40 @@ def migrate_products(session: Session) -> None:
 
 
 def migrate_rules(session: Session) -> None:
-    rules_state = session.exec(select(RulesState)).first()
-    if rules_state is None:
-        return
+    updated = False
+    for rules_state in session.exec(select(RulesState)).all():
+        rules = dict(rules_state.rules or {})
+        hydration = dict(rules.get("hydrationBoost", {}))
+        if "autoSeasons" not in hydration:
+            hydration["autoSeasons"] = ["winter", "fall"]
+            rules["hydrationBoost"] = hydration
+            rules_state.rules = rules
+            session.add(rules_state)
+            updated = True
 
-    rules = rules_state.rules or {}
-    hydration = rules.get("hydrationBoost", {})
-    if "autoSeasons" not in hydration:
-        hydration["autoSeasons"] = ["winter", "fall"]
-        rules["hydrationBoost"] = hydration
-        rules_state.rules = rules
-        session.add(rules_state)
+    if updated:
         session.commit()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    from .db import engine
+    from .migrations import init_db
+
+    parser = argparse.ArgumentParser(description="Import a seed file into one tenant")
+    parser.add_argument("path", nargs="?", type=Path, default=SEED_PATH)
+    parser.add_argument("--user-id", default=DEFAULT_USER_ID)
+    parser.add_argument("--batch-size", type=int, default=SEED_BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    init_db()
+    started = time.perf_counter()
+    with Session(engine) as session:
+        counts = import_seed(session, args.user_id, args.path, batch_size=args.batch_size)
+        session.commit()
+    elapsed = time.perf_counter() - started
+    print(json.dumps({"userId": args.user_id, **counts, "seconds": round(elapsed, 3)}))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,37 @@
+﻿from __future__ import annotations
+
+import json
+from dataclasses import fields, is_dataclass
+from typing import Any
+
+from fastapi.responses import Response
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depends on the environment
+    orjson = None
+
+
+def _encode(value: Any) -> Any:
+    if is_dataclass(value):
+        return {field.name: getattr(value, field.name) for field in fields(value)}
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def dumps(payload: Any) -> bytes:
+    # orjson writes slotted dataclasses natively; the fallback matches its
+    # compact, UTF-8 output.
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(
+        payload, ensure_ascii=False, separators=(",", ":"), default=_encode
+    ).encode("utf-8")
+
+
+class FastJSONResponse(Response):
+    # Renders the payload as is; routes returning it skip response_model
+    # validation, which stays only for the OpenAPI schema.
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
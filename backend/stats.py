@@ -0,0 +1,318 @@
+﻿from __future__ import annotations
+
+import math
+from datetime import date, timedelta
+from itertools import groupby
+from typing import Any, Dict, List, Optional
+
+from sqlmodel import Session, delete, select, update
+
+from .history import EVENT_COMPLETE
+from .models import RotationDayStat, RuleUsage, TaskDayStat, TaskDefinition, TaskEvent
+
+STATE_COMPLETED = "completed"
+STATE_SKIPPED = "skipped"
+
+
+def streak_gap(task_def: TaskDefinition) -> int:
+    # Longest wait between two scheduled days; a completion within it keeps
+    # the streak going.
+    if task_def.interval_days is not None:
+        return max(task_def.interval_days, 1)
+    weekdays = sorted({day for day in task_def.cron_weekdays or () if 0 <= day <= 6})
+    if not weekdays:
+        return 1
+    following = weekdays[1:] + [weekdays[0] + 7]
+    return max(after - before for before, after in zip(weekdays, following))
+
+
+def expected_occurrences(task_def: TaskDefinition, start_date: date, end_date: date) -> int:
+    days = (end_date - start_date).days + 1
+    if task_def.interval_days is not None:
+        return math.ceil(days / max(task_def.interval_days, 1))
+    weekdays = {day for day in task_def.cron_weekdays or () if 0 <= day <= 6}
+    full_weeks, remainder = divmod(days, 7)
+    expected = full_weeks * len(weekdays)
+    for offset in range(remainder):
+        if (start_date + timedelta(days=offset)).weekday() in weekdays:
+            expected += 1
+    return expected
+
+
+def _next_streak(previous: Optional[TaskDayStat], day: date, gap: int) -> int:
+    if previous is None or (day - previous.day).days > gap:
+        return 1
+    return previous.streak + 1
+
+
+def _last_completed_before(
+    session: Session, user_id: str, task_definition_id: str, day: date
+) -> Optional[TaskDayStat]:
+    return session.exec(
+        select(TaskDayStat)
+        .where(
+            TaskDayStat.user_id == user_id,
+            TaskDayStat.task_definition_id == task_definition_id,
+            TaskDayStat.state == STATE_COMPLETED,
+            TaskDayStat.day < day,
+        )
+        .order_by(TaskDayStat.day.desc())
+        .limit(1)
+    ).first()
+
+
+def _restreak_after(
+    session: Session, user_id: str, task_def: TaskDefinition, row: TaskDayStat
+) -> None:
+    # Only back-dated events reach later rows; stop once a streak is unchanged
+    # because every later value follows from its predecessor.
+    gap = streak_gap(task_def)
+    previous = row
+    later = session.exec(
+        select(TaskDayStat)
+        .where(
+            TaskDayStat.user_id == user_id,
+            TaskDayStat.task_definition_id == task_def.id,
+            TaskDayStat.state == STATE_COMPLETED,
+            TaskDayStat.day > row.day,
+        )
+        .order_by(TaskDayStat.day)
+    )
+    for stat in later:
+        streak = _next_streak(previous, stat.day, gap)
+        if streak == stat.streak:
+            break
+        stat.streak = streak
+        session.add(stat)
+        previous = stat
+
+
+def record_task_day(
+    session: Session, user_id: str, task_def: TaskDefinition, day: date, kind: str
+) -> None:
+    state = STATE_COMPLETED if kind == EVENT_COMPLETE else STATE_SKIPPED
+    row = session.get(TaskDayStat, (user_id, task_def.id, day))
+    if row is not None and (row.state == state or row.state == STATE_COMPLETED):
+        return
+
+    completed_delta = 1 if state == STATE_COMPLETED else 0
+    skipped_delta = 1 if state == STATE_SKIPPED else -1 if row is not None else 0
+    if row is None:
+        previous = session.exec(
+            select(TaskDayStat)
+            .where(
+                TaskDayStat.user_id == user_id,
+                TaskDayStat.task_definition_id == task_def.id,
+                TaskDayStat.day < day,
+            )
+            .order_by(TaskDayStat.day.desc())
+            .limit(1)
+        ).first()
+        row = TaskDayStat(
+            user_id=user_id,
+            task_definition_id=task_def.id,
+            day=day,
+            state=state,
+            completed_total=previous.completed_total if previous else 0,
+            skipped_total=previous.skipped_total if previous else 0,
+        )
+    row.state = state
+    row.completed_total += completed_delta
+    row.skipped_total += skipped_delta
+    if state == STATE_COMPLETED:
+        row.streak = _next_streak(
+            _last_completed_before(session, user_id, task_def.id, day), day, streak_gap(task_def)
+        )
+    session.add(row)
+
+    session.exec(
+        update(TaskDayStat)
+        .where(
+            TaskDayStat.user_id == user_id,
+            TaskDayStat.task_definition_id == task_def.id,
+            TaskDayStat.day > day,
+        )
+        .values(
+            completed_total=TaskDayStat.completed_total + completed_delta,
+            skipped_total=TaskDayStat.skipped_total + skipped_delta,
+        )
+    )
+    if state == STATE_COMPLETED:
+        _restreak_after(session, user_id, task_def, row)
+
+
+def record_rotation_use(session: Session, user_id: str, rule_key: str, day: date) -> None:
+    row = session.get(RotationDayStat, (user_id, rule_key, day))
+    if row is None:
+        previous = session.exec(
+            select(RotationDayStat)
+            .where(
+                RotationDayStat.user_id == user_id,
+                RotationDayStat.rule_key == rule_key,
+                RotationDayStat.day < day,
+            )
+            .order_by(RotationDayStat.day.desc())
+            .limit(1)
+        ).first()
+        row = RotationDayStat(
+            user_id=user_id,
+            rule_key=rule_key,
+            day=day,
+            uses_total=previous.uses_total if previous else 0,
+        )
+    row.uses += 1
+    row.uses_total += 1
+    session.add(row)
+    session.exec(
+        update(RotationDayStat)
+        .where(
+            RotationDayStat.user_id == user_id,
+            RotationDayStat.rule_key == rule_key,
+            RotationDayStat.day > day,
+        )
+        .values(uses_total=RotationDayStat.uses_total + 1)
+    )
+
+
+def delete_task_stats(session: Session, user_id: str, task_definition_id: str) -> None:
+    session.exec(
+        delete(TaskDayStat).where(
+            TaskDayStat.user_id == user_id,
+            TaskDayStat.task_definition_id == task_definition_id,
+        )
+    )
+
+
+def _latest(model, owner, column, *criteria):
+    return (
+        select(column)
+        .where(*criteria)
+        .order_by(model.day.desc())
+        .limit(1)
+        .correlate(owner)
+        .scalar_subquery()
+    )
+
+
+def _task_stat_at(column, *criteria):
+    return _latest(
+        TaskDayStat,
+        TaskDefinition,
+        column,
+        TaskDayStat.user_id == TaskDefinition.user_id,
+        TaskDayStat.task_definition_id == TaskDefinition.id,
+        *criteria,
+    )
+
+
+def load_task_stats(
+    session: Session, user_id: str, start_date: date, end_date: date
+) -> List[Dict[str, Any]]:
+    # Running totals make every figure a lookup of the last row at or before
+    # a bound, so the cost does not grow with history.
+    to_bound = TaskDayStat.day <= end_date
+    before_bound = TaskDayStat.day < start_date
+    completed = TaskDayStat.state == STATE_COMPLETED
+    rows = session.exec(
+        select(
+            TaskDefinition,
+            _task_stat_at(TaskDayStat.completed_total, to_bound),
+            _task_stat_at(TaskDayStat.skipped_total, to_bound),
+            _task_stat_at(TaskDayStat.completed_total, before_bound),
+            _task_stat_at(TaskDayStat.skipped_total, before_bound),
+            _task_stat_at(TaskDayStat.day, to_bound, completed),
+            _task_stat_at(TaskDayStat.streak, to_bound, completed),
+        )
+        .where(TaskDefinition.user_id == user_id)
+        .order_by(TaskDefinition.id)
+    ).all()
+
+    stats = []
+    for task_def, *totals, last_day, streak in rows:
+        completed_to, skipped_to, completed_before, skipped_before = (
+            total or 0 for total in totals
+        )
+        done = completed_to - completed_before
+        expected = expected_occurrences(task_def, start_date, end_date)
+        alive = last_day is not None and (end_date - last_day).days <= streak_gap(task_def)
+        stats.append(
+            {
+                "taskDefinitionId": task_def.id,
+                "completed": done,
+                "skipped": skipped_to - skipped_before,
+                "expected": expected,
+                "completionRate": round(min(done / expected, 1.0), 4) if expected else None,
+                "currentStreak": streak if alive else 0,
+            }
+        )
+    return stats
+
+
+def load_rotation_stats(
+    session: Session, user_id: str, start_date: date, end_date: date
+) -> List[Dict[str, Any]]:
+    def total_at(bound):
+        return _latest(
+            RotationDayStat,
+            RuleUsage,
+            RotationDayStat.uses_total,
+            RotationDayStat.user_id == RuleUsage.user_id,
+            RotationDayStat.rule_key == RuleUsage.rule_key,
+            bound,
+        )
+
+    rows = session.exec(
+        select(
+            RuleUsage.rule_key,
+            total_at(RotationDayStat.day <= end_date),
+            total_at(RotationDayStat.day < start_date),
+        )
+        .where(RuleUsage.user_id == user_id)
+        .order_by(RuleUsage.rule_key)
+    ).all()
+    return [
+        {"ruleKey": rule_key, "uses": (through_end or 0) - (before_start or 0)}
+        for rule_key, through_end, before_start in rows
+    ]
+
+
+def backfill_task_stats(session: Session) -> None:
+    task_defs = {
+        (task_def.user_id, task_def.id): task_def
+        for task_def in session.exec(select(TaskDefinition))
+    }
+    session.exec(delete(TaskDayStat))
+    events = session.exec(
+        select(
+            TaskEvent.user_id,
+            TaskEvent.task_definition_id,
+            TaskEvent.instance_date,
+            TaskEvent.kind,
+        ).order_by(TaskEvent.user_id, TaskEvent.task_definition_id, TaskEvent.instance_date)
+    )
+    rows = []
+    for key, task_events in groupby(events, key=lambda event: (event[0], event[1])):
+        task_def = task_defs.get(key)
+        if task_def is None:
+            continue
+        states: Dict[date, str] = {}
+        for _, _, day, kind in task_events:
+            if kind == EVENT_COMPLETE or states.get(day) != STATE_COMPLETED:
+                states[day] = STATE_COMPLETED if kind == EVENT_COMPLETE else STATE_SKIPPED
+        completed_total = skipped_total = 0
+        previous: Optional[TaskDayStat] = None
+        for day in sorted(states):
+            row = TaskDayStat(
+                user_id=key[0], task_definition_id=key[1], day=day, state=states[day]
+            )
+            if row.state == STATE_COMPLETED:
+                completed_total += 1
+                row.streak = _next_streak(previous, day, streak_gap(task_def))
+                previous = row
+            else:
+                skipped_total += 1
+            row.completed_total = completed_total
+            row.skipped_total = skipped_total
+            rows.append(row)
+    session.add_all(rows)
+    session.commit()
@@ -0,0 +1,88 @@
+﻿from __future__ import annotations
+
+from itertools import chain
+from typing import Any, Dict, Optional
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session as OrmSession
+from sqlmodel import Session, select
+
+from .models import Product, RulesState, SyncTombstone, TaskDefinition, TaskStatus
+
+TOMBSTONE_TASK_DEFINITION = "taskDefinition"
+
+REVISIONED_MODELS = (Product, TaskDefinition, TaskStatus, RulesState, SyncTombstone)
+
+_TOUCHED_KEY = "sync_touched_rows"
+_REVISIONS_KEY = "sync_revisions"
+
+
+def _is_revisioned(instance: Any) -> bool:
+    return isinstance(instance, REVISIONED_MODELS)
+
+
+@event.listens_for(OrmSession, "before_flush")
+def _track_revisioned_rows(session: OrmSession, flush_context: Any, instances: Any) -> None:
+    # Rows flushed before the version bump are remembered so the bump can
+    # still stamp them; rows flushed after it are stamped right away.
+    revisions = session.info.get(_REVISIONS_KEY, {})
+    touched = session.info.setdefault(_TOUCHED_KEY, {})
+    for instance in chain(session.new, session.dirty):
+        if not _is_revisioned(instance):
+            continue
+        revision = revisions.get(instance.user_id)
+        if revision is None:
+            touched[id(instance)] = instance
+        elif instance.revision != revision:
+            instance.revision = revision
+
+
+@event.listens_for(OrmSession, "after_commit")
+@event.listens_for(OrmSession, "after_rollback")
+def _reset_revision_tracking(session: OrmSession) -> None:
+    session.info.pop(_TOUCHED_KEY, None)
+    session.info.pop(_REVISIONS_KEY, None)
+
+
+def stamp_revisions(session: Session, user_id: str, revision: int) -> None:
+    session.info.setdefault(_REVISIONS_KEY, {})[user_id] = revision
+    touched = session.info.get(_TOUCHED_KEY, {})
+    for instance in chain(touched.values(), session.new, session.dirty):
+        if _is_revisioned(instance) and instance.user_id == user_id:
+            instance.revision = revision
+
+
+def record_task_definition_deleted(
+    session: Session, user_id: str, task_definition_id: str
+) -> None:
+    session.merge(
+        SyncTombstone(
+            user_id=user_id, kind=TOMBSTONE_TASK_DEFINITION, row_id=task_definition_id
+        )
+    )
+
+
+def load_changes(session: Session, user_id: str, since: Optional[int]) -> Dict[str, Any]:
+    floor = -1 if since is None else since
+
+    def changed(model):
+        return session.exec(
+            select(model)
+            .where(model.user_id == user_id, model.revision > floor)
+            .order_by(model.revision)
+        ).all()
+
+    tombstones = changed(SyncTombstone) if since is not None else []
+    deleted_ids = [
+        tombstone.row_id
+        for tombstone in tombstones
+        if tombstone.kind == TOMBSTONE_TASK_DEFINITION
+        and session.get(TaskDefinition, (user_id, tombstone.row_id)) is None
+    ]
+    return {
+        "products": changed(Product),
+        "task_defs": changed(TaskDefinition),
+        "statuses": changed(TaskStatus),
+        "rules_states": changed(RulesState),
+        "deleted_task_definition_ids": deleted_ids,
+    }
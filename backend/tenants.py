@@ -0,0 +1,59 @@
+﻿from __future__ import annotations
+
+import argparse
+import re
+from typing import List, Optional
+
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session
+
+from .cache import STATE_VERSION_ID, init_state_version
+from .config import ALLOWED_TENANTS, DEFAULT_USER_ID, TENANT_AUTO_PROVISION
+from .models import StateVersion
+from .seed import seed_if_needed
+
+TENANT_ID_PATTERN = re.compile(r"[A-Za-z0-9][A-Za-z0-9_.@-]{0,63}")
+
+
+def is_valid_tenant_id(user_id: str) -> bool:
+    return TENANT_ID_PATTERN.fullmatch(user_id) is not None
+
+
+def may_provision(user_id: str) -> bool:
+    return TENANT_AUTO_PROVISION or user_id == DEFAULT_USER_ID or user_id in ALLOWED_TENANTS
+
+
+def tenant_exists(session: Session, user_id: str) -> bool:
+    return session.get(StateVersion, (user_id, STATE_VERSION_ID)) is not None
+
+
+def provision_tenant(session: Session, user_id: str) -> None:
+    try:
+        seed_if_needed(session, user_id)
+        init_state_version(session, user_id)
+    except IntegrityError:
+        # Another worker process seeded the same tenant first.
+        session.rollback()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    from .db import engine
+    from .migrations import init_db
+
+    parser = argparse.ArgumentParser(description="Seed tenants ahead of their first request")
+    parser.add_argument("user_ids", nargs="+")
+    args = parser.parse_args(argv)
+
+    invalid = [user_id for user_id in args.user_ids if not is_valid_tenant_id(user_id)]
+    if invalid:
+        parser.error(f"invalid user ids: {', '.join(invalid)}")
+
+    init_db()
+    with Session(engine) as session:
+        for user_id in args.user_ids:
+            provision_tenant(session, user_id)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
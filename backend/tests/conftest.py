@@ -0,0 +1,24 @@
+﻿import os
+import tempfile
+
+os.environ.setdefault(
+    "DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/routine-test.db"
+)
+# Tests create tenants freely; test_tenants covers the restricted default.
+os.environ.setdefault("TENANT_AUTO_PROVISION", "1")
+# Metrics are opt-in; turn them on so test_metrics can exercise them.
+os.environ.setdefault("METRICS_ENABLED", "1")
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlmodel import SQLModel
+
+from backend.db import engine
+from backend.main import app
+
+
+@pytest.fixture
+def client():
+    SQLModel.metadata.drop_all(engine)
+    with TestClient(app) as test_client:
+        yield test_client
@@ -0,0 +1,37 @@
+﻿import asyncio
+import json
+from typing import Any, Dict, List
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+
+class FakeProvider:
+    def __init__(self, delay: float = 0.0, failures: List[int] | None = None) -> None:
+        self.delay = delay
+        self.failures = list(failures or [])
+        self.calls = 0
+        self.last_prompt = ""
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.reply: Dict[str, Any] = {
+            "jsonPatch": [{"op": "replace", "path": "/conditions/dry", "value": True}],
+            "summary": "dry on",
+        }
+        self.app = FastAPI()
+        self.app.post("/v1beta/models/{model}:generateContent")(self.generate)
+
+    async def generate(self, model: str, request: Request) -> JSONResponse:
+        self.calls += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            body = await request.json()
+            self.last_prompt = body["contents"][0]["parts"][0]["text"]
+            await asyncio.sleep(self.delay)
+            if self.failures:
+                return JSONResponse({"error": "unavailable"}, status_code=self.failures.pop(0))
+            text = json.dumps(self.reply)
+            return JSONResponse({"candidates": [{"content": {"parts": [{"text": text}]}}]})
+        finally:
+            self.in_flight -= 1
@@ -0,0 +1,143 @@
+﻿import asyncio
+import json
+
+import httpx
+import pytest
+from sqlmodel import Session, select
+
+from backend import ai
+from backend.ai_cache import AiResponseCache, ai_response_cache
+from backend.config import DEFAULT_USER_ID
+from backend.db import engine
+from backend.models import AiCacheEntry
+from backend.tests.fake_provider import FakeProvider
+
+SPEC = {"rules": {}, "conditions": {"dry": False}}
+
+
+@pytest.fixture
+def provider(monkeypatch):
+    def install(**kwargs):
+        fake = FakeProvider(**kwargs)
+        ai.set_ai_transport(httpx.ASGITransport(app=fake.app))
+        return fake
+
+    monkeypatch.setattr(ai, "AI_RETRY_BACKOFF_SECONDS", 0)
+    ai_response_cache.clear()
+    yield install
+    ai.set_ai_transport(None)
+
+
+def test_retries_transient_provider_errors(provider):
+    fake = provider(failures=[503, 429])
+
+    result = asyncio.run(ai.generate_ai_patch("set dry", SPEC, api_key="test"))
+
+    assert result["summary"] == "dry on"
+    assert fake.calls == 3
+
+
+def test_gives_up_after_max_retries(provider):
+    provider(failures=[503] * (ai.AI_MAX_RETRIES + 1))
+
+    with pytest.raises(ai.HTTPException) as excinfo:
+        asyncio.run(ai.generate_ai_patch("set dry", SPEC, api_key="test"))
+
+    assert excinfo.value.status_code == 502
+
+
+def test_concurrent_requests_are_bounded(provider):
+    fake = provider(delay=0.02)
+
+    async def burst():
+        calls = [
+            ai.generate_ai_patch(f"set dry {index}", SPEC, api_key="test") for index in range(12)
+        ]
+        return await asyncio.gather(*calls)
+
+    results = asyncio.run(burst())
+
+    assert len(results) == 12
+    assert fake.max_in_flight <= ai.AI_MAX_CONCURRENCY
+
+
+def test_repeated_instruction_is_served_from_cache(provider):
+    fake = provider()
+
+    first = asyncio.run(ai.generate_ai_patch("set dry", SPEC, api_key="test"))
+    reordered_spec = {"conditions": {"dry": False}, "rules": {}}
+    second = asyncio.run(ai.generate_ai_patch("set dry", reordered_spec, api_key="other"))
+    asyncio.run(ai.generate_ai_patch("set dry", SPEC, api_key="test", model_name="other-model"))
+    asyncio.run(ai.generate_ai_patch("set dry", SPEC, api_key="test", user_id="other"))
+
+    assert first == second
+    assert fake.calls == 3
+    assert ai_response_cache.stats(DEFAULT_USER_ID) == {"hits": 1, "misses": 2, "size": 2}
+    assert ai_response_cache.stats("other") == {"hits": 0, "misses": 1, "size": 1}
+
+
+def test_persisted_cache_survives_restart_until_expiry(client):
+    value = {"jsonPatch": [], "summary": "stored"}
+    asyncio.run(AiResponseCache(maxsize=4, ttl_seconds=0, persist=True).set("t:old", value))
+    asyncio.run(AiResponseCache(maxsize=4, ttl_seconds=60, persist=True).set("t:key", value))
+
+    restarted = AiResponseCache(maxsize=4, ttl_seconds=60, persist=True)
+    expired = AiResponseCache(maxsize=4, ttl_seconds=0, persist=True)
+
+    assert asyncio.run(restarted.get("t:key")) == value
+    assert asyncio.run(expired.get("t:old")) is None
+    assert restarted.stats("t")["hits"] == 1
+    assert expired.stats("t")["misses"] == 1
+
+
+def test_persisted_cache_keeps_only_the_newest_rows(client):
+    cache = AiResponseCache(maxsize=2, ttl_seconds=60, persist=True)
+    for index in range(5):
+        asyncio.run(cache.set(f"t:{index}", {"jsonPatch": [], "summary": str(index)}))
+
+    with Session(engine) as session:
+        keys = set(session.exec(select(AiCacheEntry.key)).all())
+
+    assert keys == {"t:3", "t:4"}
+
+
+def test_server_side_spec_sends_only_relevant_slices(client, provider):
+    fake = provider()
+
+    snapshot = client.get("/api/spec").json()
+    response = client.post(
+        "/api/ai/patch", json={"userInstruction": "민감할 때 비타C 끄기", "apiKey": "test"}
+    )
+
+    assert response.status_code == 200
+    assert response.json()["specVersion"] == snapshot["version"]
+    assert '"rules"' in fake.last_prompt
+    assert '"products"' not in fake.last_prompt
+    assert '"taskDefinitions"' in fake.last_prompt
+    assert '"steps"' not in fake.last_prompt
+
+    client.post(
+        "/api/ai/patch", json={"userInstruction": "세럼 제품 이름 바꿔줘", "apiKey": "test"}
+    )
+    assert '"products"' in fake.last_prompt
+    assert '"steps"' not in fake.last_prompt
+
+
+def test_unmatched_instruction_sends_a_core_slice():
+    spec = {
+        "rules": {"vitc": {"interval_days": 2}},
+        "conditions": {"dry": False},
+        "products": [{"id": "p1", "name": "세럼", "category": "serum"}],
+        "taskDefinitions": [
+            {"id": "skin_am", "slot": "AM", "type": "skincare", "steps": ["wash", "serum"]}
+        ],
+    }
+
+    sliced = ai.select_spec_slices(spec, "비타C를 주 2회로 줄여")
+
+    assert sliced == {
+        "rules": spec["rules"],
+        "conditions": spec["conditions"],
+        "taskDefinitions": [{"id": "skin_am", "slot": "AM", "type": "skincare"}],
+    }
+    assert len(json.dumps(sliced)) < len(json.dumps(spec))
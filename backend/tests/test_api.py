@@ -0,0 +1,369 @@
+﻿from sqlmodel import Session
+
+from backend import catalog
+from backend.cache import bump_state_version
+from backend.db import engine
+from backend.models import Product
+
+
+def test_schedule_matches_today_for_each_day(client):
+    for kind, task_id, day in [
+        ("complete", "skin_am", "2026-01-05"),
+        ("complete", "scalp_scale_day", "2026-01-08"),
+        ("skip", "shower_normal", "2026-01-03"),
+        ("complete", "skin_am", "2026-01-09"),
+        ("skip", "skin_pm", "2026-01-10"),
+    ]:
+        field = "completedAtIso" if kind == "complete" else "skippedAtIso"
+        client.post(
+            f"/api/{kind}",
+            json={"taskInstanceId": f"{task_id}|{day}", field: f"{day}T08:00:00+09:00"},
+        )
+
+    response = client.get("/api/schedule", params={"from": "2026-01-01", "to": "2026-01-14"})
+    assert response.status_code == 200
+    body = response.json()
+    assert body["from"] == "2026-01-01"
+    assert len(body["days"]) == 14
+
+    for day in body["days"]:
+        today = client.get("/api/today", params={"date": day["date"]}).json()
+        assert day["cards"] == today["cards"], day["date"]
+
+
+def test_schedule_rejects_bad_ranges(client):
+    reversed_range = {"from": "2026-01-05", "to": "2026-01-04"}
+    too_long = {"from": "2026-01-01", "to": "2026-12-31"}
+
+    assert client.get("/api/schedule", params=reversed_range).status_code == 400
+    assert client.get("/api/schedule", params=too_long).status_code == 400
+
+
+def test_today_etag_revalidates_until_state_changes(client):
+    params = {"date": "2026-01-04"}
+    first = client.get("/api/today", params=params)
+    etag = first.headers["etag"]
+
+    cached = client.get("/api/today", params=params, headers={"If-None-Match": etag})
+    assert cached.status_code == 304
+
+    card = first.json()["cards"][0]
+    client.post(
+        "/api/complete",
+        json={
+            "taskInstanceId": card["taskInstanceId"],
+            "completedAtIso": "2026-01-04T08:00:00+09:00",
+        },
+    )
+
+    refreshed = client.get("/api/today", params=params, headers={"If-None-Match": etag})
+    assert refreshed.status_code == 200
+    assert refreshed.headers["etag"] != etag
+    assert refreshed.json()["cards"][0]["state"] == "completed"
+
+
+def test_completions_are_kept_per_day(client):
+    for day in ("2026-01-04", "2026-01-05"):
+        client.post(
+            "/api/complete",
+            json={"taskInstanceId": f"skin_am|{day}", "completedAtIso": f"{day}T08:00:00+09:00"},
+        )
+
+    body = client.get("/api/schedule", params={"from": "2026-01-04", "to": "2026-01-05"}).json()
+    am_states = [
+        card["state"] for day in body["days"] for card in day["cards"] if card["slot"] == "AM"
+    ]
+    assert am_states == ["completed", "completed"]
+
+
+def test_days_before_first_completion_stay_due(client):
+    client.post(
+        "/api/complete",
+        json={
+            "taskInstanceId": "skin_am|2026-01-10",
+            "completedAtIso": "2026-01-10T08:00:00+09:00",
+        },
+    )
+
+    def am_state(day):
+        cards = client.get("/api/today", params={"date": day}).json()["cards"]
+        return [card["state"] for card in cards if card["slot"] == "AM"]
+
+    assert [am_state(f"2026-01-{day:02d}") for day in range(6, 11)] == [
+        ["due"],
+        ["due"],
+        ["due"],
+        ["due"],
+        ["completed"],
+    ]
+
+
+def test_rule_changes_recompile_the_plan(client):
+    def am_products():
+        cards = client.get("/api/today", params={"date": "2026-01-04"}).json()["cards"]
+        return [
+            step["products"] for card in cards if card["slot"] == "AM" for step in card["steps"]
+        ]
+
+    before = am_products()
+    client.patch("/api/rules", json={"conditions": {"lazy_mode": True}})
+    assert am_products() == [["allinone_minic_collard_green", "sunscreen_mediheal_madecassoside"]]
+    client.patch("/api/rules", json={"conditions": {"lazy_mode": False}})
+    assert am_products() == before
+
+
+def test_tenants_are_isolated(client):
+    alice = {"X-User-Id": "alice"}
+    bob = {"X-User-Id": "bob"}
+
+    client.post(
+        "/api/complete",
+        json={
+            "taskInstanceId": "skin_am|2026-01-04",
+            "completedAtIso": "2026-01-04T08:00:00+09:00",
+        },
+        headers=alice,
+    )
+    client.patch("/api/rules", json={"conditions": {"sensitive": True}}, headers=alice)
+    client.delete("/api/products/serum_uiq_vita_c", headers=alice)
+
+    def am_state(headers):
+        cards = client.get("/api/today", params={"date": "2026-01-04"}, headers=headers).json()
+        return [card["state"] for card in cards["cards"] if card["slot"] == "AM"]
+
+    assert am_state(alice) == ["completed"]
+    assert am_state(bob) == ["due"]
+    assert client.get("/api/rules", headers=bob).json()["conditions"]["sensitive"] is False
+    bob_products = {product["id"] for product in client.get("/api/products", headers=bob).json()}
+    assert "serum_uiq_vita_c" in bob_products
+
+
+def test_spec_snapshot_is_versioned(client):
+    first = client.get("/api/spec")
+    body = first.json()
+    assert set(body["spec"]) == {"rules", "conditions", "products", "taskDefinitions"}
+
+    unchanged = client.get("/api/spec", headers={"If-None-Match": first.headers["etag"]})
+    assert unchanged.status_code == 304
+
+    client.patch("/api/rules", json={"conditions": {"dry": True}})
+    changed = client.get("/api/spec").json()
+    assert changed["version"] > body["version"]
+    assert changed["spec"]["conditions"]["dry"] is True
+
+
+def test_spec_apply_writes_patch_in_one_version(client):
+    snapshot = client.get("/api/spec").json()
+    products = snapshot["spec"]["products"]
+    first_id = products[0]["id"]
+
+    response = client.post(
+        "/api/spec/apply",
+        json={
+            "specVersion": snapshot["version"],
+            "jsonPatch": [
+                {"op": "replace", "path": "/products/0/name", "value": "Renamed"},
+                {"op": "remove", "path": f"/products/{len(products) - 1}"},
+                {
+                    "op": "add",
+                    "path": "/products/-",
+                    "value": {
+                        "id": "new_cream",
+                        "name": "New",
+                        "category": "cream",
+                        "role": "moisturize",
+                    },
+                },
+                {"op": "replace", "path": "/conditions/dry", "value": True},
+            ],
+        },
+    )
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["changed"] == 4
+    assert body["version"] == snapshot["version"] + 1
+    assert body["spec"]["conditions"]["dry"] is True
+
+    listed = {product["id"]: product for product in client.get("/api/products").json()}
+    assert listed[first_id]["name"] == "Renamed"
+    assert "new_cream" in listed
+    assert products[-1]["id"] not in listed
+
+    stale = client.post(
+        "/api/spec/apply",
+        json={"specVersion": snapshot["version"], "jsonPatch": []},
+    )
+    assert stale.status_code == 409
+
+
+def test_spec_apply_rejects_invalid_patch(client):
+    version = client.get("/api/spec").json()["version"]
+
+    missing = client.post(
+        "/api/spec/apply",
+        json={"jsonPatch": [{"op": "remove", "path": "/products/999"}]},
+    )
+    bad_condition = client.post(
+        "/api/spec/apply",
+        json={"jsonPatch": [{"op": "add", "path": "/conditions/unknown", "value": True}]},
+    )
+
+    assert missing.status_code == 400
+    assert bad_condition.status_code == 400
+    assert client.get("/api/spec").json()["version"] == version
+
+
+def test_event_batch_matches_sequential_replay(client):
+    one_by_one = {"X-User-Id": "one-by-one"}
+    batched = {"X-User-Id": "batched"}
+    days = ["2026-01-04", "2026-01-05", "2026-01-06", "2026-01-07"]
+    events = []
+    for day in days:
+        events.append(("complete", f"skin_am|{day}", f"{day}T08:00:00+09:00"))
+        events.append(("complete", f"skin_pm|{day}", f"{day}T22:00:00+09:00"))
+    events.append(("skip", "skin_am|2026-01-08", "2026-01-08T08:00:00+09:00"))
+
+    for kind, instance_id, at in events:
+        field = "completedAtIso" if kind == "complete" else "skippedAtIso"
+        client.post(
+            f"/api/{kind}",
+            json={"taskInstanceId": instance_id, field: at},
+            headers=one_by_one,
+        )
+
+    response = client.post(
+        "/api/events/batch",
+        json={
+            "events": [
+                {"kind": kind, "taskInstanceId": instance_id, "occurredAtIso": at}
+                for kind, instance_id, at in reversed(events)
+            ]
+        },
+        headers=batched,
+    )
+    assert response.json() == {"ok": True, "applied": len(events)}
+
+    params = {"from": "2026-01-04", "to": "2026-01-12"}
+    expected = client.get("/api/schedule", params=params, headers=one_by_one).json()["days"]
+    actual = client.get("/api/schedule", params=params, headers=batched).json()["days"]
+    assert actual == expected
+
+
+def test_event_batch_is_all_or_nothing(client):
+    response = client.post(
+        "/api/events/batch",
+        json={
+            "events": [
+                {
+                    "kind": "complete",
+                    "taskInstanceId": "skin_am|2026-01-04",
+                    "occurredAtIso": "2026-01-04T08:00:00+09:00",
+                },
+                {
+                    "kind": "complete",
+                    "taskInstanceId": "missing|2026-01-04",
+                    "occurredAtIso": "2026-01-04T09:00:00+09:00",
+                },
+            ]
+        },
+    )
+
+    assert response.status_code == 404
+    cards = client.get("/api/today", params={"date": "2026-01-04"}).json()["cards"]
+    assert [card["state"] for card in cards if card["slot"] == "AM"] == ["due"]
+
+
+def test_products_filter_search_and_paginate(client):
+    everything = client.get("/api/products").json()
+    ampoules = client.get("/api/products", params={"category": "ampoule"}).json()
+    assert ampoules and all(product["category"] == "ampoule" for product in ampoules)
+
+    client.post(
+        "/api/products",
+        json={"id": "zz_search", "name": "Blue Hyaluronic Gel", "category": "gel", "role": "r"},
+    )
+    found = client.get("/api/products", params={"q": "hyalu"}).json()
+    assert "zz_search" in {product["id"] for product in found}
+    client.patch("/api/products/zz_search", json={"name": "Renamed"})
+    assert "zz_search" not in {
+        product["id"] for product in client.get("/api/products", params={"q": "hyalu"}).json()
+    }
+    assert client.get("/api/products", params={"q": 'x" OR *'}).status_code == 200
+
+    pages, cursor = [], None
+    while True:
+        params = {"limit": 3, **({"after": cursor} if cursor else {})}
+        response = client.get("/api/products", params=params)
+        pages.extend(product["id"] for product in response.json())
+        cursor = response.headers.get("x-next-cursor")
+        if cursor is None:
+            break
+    assert pages == sorted(product["id"] for product in everything) + ["zz_search"]
+
+
+def test_product_search_matches_substrings_on_both_paths(client, monkeypatch):
+    client.post(
+        "/api/products",
+        json={"id": "zz_percent", "name": "Vita 100% C_Drop", "category": "serum", "role": "r"},
+    )
+    queries = ["세럼", "시카마", "92세럼", "마누 92", "SERUM", "vita", "100%", "c_d", "장벽", "없는말"]
+
+    def search():
+        return {
+            query: sorted(
+                product["id"]
+                for product in client.get("/api/products", params={"q": query}).json()
+            )
+            for query in queries
+        }
+
+    with engine.connect() as connection:
+        assert catalog.product_search_available(connection)
+        # Short words must not scan the search table shared by every tenant.
+        short = str(catalog.product_name_filter(connection, "default", "세럼"))
+        long = str(catalog.product_name_filter(connection, "default", "시카마"))
+    assert "product_fts" not in short and "product_fts" in long
+    indexed = search()
+    monkeypatch.setattr(catalog, "_search_available", False)
+    assert search() == indexed
+    assert "serum_parnell_cicamanu_92" in indexed["세럼"]
+    assert indexed["100%"] == indexed["c_d"] == ["zz_percent"]
+    assert indexed["없는말"] == []
+
+
+def test_today_expands_referenced_products(client):
+    params = {"date": "2026-01-04"}
+    plain = client.get("/api/today", params=params)
+    assert "products" not in plain.json()
+
+    expanded = client.get("/api/today", params={**params, "expand": "products"})
+    body = expanded.json()
+    assert body["cards"] == plain.json()["cards"]
+    referenced = {
+        product_id
+        for card in body["cards"]
+        for step in card["steps"]
+        for product_id in step["products"]
+    }
+    assert referenced and set(body["products"]) == referenced
+    assert expanded.headers["etag"] != plain.headers["etag"]
+
+    product_id = sorted(referenced)[0]
+    client.patch(f"/api/products/{product_id}", json={"name": "Renamed"})
+    client.delete(f"/api/products/{product_id}")
+    refreshed = client.get("/api/today", params={**params, "expand": "products"}).json()
+    assert refreshed["products"][product_id]["name"] == "Renamed"
+    assert refreshed["products"][product_id]["is_active"] is False
+
+    # A write made by another worker only shows up as a new state version.
+    with Session(engine) as session:
+        product = session.get(Product, ("default", product_id))
+        product.name = "Renamed elsewhere"
+        session.add(product)
+        bump_state_version(session, "default")
+        session.commit()
+    refreshed = client.get("/api/today", params={**params, "expand": "products"}).json()
+    assert refreshed["products"][product_id]["name"] == "Renamed elsewhere"
+
+    assert client.get("/api/today", params={**params, "expand": "tasks"}).status_code == 400
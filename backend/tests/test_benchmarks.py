@@ -0,0 +1,76 @@
+﻿import importlib.util
+import json
+
+import pytest
+
+from backend.benchmarks import run as bench
+from backend.benchmarks.synthetic import make_status_and_history, make_task_definitions, seed_rules
+from backend.rule_plan import compile_rule_plan
+from backend.scheduler import build_range_cards, build_today_cards
+
+needs_benchmark = pytest.mark.skipif(
+    importlib.util.find_spec("pytest_benchmark") is None,
+    reason="pytest-benchmark is not installed",
+)
+
+
+@pytest.fixture(scope="module")
+def scheduler_inputs():
+    rules, conditions = seed_rules()
+    plan = compile_rule_plan(rules, conditions)
+    inputs = {}
+    for size in (10, 1000):
+        task_defs = make_task_definitions(size)
+        status_map, history = make_status_and_history(task_defs, bench.TARGET_DATE, 730)
+        inputs[size] = (task_defs, status_map, history, plan, conditions)
+    return inputs
+
+
+@needs_benchmark
+@pytest.mark.parametrize("size", [10, 1000])
+def test_bench_build_today_cards(benchmark, scheduler_inputs, size):
+    task_defs, status_map, history, plan, conditions = scheduler_inputs[size]
+    cards = benchmark(
+        build_today_cards, task_defs, status_map, plan, conditions, {}, bench.TARGET_DATE, history
+    )
+    assert cards
+
+
+@needs_benchmark
+def test_bench_build_range_cards(benchmark, scheduler_inputs):
+    task_defs, status_map, history, plan, conditions = scheduler_inputs[10]
+    end_date = bench.TARGET_DATE.replace(day=31)
+    days = benchmark(
+        build_range_cards,
+        task_defs,
+        status_map,
+        plan,
+        conditions,
+        {},
+        bench.TARGET_DATE,
+        end_date,
+        project_from=bench.TARGET_DATE,
+        history=history,
+    )
+    assert len(days) == 28
+
+
+@needs_benchmark
+def test_bench_today_endpoint(benchmark, client):
+    response = benchmark(client.get, "/api/today", params={"date": "2026-01-04"})
+    assert response.status_code == 200
+
+
+def test_runner_writes_json(client, tmp_path):
+    output = tmp_path / "bench.json"
+
+    argv = ["--sizes", "10", "--api-sizes", "10", "--history-days", "30", "--range-days", "3"]
+    argv += ["--requests", "3", "--min-seconds", "0", "--seed-products", "20"]
+    argv += ["--due-matrix-tasks", "10"]
+    bench.main(argv + ["--output", str(output)])
+
+    results = json.loads(output.read_text(encoding="utf-8"))
+    assert results["scheduler"][0]["size"] == 10
+    assert results["scheduler"][0]["build_today_cards"]["runs"] >= 1
+    assert set(results["api"][0]["today_uncached"]) == {"p50_ms", "p95_ms", "p99_ms", "max_ms"}
+    assert results["seed_import"]["rows_per_sec"] > 0
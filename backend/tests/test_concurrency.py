@@ -0,0 +1,72 @@
+﻿import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+from backend import main
+from backend.db import engine, to_async_url
+
+
+def test_sqlite_runs_in_wal_mode(client):
+    with engine.connect() as connection:
+        assert connection.exec_driver_sql("PRAGMA journal_mode").scalar() == "wal"
+
+
+def test_async_url_uses_async_drivers():
+    assert to_async_url("sqlite:///routine.db") == "sqlite+aiosqlite:///routine.db"
+    assert (
+        to_async_url("postgresql://user:pw@db/routine")
+        == "postgresql+asyncpg://user:pw@db/routine"
+    )
+
+
+def test_concurrent_complete_and_today_do_not_lock(client):
+    start = date(2026, 1, 1)
+
+    def complete(offset: int) -> int:
+        day = (start + timedelta(days=offset % 30)).isoformat()
+        task_id = ("skin_am", "skin_pm", "shower_normal")[offset % 3]
+        response = client.post(
+            "/api/complete",
+            json={
+                "taskInstanceId": f"{task_id}|{day}",
+                "completedAtIso": f"{day}T09:00:00+09:00",
+            },
+            headers={"X-User-Id": f"user-{offset % 4}"},
+        )
+        return response.status_code
+
+    def today(offset: int) -> int:
+        day = (start + timedelta(days=offset % 30)).isoformat()
+        response = client.get(
+            "/api/today", params={"date": day}, headers={"X-User-Id": f"user-{offset % 4}"}
+        )
+        return response.status_code
+
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        futures = [pool.submit(complete if i % 2 else today, i) for i in range(200)]
+        statuses = [future.result() for future in futures]
+
+    assert statuses == [200] * len(statuses)
+
+
+def test_slow_card_build_does_not_block_other_requests(client, monkeypatch):
+    client.get("/api/time")
+    started = threading.Event()
+    build_today_cards = main.build_today_cards
+
+    def slow_build(**inputs):
+        started.set()
+        time.sleep(1.0)
+        return build_today_cards(**inputs)
+
+    monkeypatch.setattr(main, "build_today_cards", slow_build)
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        slow = pool.submit(client.get, "/api/today", params={"date": "2026-02-01"})
+        assert started.wait(5)
+        began = time.perf_counter()
+        assert client.get("/api/time").status_code == 200
+        elapsed = time.perf_counter() - began
+        assert slow.result().status_code == 200
+    assert elapsed < 0.5
+
@@ -0,0 +1,73 @@
+﻿from datetime import date
+
+from sqlmodel import Session, select
+
+from backend.cache import today_cache
+from backend.daily_plans import run_daily_plans
+from backend.db import engine
+from backend.models import DailyPlan, StateVersion
+
+PLAN_DATE = date(2026, 1, 5)
+TENANTS = ["plan-a", "plan-b", "plan-c"]
+
+
+def _plans():
+    with Session(engine) as session:
+        plans = session.exec(select(DailyPlan).order_by(DailyPlan.user_id)).all()
+        return {plan.user_id: (plan.state_version, plan.cards, plan.etag) for plan in plans}
+
+
+def test_daily_plans_cover_every_tenant_and_are_served(client):
+    for user_id in TENANTS:
+        client.get("/api/time", headers={"X-User-Id": user_id})
+        client.get("/api/rules", headers={"X-User-Id": user_id})
+    chunks = []
+
+    summary = run_daily_plans(PLAN_DATE, workers=1, chunk_size=2, on_chunk=chunks.append)
+
+    with Session(engine) as session:
+        tenant_count = len(session.exec(select(StateVersion)).all())
+    assert summary["tenants"] == tenant_count == sum(chunk["tenants"] for chunk in chunks)
+    assert [chunk["chunk"] for chunk in chunks] == list(range(summary["chunks"]))
+
+    params = {"date": PLAN_DATE.isoformat()}
+    headers = {"X-User-Id": "plan-a"}
+    version, cards, etag = _plans()["plan-a"]
+    live = client.get("/api/today", params=params, headers=headers)
+    assert live.json()["cards"] == cards
+    assert live.headers["etag"] == etag
+
+    with Session(engine) as session:
+        plan = session.get(DailyPlan, ("plan-a", PLAN_DATE))
+        plan.cards = []
+        session.add(plan)
+        session.commit()
+    today_cache.clear()
+    assert client.get("/api/today", params=params, headers=headers).json()["cards"] == []
+
+    card = cards[0]
+    client.post(
+        "/api/skip",
+        json={
+            "taskInstanceId": card["taskInstanceId"],
+            "skippedAtIso": "2026-01-05T08:00:00+09:00",
+        },
+        headers=headers,
+    )
+    refreshed = client.get("/api/today", params=params, headers=headers).json()["cards"]
+    assert refreshed[0]["state"] == "skipped"
+
+
+def test_process_pool_matches_inline_run(client):
+    for user_id in TENANTS:
+        client.get("/api/rules", headers={"X-User-Id": user_id})
+
+    run_daily_plans(PLAN_DATE, workers=1, chunk_size=2)
+    inline = {user_id: plan[1] for user_id, plan in _plans().items()}
+    with Session(engine) as session:
+        session.exec(DailyPlan.__table__.delete())
+        session.commit()
+
+    summary = run_daily_plans(PLAN_DATE, workers=2, chunk_size=1)
+    assert summary["chunks"] == len(inline)
+    assert {user_id: plan[1] for user_id, plan in _plans().items()} == inline
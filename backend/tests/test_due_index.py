@@ -0,0 +1,127 @@
+﻿from datetime import date, datetime, timedelta, timezone
+
+from sqlmodel import Session, SQLModel, create_engine, select
+
+from backend.db import engine
+from backend.due_index import (
+    backfill_due_projection,
+    load_candidate_tasks,
+    weekday_mask,
+    weekdays_between,
+)
+from backend.history import load_task_history
+from backend.models import TaskDefinition, TaskEvent, TaskStatus
+from backend.schedule_inputs import get_rule_plan, get_rule_usage, get_rules_state
+from backend.scheduler import build_today_cards, card_to_dict
+
+START = date(2026, 1, 1)
+
+
+def _full_scan_cards(user_id, target_date):
+    with Session(engine) as session:
+        task_defs = session.exec(
+            select(TaskDefinition)
+            .where(TaskDefinition.user_id == user_id)
+            .order_by(TaskDefinition.id)
+        ).all()
+        statuses = session.exec(select(TaskStatus).where(TaskStatus.user_id == user_id)).all()
+        rules_state = get_rules_state(session, user_id)
+        cards = build_today_cards(
+            task_defs,
+            {status.task_definition_id: status for status in statuses},
+            get_rule_plan(rules_state),
+            rules_state.conditions,
+            get_rule_usage(session, user_id),
+            target_date,
+            load_task_history(session, user_id, target_date, target_date),
+        )
+        return [card_to_dict(card) for card in cards]
+
+
+def test_weekday_masks():
+    assert weekday_mask([0, 6, 9, None]) == 0b1000001
+    assert weekday_mask(None) == 0
+    assert weekdays_between(date(2026, 1, 5), date(2026, 1, 6)) == 0b11
+    assert weekdays_between(START, START + timedelta(days=6)) == 0b1111111
+
+
+def test_candidate_tasks_match_full_scan(client):
+    headers = {"X-User-Id": "due-index"}
+    for task_id, slot, interval, weekdays in [
+        ("every_3", "SCALP", 3, None),
+        ("every_5", "SCALP", 5, None),
+        ("mon_thu", "SUPP", None, [0, 3]),
+        ("weekend", "SHOWER", None, [5, 6]),
+    ]:
+        client.post(
+            "/api/tasks",
+            json={
+                "id": task_id,
+                "slot": slot,
+                "type": "care",
+                "steps": [],
+                "interval_days": interval,
+                "cron_weekdays": weekdays,
+            },
+            headers=headers,
+        )
+
+    completions = [("every_3", 3), ("every_5", 1), ("mon_thu", 4), ("every_3", 10), ("every_3", 6)]
+    for task_id, offset in completions:
+        day = (START + timedelta(days=offset)).isoformat()
+        client.post(
+            "/api/complete",
+            json={"taskInstanceId": f"{task_id}|{day}", "completedAtIso": f"{day}T09:00:00+09:00"},
+            headers=headers,
+        )
+    client.post(
+        "/api/skip",
+        json={"taskInstanceId": "every_5|2026-01-08", "skippedAtIso": "2026-01-08T09:00:00+09:00"},
+        headers=headers,
+    )
+    client.patch("/api/tasks/every_5", json={"interval_days": 2}, headers=headers)
+
+    for offset in range(-2, 20):
+        day = START + timedelta(days=offset)
+        cards = client.get("/api/today", params={"date": day.isoformat()}, headers=headers)
+        assert cards.json()["cards"] == _full_scan_cards("due-index", day), day
+
+    with Session(engine) as session:
+        task_defs, status_map = load_candidate_tasks(
+            session, "due-index", date(2026, 1, 13), date(2026, 1, 13)
+        )
+    assert "every_3" not in {task_def.id for task_def in task_defs}
+    assert status_map["every_5"].next_due_date == date(2026, 1, 4)
+
+
+def test_backfill_sets_projection_from_history(tmp_path):
+    legacy = create_engine(f"sqlite:///{tmp_path / 'backfill.db'}")
+    SQLModel.metadata.create_all(legacy)
+    occurred_at = datetime(2026, 1, 9, tzinfo=timezone.utc)
+    with Session(legacy) as session:
+        session.add(TaskDefinition(id="every_3", slot="SCALP", task_type="care", interval_days=3))
+        session.add(TaskDefinition(id="weekly", slot="SUPP", task_type="care", cron_weekdays=[2]))
+        session.add(TaskStatus(task_definition_id="every_3", last_completed_at=occurred_at))
+        session.add(TaskStatus(task_definition_id="weekly", last_completed_at=occurred_at))
+        session.add(
+            TaskEvent(
+                task_definition_id="every_3",
+                kind="complete",
+                instance_date=date(2026, 1, 7),
+                occurred_at=occurred_at,
+            )
+        )
+        session.commit()
+        session.exec(TaskDefinition.__table__.update().values(weekday_mask=0))
+        session.commit()
+
+        backfill_due_projection(session)
+
+        every_3 = session.get(TaskStatus, ("default", "every_3"))
+        assert (every_3.completed_through, every_3.next_due_date) == (
+            date(2026, 1, 7),
+            date(2026, 1, 10),
+        )
+        weekly = session.get(TaskStatus, ("default", "weekly"))
+        assert (weekly.completed_through, weekly.next_due_date) == (date(2026, 1, 9), None)
+        assert session.get(TaskDefinition, ("default", "weekly")).weekday_mask == 0b100
@@ -0,0 +1,41 @@
+﻿from backend.metrics import MetricsRegistry, RequestMetrics, registry, timed
+
+
+def test_today_reports_server_timing_and_prometheus_metrics(client):
+    registry.clear()
+
+    response = client.get("/api/today", params={"date": "2026-01-04"})
+
+    server_timing = response.headers["server-timing"]
+    names = {entry.split(";")[0] for entry in server_timing.split(", ")}
+    assert names == {"total", "db", "scheduler", "serialize"}
+    assert 'queries"' in server_timing
+
+    text = client.get("/api/metrics").text
+    assert 'routine_request_duration_seconds_count{method="GET",route="/api/today"} 1' in text
+    assert 'routine_db_queries_total{method="GET",route="/api/today"}' in text
+    assert 'routine_scheduler_seconds_total{method="GET",route="/api/today"}' in text
+
+
+
+def test_stream_is_not_timed(client):
+    registry.clear()
+    response = client.get("/api/stream", params={"date": "bad"})
+
+    assert "server-timing" not in response.headers
+    assert "/api/stream" not in client.get("/api/metrics").text
+
+def test_histogram_buckets_are_cumulative():
+    metrics_registry = MetricsRegistry()
+    metrics_registry.observe("GET", "/x", 0.003, RequestMetrics())
+    metrics_registry.observe("GET", "/x", 0.3, RequestMetrics())
+
+    text = metrics_registry.render()
+    assert 'routine_request_duration_seconds_bucket{method="GET",route="/x",le="0.005"} 1' in text
+    assert 'routine_request_duration_seconds_bucket{method="GET",route="/x",le="0.5"} 2' in text
+    assert 'routine_request_duration_seconds_bucket{method="GET",route="/x",le="+Inf"} 2' in text
+
+
+def test_timed_is_a_no_op_outside_requests():
+    with timed("scheduler"):
+        pass
@@ -0,0 +1,56 @@
+﻿from sqlalchemy import create_engine, inspect, text
+
+from backend.migrations import LATEST_VERSION, current_schema_version, upgrade
+
+
+def _legacy_engine(path):
+    engine = create_engine(f"sqlite:///{path}")
+    with engine.begin() as connection:
+        connection.execute(
+            text(
+                "CREATE TABLE product (id VARCHAR PRIMARY KEY, name VARCHAR, category VARCHAR, "
+                "role VARCHAR, notes VARCHAR, verified JSON, is_active BOOLEAN)"
+            )
+        )
+        connection.execute(
+            text("INSERT INTO product VALUES ('p1', 'n', 'serum', 'r', NULL, '{}', 1)")
+        )
+        connection.execute(
+            text("CREATE TABLE rulesstate (id INTEGER PRIMARY KEY, rules JSON, conditions JSON)")
+        )
+        connection.execute(
+            text("""INSERT INTO rulesstate VALUES (1, '{"hydrationBoost": {}}', '{}')""")
+        )
+    return engine
+
+
+def test_legacy_database_is_migrated_once(tmp_path):
+    engine = _legacy_engine(tmp_path / "legacy.db")
+
+    with engine.begin() as connection:
+        assert upgrade(connection) == LATEST_VERSION
+
+    with engine.connect() as connection:
+        columns = {column["name"] for column in inspect(connection).get_columns("product")}
+        assert {"user_id", "revision"} <= columns
+        assert connection.execute(text("SELECT user_id, category FROM product")).one() == (
+            "default",
+            "ampoule",
+        )
+        rules = connection.execute(text("SELECT rules FROM rulesstate")).scalar_one()
+        assert "autoSeasons" in rules
+        assert current_schema_version(connection) == LATEST_VERSION
+
+    with engine.begin() as connection:
+        connection.execute(text("UPDATE product SET category = 'serum'"))
+        upgrade(connection)
+        assert connection.execute(text("SELECT category FROM product")).scalar_one() == "serum"
+
+
+def test_new_database_starts_at_latest_version(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'new.db'}")
+
+    with engine.begin() as connection:
+        assert upgrade(connection) == LATEST_VERSION
+    with engine.connect() as connection:
+        assert current_schema_version(connection) == LATEST_VERSION
@@ -1,7 +1,18 @@
-﻿from datetime import date
+﻿import json
+from datetime import date
 
+from backend import serialization
+from backend.history import EVENT_COMPLETE, EVENT_SKIP, TaskHistory
 from backend.models import RuleUsage, TaskDefinition, TaskStatus
-from backend.scheduler import build_today_cards, select_am_serum, select_pm_serum
+from backend.rule_plan import clear_rule_plan_cache, compile_rule_plan
+from backend.scheduler import (
+    build_range_cards,
+    build_today_cards,
+    card_from_dict,
+    card_to_dict,
+    select_am_serum,
+    select_pm_serum,
+)
 from backend.seed import RULE_KEY_AM_VITC, RULE_KEY_PM_HIGH_NIACIN
 
 
@@ -37,7 +48,7 @@ def test_slot_prefers_longer_interval():
     )
 
     assert len(cards) == 1
-    assert cards[0]["taskDefinitionId"] == "scalp_scale_day"
+    assert cards[0].taskDefinitionId == "scalp_scale_day"
 
 
 def test_serum_selection_constraints():
@@ -130,4 +141,124 @@ def test_hydration_boost_overrides_default_only():
         target_date=date(2026, 1, 4),
     )
 
-    assert cards[0]["steps"][0]["products"] == ["ampoule_hydration"]
+    assert cards[0].steps[0].products == ["ampoule_hydration"]
+
+
+def test_range_projects_intervals_and_rotation():
+    task_defs = [
+        TaskDefinition(
+            id="scalp_scale_day",
+            slot="SHOWER",
+            task_type="scalp",
+            steps=[],
+            interval_days=2,
+        ),
+        TaskDefinition(
+            id="skin_am",
+            slot="AM",
+            task_type="skincare",
+            steps=[{"step": 1, "action": "apply_serum", "productSelector": "rule_based_serum_am"}],
+            interval_days=1,
+        ),
+    ]
+    rules = {
+        "amSerumRotation": {
+            "default": "serum_default",
+            "vitc": {"productId": "serum_vitc", "interval_days": 2},
+        },
+    }
+
+    days = build_range_cards(
+        task_defs,
+        status_map={},
+        rules=rules,
+        conditions={},
+        rule_usage={},
+        start_date=date(2026, 1, 4),
+        end_date=date(2026, 1, 7),
+        project_from=date(2026, 1, 4),
+    )
+
+    shower_days = [
+        day["date"] for day in days if any(card.slot == "SHOWER" for card in day["cards"])
+    ]
+    am_products = [
+        card.steps[0].products
+        for day in days
+        for card in day["cards"]
+        if card.slot == "AM"
+    ]
+    assert shower_days == ["2026-01-04", "2026-01-06"]
+    assert am_products == [["serum_vitc"], ["serum_default"], ["serum_vitc"], ["serum_default"]]
+
+
+def test_rule_plan_is_compiled_once_per_state():
+    rules = {
+        "amSerumRotation": {
+            "default": "serum_default",
+            "vitc": {
+                "productId": "serum_vitc",
+                "interval_days": 2,
+                "only_if_condition_not": ["sensitive"],
+            },
+        },
+        "hydrationBoost": {"productId": "ampoule", "autoSeasons": ["winter"]},
+    }
+    clear_rule_plan_cache()
+
+    plan = compile_rule_plan(rules, {"sensitive": True}, ("default", 1))
+
+    assert compile_rule_plan(rules, {"sensitive": True}, ("default", 1)) is plan
+    assert compile_rule_plan(rules, {"sensitive": False}, ("default", 2)) is not plan
+    assert compile_rule_plan(rules, {"sensitive": True}) is not plan
+    assert plan.am.rotation.blocked
+    assert plan.am.rotation.only_if_condition_not == frozenset({"sensitive"})
+    assert plan.hydration.auto_seasons == frozenset({"winter"})
+    assert select_am_serum(plan, {}, {}, date(2026, 1, 4)) == "serum_default"
+
+
+def test_history_keeps_past_days_accurate():
+    task_defs = [
+        TaskDefinition(
+            id="scalp_scale_day",
+            slot="SHOWER",
+            task_type="scalp",
+            steps=[],
+            interval_days=4,
+        )
+    ]
+    status_map = {"scalp_scale_day": TaskStatus(task_definition_id="scalp_scale_day")}
+    history = TaskHistory()
+    history.add("scalp_scale_day", EVENT_COMPLETE, date(2026, 1, 1))
+    history.add("scalp_scale_day", EVENT_SKIP, date(2026, 1, 5))
+    history.add("scalp_scale_day", EVENT_COMPLETE, date(2026, 1, 6))
+
+    def states(target_date):
+        cards = build_today_cards(task_defs, status_map, {}, {}, {}, target_date, history)
+        return [card.state for card in cards]
+
+    assert states(date(2026, 1, 1)) == ["completed"]
+    assert states(date(2026, 1, 3)) == []
+    assert states(date(2026, 1, 5)) == ["skipped"]
+    assert states(date(2026, 1, 6)) == ["completed"]
+    assert states(date(2026, 1, 10)) == ["due"]
+
+
+def test_cards_serialize_like_their_dicts(monkeypatch):
+    task_defs = [
+        TaskDefinition(
+            id="skin_am",
+            slot="AM",
+            task_type="skincare",
+            steps=[{"step": 1, "action": "apply_serum", "productSelector": "rule_based_serum_am"}],
+            interval_days=1,
+        )
+    ]
+    rules = {"amSerumRotation": {"default": "serum_default"}}
+    cards = build_today_cards(task_defs, {}, rules, {}, {}, date(2026, 1, 4))
+    as_dicts = [card_to_dict(card) for card in cards]
+
+    assert [card_from_dict(card) for card in as_dicts] == cards
+    assert json.loads(serialization.dumps(cards)) == as_dicts
+    monkeypatch.setattr(serialization, "orjson", None)
+    assert json.loads(serialization.dumps(cards)) == as_dicts
@@ -0,0 +1,88 @@
+﻿import json
+
+import pytest
+from sqlmodel import Session, select
+
+from backend.db import engine
+from backend.models import Product, RulesState, TaskStatus
+from backend.seed import SEED_CHUNK_SIZE, detect_seed_encoding, import_seed, iter_seed
+
+SEED = {
+    "profile": {"name": "테스트", "values": [1.25, 1000000, None, True]},
+    "products": [
+        {"id": f"p{index}", "name": f"제품 {index}", "category": "cream", "role": "r"}
+        for index in range(25)
+    ],
+    "taskDefinitions": [
+        {"id": "t1", "slot": "AM", "type": "skincare", "steps": [], "interval_days": 12345}
+    ],
+    "rules": {"amSerumRotation": {"default": "p0", "vitc": {"productId": "p1"}}},
+}
+
+
+@pytest.mark.parametrize("encoding", ["utf-8", "utf-8-sig", "utf-16", "cp949"])
+def test_iter_seed_streams_sections_across_chunks(tmp_path, encoding):
+    path = tmp_path / "seed.json"
+    path.write_text(json.dumps(SEED, ensure_ascii=False, indent=1), encoding=encoding)
+
+    assert detect_seed_encoding(path) in {encoding, "utf-16"}
+    items = list(iter_seed(path, chunk_size=7))
+
+    assert [value for section, value in items if section == "products"] == SEED["products"]
+    assert dict(items)["profile"] == SEED["profile"]
+    assert dict(items)["taskDefinitions"] == SEED["taskDefinitions"][0]
+    assert dict(items)["rules"] == SEED["rules"]
+
+
+def test_encoding_is_detected_past_a_long_ascii_head(tmp_path):
+    path = tmp_path / "seed.json"
+    products = [
+        {"id": f"p{index}", "name": f"product {index}", "category": "c", "role": "r"}
+        for index in range(2000)
+    ] + [{"id": "korean", "name": "파넬 시카마누 92세럼", "category": "c", "role": "r"}]
+    path.write_text(json.dumps({"products": products}, ensure_ascii=False), encoding="cp949")
+    assert path.stat().st_size > 2 * SEED_CHUNK_SIZE
+
+    assert detect_seed_encoding(path) == "cp949"
+    assert [value for _, value in iter_seed(path)][-1]["name"] == "파넬 시카마누 92세럼"
+
+
+def test_import_seed_bulk_inserts_and_is_idempotent(client, tmp_path):
+    path = tmp_path / "seed.json"
+    path.write_text(json.dumps(SEED), encoding="utf-8")
+
+    with Session(engine) as session:
+        first = import_seed(session, "importer", path, batch_size=10)
+        session.commit()
+        again = import_seed(session, "importer", path, batch_size=10)
+        session.commit()
+
+        products = session.exec(select(Product).where(Product.user_id == "importer")).all()
+        statuses = session.exec(select(TaskStatus).where(TaskStatus.user_id == "importer")).all()
+        rules_state = session.get(RulesState, ("importer", 1))
+
+    assert first == {"products": 25, "taskDefinitions": 1, "rules": 1}
+    assert again == {"products": 0, "taskDefinitions": 0, "rules": 0}
+    assert len(products) == 25 and all(product.is_active for product in products)
+    assert [status.task_definition_id for status in statuses] == ["t1"]
+    assert rules_state.rules == SEED["rules"]
+
+
+def test_import_into_existing_tenant_reaches_sync_and_caches(client, tmp_path):
+    path = tmp_path / "seed.json"
+    path.write_text(json.dumps(SEED), encoding="utf-8")
+    cursor = client.get("/api/sync").json()["cursor"]
+    spec_etag = client.get("/api/spec").headers["etag"]
+
+    with Session(engine) as session:
+        import_seed(session, "default", path)
+        session.commit()
+
+    delta = client.get("/api/sync", params={"since": cursor}).json()
+    assert delta["cursor"] > cursor
+    assert sorted(product["id"] for product in delta["products"]) == sorted(
+        product["id"] for product in SEED["products"]
+    )
+    assert [task["id"] for task in delta["taskDefinitions"]] == ["t1"]
+    assert client.get("/api/spec", headers={"If-None-Match": spec_etag}).status_code == 200
+
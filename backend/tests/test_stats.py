@@ -0,0 +1,79 @@
+﻿from datetime import date, timedelta
+
+from sqlmodel import Session, select
+
+from backend.db import engine
+from backend.models import TaskDayStat
+from backend.stats import backfill_task_stats
+
+HEADERS = {"X-User-Id": "stats"}
+
+
+def _post(client, kind, task_id, day):
+    field = "completedAtIso" if kind == "complete" else "skippedAtIso"
+    response = client.post(
+        f"/api/{kind}",
+        json={"taskInstanceId": f"{task_id}|{day}", field: f"{day}T21:00:00+09:00"},
+        headers=HEADERS,
+    )
+    assert response.status_code == 200
+
+
+def _stats(client, start, end):
+    response = client.get("/api/stats", params={"from": start, "to": end}, headers=HEADERS)
+    assert response.status_code == 200
+    return response.json()
+
+
+def _task(stats, task_id):
+    return next(task for task in stats["tasks"] if task["taskDefinitionId"] == task_id)
+
+
+def test_stats_track_rates_streaks_and_rotations(client):
+    start = date(2026, 3, 1)
+    for offset in (0, 1, 2, 4, 5):
+        _post(client, "complete", "skin_pm", start + timedelta(days=offset))
+    _post(client, "skip", "skin_pm", start + timedelta(days=3))
+    _post(client, "skip", "skin_pm", start + timedelta(days=1))
+
+    week = _task(_stats(client, "2026-03-01", "2026-03-07"), "skin_pm")
+    assert (week["completed"], week["skipped"], week["expected"]) == (5, 1, 7)
+    assert week["completionRate"] == round(5 / 7, 4)
+    assert week["currentStreak"] == 2
+
+    _post(client, "complete", "skin_pm", start + timedelta(days=3))
+    week = _task(_stats(client, "2026-03-01", "2026-03-07"), "skin_pm")
+    assert (week["completed"], week["skipped"], week["currentStreak"]) == (6, 0, 6)
+    assert _task(_stats(client, "2026-03-03", "2026-03-04"), "skin_pm")["completed"] == 2
+    assert _task(_stats(client, "2026-03-10", "2026-03-12"), "skin_pm")["currentStreak"] == 0
+
+    for offset in range(6):
+        _post(client, "complete", "skin_am", start + timedelta(days=offset))
+    rotations = _stats(client, "2026-03-01", "2026-03-31")["rotations"]
+    assert sum(rotation["uses"] for rotation in rotations) > 0
+    assert _stats(client, "2026-04-01", "2026-04-30")["rotations"] == [
+        {"ruleKey": rotation["ruleKey"], "uses": 0} for rotation in rotations
+    ]
+
+    reversed_range = {"from": "2026-03-02", "to": "2026-03-01"}
+    assert client.get("/api/stats", params=reversed_range).status_code == 400
+
+
+def test_backfill_matches_incremental_aggregates(client):
+    start = date(2026, 3, 1)
+    events = [("complete", 0), ("skip", 2), ("complete", 4), ("complete", 2), ("skip", 4)]
+    for kind, offset in events + [("complete", 1)]:
+        _post(client, kind, "scalp_scale_day", start + timedelta(days=offset))
+
+    def snapshot():
+        with Session(engine) as session:
+            rows = session.exec(
+                select(TaskDayStat).where(TaskDayStat.user_id == "stats").order_by(TaskDayStat.day)
+            ).all()
+            return [row.model_dump() for row in rows]
+
+    incremental = snapshot()
+    assert [row["streak"] for row in incremental] == [1, 2, 3, 4]
+    with Session(engine) as session:
+        backfill_task_stats(session)
+    assert snapshot() == incremental
@@ -0,0 +1,75 @@
+﻿import asyncio
+import json
+from datetime import date
+
+from backend.events import StateChangeBroker
+from backend.main import _card_events
+
+
+class FakeRequest:
+    def __init__(self) -> None:
+        self.disconnected = False
+
+    async def is_disconnected(self) -> bool:
+        return self.disconnected
+
+
+def _parse(message):
+    name, data = message.strip().split("\n")
+    return name.removeprefix("event: "), json.loads(data.removeprefix("data: "))
+
+
+def test_stream_emits_diff_after_completion(client):
+    # The stream route provisions the tenant through get_user_id; do it here.
+    client.get("/api/today", params={"date": "2026-01-04"})
+
+    async def scenario():
+        request = FakeRequest()
+        events = _card_events(request, "default", date(2026, 1, 4))
+        name, snapshot = _parse(await events.__anext__())
+        assert name == "snapshot"
+        assert snapshot["cards"]
+        assert all(card["state"] == "due" for card in snapshot["cards"])
+
+        pending = asyncio.ensure_future(events.__anext__())
+        await asyncio.to_thread(
+            client.post,
+            "/api/complete",
+            json={
+                "taskInstanceId": "skin_am|2026-01-04",
+                "completedAtIso": "2026-01-04T08:00:00+09:00",
+            },
+        )
+        name, diff = _parse(await asyncio.wait_for(pending, 5))
+        request.disconnected = True
+        await events.aclose()
+        return snapshot, name, diff
+
+    snapshot, name, diff = asyncio.run(scenario())
+    assert name == "diff"
+    assert diff["version"] > snapshot["version"]
+    assert [card["taskInstanceId"] for card in diff["changed"]] == ["skin_am|2026-01-04"]
+    assert diff["changed"][0]["state"] == "completed"
+    assert diff["removed"] == []
+
+
+def test_stream_rejects_malformed_date(client):
+    assert client.get("/api/stream", params={"date": "bad"}).status_code == 400
+
+
+def test_broker_queues_are_bounded_and_coalesce():
+    async def scenario():
+        broker = StateChangeBroker(queue_size=2)
+        subscription = broker.subscribe("alice")
+        other = broker.subscribe("bob")
+        for version in range(1, 6):
+            broker.publish("alice", version)
+        await asyncio.sleep(0)
+        received = [subscription.queue.get_nowait() for _ in range(subscription.queue.qsize())]
+        broker.unsubscribe(subscription)
+        return received, other.queue.qsize(), broker.subscriber_count("alice")
+
+    received, other_size, remaining = asyncio.run(scenario())
+    assert received == [1, 2]
+    assert other_size == 0
+    assert remaining == 0
@@ -0,0 +1,79 @@
+﻿from sqlalchemy import create_engine, inspect, text
+
+from backend.db import migrate_revision_columns
+
+
+def test_sync_returns_only_rows_changed_after_cursor(client):
+    full = client.get("/api/sync").json()
+    assert full["full"] is True
+    assert full["products"] and full["taskDefinitions"] and full["rules"]
+    cursor = full["cursor"]
+
+    assert client.get("/api/sync", params={"since": cursor}).json()["products"] == []
+
+    client.post(
+        "/api/complete",
+        json={
+            "taskInstanceId": "skin_am|2026-01-04",
+            "completedAtIso": "2026-01-04T08:00:00+09:00",
+        },
+    )
+    client.delete("/api/products/serum_uiq_vita_c")
+    client.delete("/api/tasks/skin_pm")
+
+    delta = client.get("/api/sync", params={"since": cursor}).json()
+    assert delta["full"] is False
+    assert delta["cursor"] == cursor + 3
+    assert [product["id"] for product in delta["products"]] == ["serum_uiq_vita_c"]
+    assert delta["products"][0]["is_active"] is False
+    assert [status["taskDefinitionId"] for status in delta["taskStatuses"]] == ["skin_am"]
+    assert delta["taskDefinitions"] == []
+    assert delta["deletedTaskDefinitionIds"] == ["skin_pm"]
+    assert delta["rules"] is None
+
+    assert client.get("/api/sync", params={"since": cursor + 100}).json()["full"] is True
+
+
+def test_spec_apply_stamps_every_written_row(client):
+    cursor = client.get("/api/sync").json()["cursor"]
+    spec = client.get("/api/spec").json()["spec"]
+    last = len(spec["taskDefinitions"]) - 1
+
+    client.post(
+        "/api/spec/apply",
+        json={
+            "jsonPatch": [
+                {"op": "replace", "path": "/products/0/notes", "value": "changed"},
+                {"op": "remove", "path": f"/taskDefinitions/{last}"},
+                {"op": "replace", "path": "/products/1/notes", "value": "changed"},
+            ]
+        },
+    )
+
+    delta = client.get("/api/sync", params={"since": cursor}).json()
+    assert len(delta["products"]) == 2
+    assert delta["deletedTaskDefinitionIds"] == [spec["taskDefinitions"][last]["id"]]
+
+
+def test_revision_columns_are_added_to_existing_tables(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+    with engine.begin() as connection:
+        connection.execute(
+            text(
+                "CREATE TABLE product (user_id VARCHAR, id VARCHAR, name VARCHAR, "
+                "category VARCHAR, role VARCHAR, notes VARCHAR, verified JSON, "
+                "is_active BOOLEAN, PRIMARY KEY (user_id, id))"
+            )
+        )
+        connection.execute(
+            text("INSERT INTO product VALUES ('default', 'p1', 'n', 'c', 'r', NULL, '{}', 1)")
+        )
+        migrate_revision_columns(connection)
+
+    inspector = inspect(engine)
+    assert "revision" in {column["name"] for column in inspector.get_columns("product")}
+    assert "ix_product_user_revision" in {
+        index["name"] for index in inspector.get_indexes("product")
+    }
+    with engine.connect() as connection:
+        assert connection.execute(text("SELECT revision FROM product")).scalar_one() == 0
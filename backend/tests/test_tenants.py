@@ -0,0 +1,24 @@
+﻿from sqlmodel import Session
+
+from backend import tenants
+from backend.db import engine
+from backend.tenants import tenant_exists
+
+
+def test_unknown_tenants_are_not_provisioned(client, monkeypatch):
+    monkeypatch.setattr(tenants, "TENANT_AUTO_PROVISION", False)
+    monkeypatch.setattr(tenants, "ALLOWED_TENANTS", frozenset({"invited"}))
+
+    def status(user_id):
+        return client.get("/api/rules", headers={"X-User-Id": user_id}).status_code
+
+    assert client.get("/api/rules").status_code == 200
+    assert status("invited") == 200
+    assert status("stranger") == 403
+    assert status("bad id") == 400
+    assert status("x" * 65) == 400
+    with Session(engine) as session:
+        assert not tenant_exists(session, "stranger")
+
+    assert tenants.main(["stranger"]) == 0
+    assert status("stranger") == 200
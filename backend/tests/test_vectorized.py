@@ -0,0 +1,91 @@
+﻿from datetime import date, timedelta
+
+import pytest
+
+np = pytest.importorskip("numpy")
+hypothesis = pytest.importorskip("hypothesis")
+from hypothesis import given, settings
+from hypothesis import strategies as st
+
+from backend.models import TaskDefinition, TaskStatus
+from backend.scheduler import _is_due, _rotation_due, _season_key
+from backend.vectorized import (
+    SEASONS,
+    date_ordinals,
+    due_matrix,
+    interval_column,
+    ordinal_column,
+    rotation_due_matrix,
+    season_indexes,
+    task_columns,
+)
+
+DAYS = st.dates(min_value=date(2024, 1, 1), max_value=date(2027, 12, 31))
+TASKS = st.lists(
+    st.tuples(
+        st.one_of(st.none(), st.integers(min_value=0, max_value=60)),
+        st.one_of(st.none(), st.lists(st.integers(min_value=0, max_value=6), max_size=7)),
+        st.one_of(st.none(), DAYS),
+    ),
+    min_size=1,
+    max_size=20,
+)
+
+
+@settings(max_examples=200, deadline=None)
+@given(TASKS, st.lists(DAYS, min_size=1, max_size=30))
+def test_due_matrix_matches_scalar(tasks, days):
+    task_defs, status_map = [], {}
+    for index, (interval, weekdays, last_completed) in enumerate(tasks):
+        task_id = f"task_{index}"
+        task_defs.append(
+            TaskDefinition(
+                id=task_id,
+                slot="AM",
+                task_type="care",
+                interval_days=interval,
+                cron_weekdays=weekdays,
+            )
+        )
+        status_map[task_id] = TaskStatus(
+            task_definition_id=task_id, last_completed_at=last_completed
+        )
+
+    matrix = due_matrix(*task_columns(task_defs, status_map), date_ordinals(days))
+
+    expected = [
+        [_is_due(task_def, status_map[task_def.id], day) for day in days] for task_def in task_defs
+    ]
+    assert matrix.tolist() == expected
+
+
+@settings(max_examples=200, deadline=None)
+@given(
+    st.lists(
+        st.tuples(
+            st.one_of(st.none(), st.integers(min_value=0, max_value=30)),
+            st.one_of(st.none(), DAYS),
+        ),
+        min_size=1,
+        max_size=10,
+    ),
+    st.lists(DAYS, min_size=1, max_size=30),
+)
+def test_rotation_matrix_matches_scalar(rotations, days):
+    matrix = rotation_due_matrix(
+        interval_column(interval for interval, _ in rotations),
+        ordinal_column(last_used for _, last_used in rotations),
+        date_ordinals(days),
+    )
+
+    expected = [
+        [_rotation_due(last_used, interval, day) for day in days]
+        for interval, last_used in rotations
+    ]
+    assert matrix.tolist() == expected
+
+
+def test_season_indexes_match_scalar():
+    days = [date(2026, 1, 1) + timedelta(days=offset) for offset in range(366)]
+    seasons = [SEASONS[index] for index in season_indexes(date_ordinals(days))]
+    assert seasons == [_season_key(day) for day in days]
@@ -0,0 +1,93 @@
+﻿from __future__ import annotations
+
+from datetime import date
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+try:
+    import numpy as np
+except ImportError as exc:  # pragma: no cover - exercised only without numpy
+    raise ImportError("backend.vectorized requires numpy (pip install numpy)") from exc
+
+from .due_index import weekday_mask
+from .models import TaskDefinition, TaskStatus
+from .scheduler import date_or_none
+
+# Prototype for the benchmark suite: daily plans and /api/schedule still use the
+# scalar scheduler, and tests keep these matrices equal to its answers.
+# Sentinels keep the columns plain int64: ordinals start at 1, and the interval
+# sentinel is only ever compared, never used in arithmetic.
+NEVER = 0
+NO_INTERVAL = np.iinfo(np.int64).min
+
+SEASONS = ("winter", "spring", "summer", "fall")
+# Month index (January = 0) to position in SEASONS, as in scheduler._season_key.
+_SEASON_BY_MONTH = np.array([0, 0, 1, 1, 1, 2, 2, 2, 3, 3, 3, 0], dtype=np.int8)
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+def date_ordinals(dates: Iterable[date]) -> np.ndarray:
+    return np.fromiter((day.toordinal() for day in dates), dtype=np.int64)
+
+
+def interval_column(values: Iterable[Optional[int]]) -> np.ndarray:
+    return np.fromiter(
+        (NO_INTERVAL if value is None else value for value in values), dtype=np.int64
+    )
+
+
+def ordinal_column(values: Iterable[Optional[date]]) -> np.ndarray:
+    return np.fromiter(
+        (NEVER if value is None else value.toordinal() for value in values), dtype=np.int64
+    )
+
+
+def task_columns(
+    task_defs: Sequence[TaskDefinition], status_map: Dict[str, TaskStatus]
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    last_completed: List[Optional[date]] = []
+    for task_def in task_defs:
+        status = status_map.get(task_def.id)
+        last_completed.append(date_or_none(status.last_completed_at) if status else None)
+    return (
+        interval_column(task_def.interval_days for task_def in task_defs),
+        np.fromiter(
+            (weekday_mask(task_def.cron_weekdays) for task_def in task_defs), dtype=np.int64
+        ),
+        ordinal_column(last_completed),
+    )
+
+
+# Rows are tasks and columns are date ordinals. Each cell is what _is_due
+# returns for that date when the last completion does not move.
+def due_matrix(
+    interval_days: np.ndarray,
+    weekday_masks: np.ndarray,
+    last_completed: np.ndarray,
+    dates: np.ndarray,
+) -> np.ndarray:
+    intervals = np.asarray(interval_days, dtype=np.int64)[:, None]
+    last = np.asarray(last_completed, dtype=np.int64)[:, None]
+    days = np.asarray(dates, dtype=np.int64)[None, :]
+
+    interval_due = (last == NEVER) | (last > days) | (days - last >= intervals)
+    weekdays = (days - 1) % 7
+    masks = np.asarray(weekday_masks, dtype=np.int64)[:, None]
+    cron_due = ((masks >> weekdays) & 1) == 1
+    return np.where(intervals != NO_INTERVAL, interval_due, cron_due)
+
+
+def rotation_due_matrix(
+    interval_days: np.ndarray, last_used: np.ndarray, dates: np.ndarray
+) -> np.ndarray:
+    intervals = np.asarray(interval_days, dtype=np.int64)[:, None]
+    last = np.asarray(last_used, dtype=np.int64)[:, None]
+    days = np.asarray(dates, dtype=np.int64)[None, :]
+
+    due = (last == NEVER) | (last == days) | (days - last >= intervals)
+    return due & (intervals != NO_INTERVAL)
+
+
+def season_indexes(dates: np.ndarray) -> np.ndarray:
+    days = (np.asarray(dates, dtype=np.int64) - _EPOCH_ORDINAL).astype("datetime64[D]")
+    months = days.astype("datetime64[M]").astype(np.int64) % 12
+    return _SEASON_BY_MONTH[months]